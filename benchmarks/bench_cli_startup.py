@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+bench_cli_startup.py
+
+Measures the start-to-print time of the sr700api command-line script,
+as Artisan experiences it: one fresh python process per sample.
+Compares the Unix domain socket fast path against the HTTP path.
+
+Requires a running REST server (sr700api startup). Usage:
+    python3 benchmarks/bench_cli_startup.py [-n 50] [params...]
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'sr700api')
+
+
+def time_invocations(argv, env, count):
+    """ Runs the script count times, returns a list of wall times in
+        seconds, and the output of the last run. """
+    times = []
+    output = None
+    for i in range(count):
+        start = time.perf_counter()
+        output = subprocess.run(
+            argv, env=env, stdout=subprocess.PIPE, check=False
+            ).stdout
+        times.append(time.perf_counter() - start)
+    return times, output.decode('utf-8').strip()
+
+
+def report(name, times, output):
+    print("%-12s median %7.1f ms  min %7.1f ms  max %7.1f ms  -> %s" % (
+        name,
+        statistics.median(times) * 1000.0,
+        min(times) * 1000.0,
+        max(times) * 1000.0,
+        output))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=50,
+                        help='number of invocations per mode')
+    parser.add_argument('parameters', nargs='*',
+                        default=['current_temp', 'bean_temp',
+                                 'fan_speed', 'heater_level'],
+                        help='get_multi parameters')
+    args = parser.parse_args()
+
+    argv = [sys.executable, SCRIPT, 'get_multi'] + args.parameters
+    baseline_env = dict(os.environ)
+    http_env = dict(os.environ)
+    http_env['SR700API_SOCKET'] = ''
+
+    # interpreter startup alone, for reference
+    times, output = time_invocations(
+        [sys.executable, '-c', 'pass'], baseline_env, args.n)
+    report('interpreter', times, output)
+    times, output = time_invocations(argv, baseline_env, args.n)
+    report('socket', times, output)
+    socket_median = statistics.median(times)
+    times, output = time_invocations(argv, http_env, args.n)
+    report('http', times, output)
+    print("socket path takes %.0f%% of the http path's time." % (
+        100.0 * socket_median / statistics.median(times)))
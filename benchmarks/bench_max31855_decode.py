@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+bench_max31855_decode.py
+
+Compares MAX31855K frame decoding through the ctypes bitfield union,
+as Max31855kDevice.read() used to do, against decode_frame(), and
+against the numpy decode_frames() for bulk decoding. Also checks that
+all decoders agree, bit for bit, on every frame used.
+
+Usage:
+    python3 benchmarks/bench_max31855_decode.py [-n 200000]
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import ctypes
+import random
+import struct
+import time
+
+from sr700api import max31855kdevice
+from sr700api.max31855kdevice import (
+    Max31855_data, decode_frame, decode_frames)
+
+
+def ctypes_decode(union, bytes_read):
+    """ the decoding path formerly used by Max31855kDevice.read(). """
+    union.bytes = (ctypes.c_ubyte * len(bytes_read))(*bytes_read)
+    return (
+        union.bit_values.thermocouple_temp/4.0,
+        union.bit_values.fault,
+        union.bit_values.int_junc_temp/16.0,
+        union.bit_values.scv_fault,
+        union.bit_values.scg_fault,
+        union.bit_values.oc_fault
+        )
+
+
+def make_frames(count):
+    """ random frames, plus the sign and range edge cases. """
+    edges = [0x00000000, 0xFFFFFFFF, 0x7FFC7FF0, 0x80008000,
+             0x1FFFFFFF, 0x20000000, 0x00007FF0, 0x00008000,
+             0x0001000F, 0xFFFEFFF0]
+    values = edges + [random.getrandbits(32) for i in range(count)]
+    # the Bus Pirate returns a list of ints
+    return [list(struct.pack('>I', v)) for v in values]
+
+
+def bench(name, func, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        func(frame)
+    elapsed = time.perf_counter() - start
+    print("%-22s %8.3f us/frame" % (name, elapsed * 1e6 / len(frames)))
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=200000,
+                        help='number of random frames')
+    args = parser.parse_args()
+    frames = make_frames(args.n)
+    union = Max31855_data()
+
+    # correctness first
+    for frame in frames:
+        expected = ctypes_decode(union, frame)
+        if tuple(decode_frame(frame)) != expected:
+            raise SystemExit("decode_frame mismatch on %r" % (frame,))
+    print("decode_frame matches ctypes on %d frames." % len(frames))
+
+    t_ctypes = bench('ctypes union', lambda f: ctypes_decode(union, f),
+                     frames)
+    t_fast = bench('decode_frame', decode_frame, frames)
+    print("decode_frame speedup: %.1fx" % (t_ctypes / t_fast))
+
+    if max31855kdevice.np is None:
+        print("numpy not installed, skipping decode_frames.")
+    else:
+        buf = b''.join(bytes(f) for f in frames)
+        start = time.perf_counter()
+        decoded = decode_frames(buf)
+        elapsed = time.perf_counter() - start
+        print("%-22s %8.3f us/frame" % (
+            'decode_frames (numpy)', elapsed * 1e6 / len(frames)))
+        for frame, row in zip(frames, decoded.tolist()):
+            if tuple(row) != ctypes_decode(union, frame):
+                raise SystemExit(
+                    "decode_frames mismatch on %r" % (frame,))
+        print("decode_frames matches ctypes on %d frames." % len(frames))
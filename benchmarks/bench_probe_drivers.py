@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+bench_probe_drivers.py
+
+Measures bean probe read latency, one MAX31855K frame read and decoded
+per read(), of each probe driver: the Linux spidev driver, against a
+fake spidev device file and optionally a real /dev/spidevB.C, and the
+Bus Pirate driver when one is plugged in. Checks that the fake device's
+frames are decoded to exactly the samples they were written from, and
+prints the time the SPI clock alone takes to shift a frame at each
+driver's speed.
+
+Usage:
+    python3 benchmarks/bench_probe_drivers.py [-n 10000]
+        [--spidev /dev/spidev0.0] [--spidev-speed 4MHz]
+        [--bus-pirate /dev/ttyUSB0] [--bus-pirate-speed 30kHz]
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sr700api.max31855kdevice import Max31855kDevice, Max31855Sample
+from sr700api import spidevdevice
+
+
+def samples(n):
+    """ a roast-like series of probe samples, at the chip's
+        resolution. """
+    rng = random.Random(700)
+    out = []
+    for i in range(n):
+        tc = 20.0 + 210.0 * i / max(n, 1) + rng.gauss(0.0, 0.3)
+        out.append(Max31855Sample(
+            round(tc * 4.0) / 4.0, 0, round(25.0 * 16.0) / 16.0, 0, 0, 0))
+    return out
+
+
+def time_reads(device, n):
+    """ seconds taken by each of n reads, and what they returned. """
+    times = []
+    results = []
+    clock = time.perf_counter
+    for i in range(n):
+        start = clock()
+        sample = device.read()
+        times.append(clock() - start)
+        results.append(sample)
+    return times, results
+
+
+def clock_time(speed):
+    """ microseconds the SPI clock takes to shift 32 bits. """
+    return 32e6 / spidevdevice.parse_speed(speed)
+
+
+def report(name, speed, times):
+    times = sorted(times)
+    print("%-28s %8s %9.1f %9.1f %9.1f %10.0f" % (
+        name, speed, clock_time(speed),
+        statistics.median(times) * 1e6,
+        times[int(len(times) * 0.99)] * 1e6,
+        len(times) / sum(times)))
+
+
+def measure(name, device, speed, n):
+    if not device.find_connect():
+        print("%-28s not found." % name)
+        return None
+    try:
+        times, results = time_reads(device, n)
+    finally:
+        device.disconnect()
+    report(name, speed, times)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=10000,
+                        help='reads per driver')
+    parser.add_argument('--spidev', help='a real spidev device to read')
+    parser.add_argument('--spidev-speed', default='4MHz')
+    parser.add_argument('--bus-pirate',
+                        help="a Bus Pirate's serial port to read")
+    parser.add_argument('--bus-pirate-speed', default='30kHz')
+    args = parser.parse_args()
+    # the fake device isn't a spidev one, and says so
+    logging.disable(logging.WARNING)
+
+    print("%-28s %8s %9s %9s %9s %10s" % (
+        'driver', 'clock', 'clock us', 'median us', 'p99 us', 'reads/s'))
+    expected = samples(args.n + 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'spidev0.0')
+        spidevdevice.write_fake_device(path, expected)
+        results = measure(
+            'spidev, fake device file',
+            spidevdevice.SpidevMax31855kDevice(
+                path, args.spidev_speed, fake=True),
+            args.spidev_speed, args.n)
+    # find_connect() reads the first frame
+    assert results == expected[1:], "fake device frames decoded wrong"
+    if args.spidev:
+        measure(
+            'spidev, ' + args.spidev,
+            spidevdevice.SpidevMax31855kDevice(
+                args.spidev, args.spidev_speed),
+            args.spidev_speed, args.n)
+    if args.bus_pirate:
+        measure(
+            'Bus Pirate, ' + args.bus_pirate,
+            Max31855kDevice(args.bus_pirate_speed, port=args.bus_pirate),
+            args.bus_pirate_speed, args.n)
+    else:
+        print("%-28s %8s %9.1f   pass --bus-pirate PORT to measure, "
+              "plus three serial round trips" % (
+                  'Bus Pirate', args.bus_pirate_speed,
+                  clock_time(args.bus_pirate_speed)))
+    print("fake device frames decoded to the samples written.")
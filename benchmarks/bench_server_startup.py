@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+bench_server_startup.py
+
+Measures a cold start of the REST server, from launching its process to
+the first valid bean temperature reading, against simulated hardware.
+Compares the launcher's former wait, sleeping for half a second then
+polling the server every 100ms, with the readiness pipe the server now
+reports to (see sr700api.readiness), and prints the server's own
+startup phases. With several roasters and a slow simulated probe, the
+discovery phase shows the probes being looked for concurrently.
+
+Usage:
+    python3 benchmarks/bench_server_startup.py [-n 10] [--asyncio]
+        [--roasters 1] [--latency 0.005]
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import json
+import os
+import select
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+from sr700api import readiness
+
+SERVER_URL = 'http://127.0.0.1:58700/'
+
+
+def launch(module, env, pass_fds=()):
+    return subprocess.Popen(
+        [sys.executable, '-m', module, 'start_server'], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        pass_fds=pass_fds)
+
+
+def wait_polling(session):
+    """ the launcher's former wait, returns True once the server
+        answered. """
+    time.sleep(0.5)
+    for i in range(10):
+        try:
+            session.get(SERVER_URL, timeout=(0.5, 5.0))
+            return True
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    return False
+
+
+def wait_pipe(fd, timeout=15.0):
+    """ the readiness line the server writes to fd, None on timeout. """
+    data = b''
+    deadline = time.monotonic() + timeout
+    while not data.endswith(b'\n'):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        if select.select([fd], [], [], remaining)[0]:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                return None
+            data += chunk
+    return json.loads(data.decode('utf-8'))
+
+
+def first_reading(session, timeout=15.0):
+    """ polls /bean_temp until it returns a valid reading. """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            r = session.get(SERVER_URL + 'bean_temp', timeout=(0.5, 5.0))
+            if r.status_code == 200 and not r.json()['fault']:
+                return r.json()['bean_temp_c']
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError("no valid reading.")
+
+
+def stop(process, session):
+    session.post(
+        SERVER_URL + 'server_shutdown',
+        data={'server_shutdown': 'sr700api'}, timeout=(0.5, 5.0))
+    session.close()
+    process.wait(10.0)
+
+
+def cold_start(module, env, use_pipe):
+    """ seconds from launch to the first valid reading, the reading,
+        whether the launcher saw the server start, and the server's
+        readiness line when reported. """
+    session = requests.Session()
+    message = None
+    start = time.perf_counter()
+    if use_pipe:
+        read_fd, write_fd = os.pipe()
+        env = dict(env)
+        env[readiness.READY_FD_ENV] = str(write_fd)
+        process = launch(module, env, (write_fd,))
+        os.close(write_fd)
+        try:
+            message = wait_pipe(read_fd)
+        finally:
+            os.close(read_fd)
+        ready = message is not None and message['ready']
+    else:
+        process = launch(module, env)
+        ready = wait_polling(session)
+    if not ready and process.poll() is not None:
+        raise RuntimeError("the server didn't start.")
+    # the former launcher gives up after 1.5s, and reports a failed
+    # startup, although the server may come up later
+    value = first_reading(session)
+    elapsed = time.perf_counter() - start
+    stop(process, session)
+    return elapsed, value, ready, message
+
+
+def report(name, times):
+    print("%-8s median %7.1f ms  min %7.1f ms  max %7.1f ms" % (
+        name, statistics.median(times) * 1e3, min(times) * 1e3,
+        max(times) * 1e3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=10,
+                        help='cold starts per method')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='start the asyncio server variant')
+    parser.add_argument('--roasters', type=int, default=1,
+                        help='simulated roasters')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='simulated probe read time, in seconds')
+    args = parser.parse_args()
+    env = dict(os.environ)
+    env.update({
+        'SR700API_BACKEND': 'simulated',
+        'SR700API_SIM_ROASTERS': str(args.roasters),
+        'SR700API_SIM_LATENCY': str(args.latency),
+        'SR700API_SOCKET': '',
+        'SR700API_RECORD_DIR': '',
+    })
+    module = 'sr700api.asyncserver' if args.asyncio else (
+        'sr700api.restserver')
+    try:
+        requests.get(SERVER_URL, timeout=(0.5, 5.0))
+        sys.exit("a server is already running, shut it down first.")
+    except requests.exceptions.ConnectionError:
+        pass
+
+    results = {}
+    phases = []
+    for name, use_pipe in (('polling', False), ('pipe', True)):
+        times = []
+        failed = 0
+        for i in range(args.n):
+            elapsed, value, ready, message = cold_start(
+                module, env, use_pipe)
+            # a valid reading of the simulated probe, above freezing
+            assert float(value) > 0.0, value
+            times.append(elapsed)
+            failed += not ready
+            if message is not None:
+                phases.append(message['timings'])
+        results[name] = times
+        report(name, times)
+        if failed:
+            print("%-8s launcher reported a failed startup %d time(s)." % (
+                name, failed))
+    print("server phases, median: " + ', '.join(
+        '%s %.1f ms' % (phase, 1e3 * statistics.median(
+            p[phase] for p in phases)) for phase in phases[0]))
+    print("the readiness pipe reaches a first reading in %.0f%% of the "
+          "polling time." % (100.0 * statistics.median(results['pipe']) /
+                             statistics.median(results['polling'])))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+bench_units.py
+
+Measures unit conversion and temperature formatting over a long series
+of samples: converting and formatting one value at a time, as the
+resources used to, against the array-aware utils.c_to_f/f_to_c, their
+in-place path, and utils.format_temps. Also checks that every method
+gives exactly the same values and strings.
+
+Usage:
+    python3 benchmarks/bench_units.py [-n 1000000]
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import array
+import random
+import time
+
+from sr700api import utils
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def series(n):
+    """ a roast-like bean temperature series, in degC, with probe noise
+        and the odd value exactly halfway between two tenths. """
+    rng = random.Random(700)
+    values = []
+    for i in range(n):
+        t = 20.0 + 210.0 * (i % 3600) / 3600.0 + rng.gauss(0.0, 0.3)
+        if i % 97 == 0:
+            t = round(t, 1) + 0.05
+        values.append(t)
+    return values
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def per_sample(values):
+    return [utils.c_to_f(v) for v in values]
+
+
+def in_place(buf):
+    return utils.c_to_f(buf, out=buf)
+
+
+def format_each(values):
+    return ["%s" % round(v, 1) for v in values]
+
+
+def format_temp_each(values):
+    return [utils.format_temp(v) for v in values]
+
+
+def report(title, baseline, elapsed, n):
+    print("%-34s %10.1f %10.1f %7.1fx" % (
+        title, elapsed * 1e3, elapsed * 1e9 / n, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=1000000,
+                        help='samples in the series')
+    args = parser.parse_args()
+    n = args.n
+    values = series(n)
+    print("%d samples, numpy %s." % (
+        n, np.__version__ if np is not None else 'not installed'))
+    print("%-34s %10s %10s %8s" % ('', 'ms', 'ns/value', 'speedup'))
+
+    base, expected = timed(per_sample, values)
+    report('c_to_f, one value at a time', base, base, n)
+    elapsed, result = timed(utils.c_to_f, values)
+    assert type(result) is list and result == expected
+    report('c_to_f(list)', base, elapsed, n)
+    buf = array.array('d', values)
+    elapsed, result = timed(in_place, buf)
+    assert list(buf) == expected
+    report('c_to_f(array.array, out=same)', base, elapsed, n)
+    if np is not None:
+        arr = np.array(values)
+        elapsed, result = timed(utils.c_to_f, arr)
+        assert result.tolist() == expected
+        report('c_to_f(ndarray)', base, elapsed, n)
+        elapsed, result = timed(in_place, arr)
+        assert arr.tolist() == expected
+        report('c_to_f(ndarray, out=same)', base, elapsed, n)
+
+    print()
+    base, expected = timed(format_each, values)
+    report('"%s" % round(v, 1)', base, base, n)
+    elapsed, result = timed(format_temp_each, values)
+    assert result == expected
+    report('format_temp(v)', base, elapsed, n)
+    elapsed, result = timed(utils.format_temps, values)
+    assert result == expected
+    report('format_temps(list)', base, elapsed, n)
+    if np is not None:
+        elapsed, result = timed(utils.format_temps, np.array(values))
+        assert result == expected
+        report('format_temps(ndarray)', base, elapsed, n)
+    # whole degrees, as integers, keep their lack of decimals
+    integers = [int(v) for v in values[:1000]]
+    assert format_temp_each(integers) == format_each(integers)
+    assert utils.format_temps(integers) == format_each(integers)
+    if np is not None:
+        assert (utils.format_temps(np.array(integers)) ==
+                format_each(integers))
+    print("all methods gave identical results.")
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+bench_validation.py
+
+Measures the per-request argument handling cost of every PUT/POST
+endpoint: building a reqparse parser and parsing with it, as the
+resources used to do on every request, against the precompiled
+validation schemas they use now. Also checks that both give the same
+arguments, or the same error body, for valid and invalid requests.
+Runs against the simulated backend, no hardware needed.
+
+Usage:
+    python3 benchmarks/bench_validation.py [-n 20000]
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('SR700API_BACKEND', 'simulated')
+os.environ.setdefault('SR700API_SOCKET', '')
+
+from flask_restful import reqparse
+from werkzeug.exceptions import HTTPException
+
+from sr700api import filters
+from sr700api import restserver
+
+TARGET_TEMP_HELP = (
+    'target_temp can be 150..550 deg F.  Note that '
+    'hardware seems to limit this to 520F.')
+STATE_HELP = (
+    'Current state of freshroastsr700 module as a string. Possible '
+    'values: idle, roasting, cooling, sleeping.')
+
+
+def sampler_rate(value):
+    """ reqparse type for /sampler's rate, with its 0.1..50 bounds. """
+    rate = float(value)
+    if not 0.1 <= rate <= 50.0:
+        raise ValueError('rate out of range')
+    return rate
+
+
+# the parsers the resources built in __init__, on every request:
+# endpoint: (argument keyword arguments, strict)
+REQPARSE_ARGS = {
+    '/fan_speed': ([
+        dict(name='fan_speed', type=int, choices=range(1, 10),
+             required=True,
+             help='Fan speed can be 1..9, wheere 1=min, 9=max'),
+    ], False),
+    '/time_remaining': ([
+        dict(name='time_remaining', type=int, choices=range(1, 600),
+             required=True, help='Time remaining can be 1..599 seconds.'),
+    ], False),
+    '/target_temp': ([
+        dict(name='target_temp_c', type=int, choices=range(150, 551),
+             help=TARGET_TEMP_HELP),
+        dict(name='target_temp_f', type=int, choices=range(150, 551),
+             help=TARGET_TEMP_HELP),
+    ], False),
+    '/heater_level': ([
+        dict(name='heater_level', type=int, choices=range(0, 9),
+             required=True,
+             help='Heater Level can be 0..8, wheere 0=off, 8=max'),
+    ], False),
+    '/state': ([
+        dict(name='state', type=str, required=True,
+             choices=('idle', 'roasting', 'cooling', 'sleeping'),
+             help=STATE_HELP),
+    ], False),
+    '/sampler': ([
+        dict(name='rate', type=sampler_rate, location='values',
+             help='rate can be 0.1..50 samples per second.'),
+        dict(name='oversample', type=int, choices=range(1, 33),
+             location='values',
+             help='oversample can be 1..32 frames per sample.'),
+        dict(name='method', type=str, choices=tuple(filters.FILTERS),
+             location='values',
+             help='method can be ' + ', '.join(filters.FILTERS) + '.'),
+    ], False),
+    '/server_shutdown': ([
+        dict(name='server_shutdown', type=str, required=True,
+             help='Used to shutdown a local REST API server instance. ' +
+                  'Must supply valid server shutdown code.'),
+    ], True),
+}
+
+SCHEMAS = {
+    '/fan_speed': restserver.FanSpeed.schema,
+    '/time_remaining': restserver.TimeRemaining.schema,
+    '/target_temp': restserver.TargetTemp.schema,
+    '/heater_level': restserver.HeaterLevel.schema,
+    '/state': restserver.State.schema,
+    '/sampler': restserver.Sampler.schema,
+    '/server_shutdown': restserver.ServerShutdown.schema,
+}
+
+# a valid request body for each endpoint, and invalid ones for checking
+VALID = {
+    '/fan_speed': {'fan_speed': 5},
+    '/time_remaining': {'time_remaining': 120},
+    '/target_temp': {'target_temp_f': 400},
+    '/heater_level': {'heater_level': 8},
+    '/state': {'state': 'roasting'},
+    '/sampler': {'rate': 4.0, 'oversample': 4, 'method': 'median'},
+    '/server_shutdown': {'server_shutdown': 'sr700api'},
+}
+INVALID = {
+    '/fan_speed': [{}, {'fan_speed': 0}, {'fan_speed': 'fast'}],
+    '/time_remaining': [{'time_remaining': 600}],
+    '/target_temp': [{'target_temp_c': 100}, {'target_temp_f': 'hot'}],
+    '/heater_level': [{'heater_level': 9}, {'heater_level': -1}],
+    '/state': [{}, {'state': 'flying'}],
+    '/sampler': [{'oversample': 33}, {'method': 'mean'}, {'rate': 'x'},
+                 {'rate': 0.05}, {'rate': 100}, {'rate': 'nan'}],
+    '/server_shutdown': [{}, {'server_shutdown': 'x', 'extra': 1}],
+}
+
+
+# /sampler's reqparse parser only read the query string and form, so
+# it is compared with form-encoded requests
+FORM = ('/sampler',)
+
+
+def request_context(app, path, body):
+    if path in FORM:
+        return app.test_request_context(path, method='PUT', data=body)
+    return app.test_request_context(path, method='PUT', json=body)
+
+
+def reqparse_parse(path):
+    """ the former per-request work: build the parser, then parse. """
+    arguments, strict = REQPARSE_ARGS[path]
+    parser = reqparse.RequestParser()
+    for kwargs in arguments:
+        parser.add_argument(**kwargs)
+    return parser.parse_args(strict=strict)
+
+
+def schema_parse(path):
+    return restserver.parse_request(SCHEMAS[path])
+
+
+def outcome(func, path):
+    """ the parsed arguments, or the error body. """
+    try:
+        return dict(func(path))
+    except HTTPException as e:
+        # flask_restful answers a bare HTTPException with its description
+        return getattr(e, 'data', {'message': e.description})
+
+
+def bench(func, path, n):
+    start = time.perf_counter()
+    for i in range(n):
+        func(path)
+    return (time.perf_counter() - start) / n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=20000,
+                        help='requests timed per endpoint and method')
+    args = parser.parse_args()
+    app = restserver.app
+
+    # correctness first
+    for path in sorted(VALID):
+        for body in [VALID[path]] + INVALID[path]:
+            with request_context(app, path, body):
+                old = outcome(reqparse_parse, path)
+                new = outcome(schema_parse, path)
+            if old != new:
+                raise SystemExit("%s %r: reqparse gave %r, schema %r" % (
+                    path, body, old, new))
+    print("schemas match reqparse on all %d checked requests." % sum(
+        1 + len(INVALID[p]) for p in VALID))
+
+    print("%-18s %12s %12s %8s" % (
+        'endpoint', 'reqparse us', 'schema us', 'speedup'))
+    total_old = total_new = 0.0
+    for path in sorted(VALID):
+        with request_context(app, path, VALID[path]):
+            t_old = bench(reqparse_parse, path, args.n)
+            t_new = bench(schema_parse, path, args.n)
+        total_old += t_old
+        total_new += t_new
+        print("%-18s %12.2f %12.2f %7.1fx" % (
+            path, t_old * 1e6, t_new * 1e6, t_old / t_new))
+    print("%-18s %12.2f %12.2f %7.1fx" % (
+        'all endpoints', total_old * 1e6, total_new * 1e6,
+        total_old / total_new))
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+loadtest.py
+
+Drives a configurable mix of concurrent GET/PUT traffic against the
+sr700api REST server and reports per-endpoint latency percentiles and
+histograms, throughput and error rates. Results can be saved as JSON
+and compared against a previous run.
+
+Examples:
+    # start a simulated server, poll like Artisan plus a dashboard
+    python3 benchmarks/loadtest.py --start-server --clients 4 \\
+        --duration 20 --output results.json
+
+    # custom mix, METHOD:PATH[:FIELD=VALUE]:WEIGHT
+    python3 benchmarks/loadtest.py \\
+        --mix get:/bean_temp:4,get:/fan_speed:1,put:/heater_level:heater_level=4:1
+
+    # compare with a previous run
+    python3 benchmarks/loadtest.py --start-server --compare results.json
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import bisect
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+# every resource registered in sr700api/restserver.py, except /stream
+# (long-lived) and /server_shutdown. Format: (method, path, body, weight)
+DEFAULT_MIX = (
+    ('GET', '/', None, 1),
+    ('GET', '/bean_temp', None, 4),
+    ('GET', '/current_temp', None, 4),
+    ('GET', '/fan_speed', None, 2),
+    ('GET', '/heater_level', None, 2),
+    ('GET', '/target_temp', None, 1),
+    ('GET', '/time_remaining', None, 1),
+    ('GET', '/state', None, 1),
+    ('GET', '/dummy', None, 1),
+    ('GET', '/snapshot', None, 2),
+    ('GET', '/history?limit=100', None, 1),
+    ('GET', '/sampler', None, 1),
+    ('PUT', '/fan_speed', {'fan_speed': 9}, 1),
+    ('PUT', '/heater_level', {'heater_level': 4}, 1),
+    ('PUT', '/target_temp', {'target_temp_f': 400}, 1),
+    ('PUT', '/time_remaining', {'time_remaining': 590}, 1),
+    ('PUT', '/state', {'state': 'idle'}, 1),
+)
+
+# histogram bucket upper bounds, in milliseconds
+BUCKETS = (
+    0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0,
+    1000.0, 2000.0, 5000.0, float('inf'))
+
+
+def parse_mix(text):
+    """ parses METHOD:PATH[:FIELD=VALUE]:WEIGHT,... into mix tuples. """
+    mix = []
+    for item in text.split(','):
+        parts = item.split(':')
+        if len(parts) not in (3, 4):
+            raise ValueError("bad mix entry %r" % item)
+        method = parts[0].upper()
+        path = parts[1]
+        body = None
+        if len(parts) == 4:
+            field, value = parts[2].split('=', 1)
+            try:
+                value = int(value)
+            except ValueError:
+                pass
+            body = {field: value}
+        mix.append((method, path, body, float(parts[-1])))
+    return tuple(mix)
+
+
+def op_name(op):
+    return op[0] + ' ' + op[1]
+
+
+class Client(threading.Thread):
+    """ One polling client, with its own keep-alive connection. """
+    def __init__(self, host, port, mix, rate, stop_event, seed):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.host = host
+        self.port = port
+        self.ops = [op for op in mix]
+        self.weights = [op[3] for op in mix]
+        self.rate = rate
+        self.stop_event = stop_event
+        self.random = random.Random(seed)
+        # op name -> list of latencies in seconds, and error counts
+        self.latencies = dict((op_name(op), []) for op in mix)
+        self.errors = dict((op_name(op), 0) for op in mix)
+        self.conn = None
+
+    def request(self, op):
+        method, path, body, weight = op
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(
+                    self.host, self.port, timeout=10)
+            try:
+                self.conn.request(method, path, body=data, headers=headers)
+                response = self.conn.getresponse()
+                response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.conn.close()
+                    self.conn = None
+                return response.status
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                # a kept-alive connection may have been closed by the
+                # server; retry once on a fresh one
+                if attempt:
+                    raise
+
+    def run(self):
+        period = 1.0 / self.rate if self.rate else 0.0
+        next_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            op = self.random.choices(self.ops, self.weights)[0]
+            name = op_name(op)
+            start = time.perf_counter()
+            try:
+                status = self.request(op)
+                if status >= 400:
+                    self.errors[name] += 1
+            except (http.client.HTTPException, OSError):
+                self.errors[name] += 1
+            self.latencies[name].append(time.perf_counter() - start)
+            if period:
+                next_time += period
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    self.stop_event.wait(delay)
+                else:
+                    next_time = time.perf_counter()
+        if self.conn is not None:
+            self.conn.close()
+
+
+def percentile(ordered, fraction):
+    """ nearest-rank percentile of an already sorted list. """
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(
+        fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors, duration):
+    """ latency stats in milliseconds, plus histogram and error rate. """
+    ordered = sorted(t * 1000.0 for t in latencies)
+    count = len(ordered)
+    histogram = [0] * len(BUCKETS)
+    for t in ordered:
+        histogram[bisect.bisect_left(BUCKETS, t)] += 1
+    return {
+        'count': count,
+        'errors': errors,
+        'error_rate': float(errors) / count if count else 0.0,
+        'throughput': count / duration,
+        'mean_ms': sum(ordered) / count if count else None,
+        'p50_ms': percentile(ordered, 0.50),
+        'p90_ms': percentile(ordered, 0.90),
+        'p99_ms': percentile(ordered, 0.99),
+        'max_ms': ordered[-1] if ordered else None,
+        'histogram': histogram,
+    }
+
+
+def start_server(url):
+    """ launches a simulated REST server and waits until it answers. """
+    env = dict(os.environ)
+    env['SR700API_BACKEND'] = 'simulated'
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'sr700api.restserver', 'start_server'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    parsed = urllib.parse.urlparse(url)
+    deadline = time.time() + 20.0
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(
+                parsed.hostname, parsed.port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("loadtest - REST server did not start.")
+
+
+def stop_server(proc, url):
+    parsed = urllib.parse.urlparse(url)
+    try:
+        conn = http.client.HTTPConnection(
+            parsed.hostname, parsed.port, timeout=2)
+        conn.request(
+            'POST', '/server_shutdown',
+            body=json.dumps({'server_shutdown': 'sr700api'}),
+            headers={'Content-Type': 'application/json'})
+        conn.getresponse().read()
+        conn.close()
+    except (http.client.HTTPException, OSError):
+        pass
+    try:
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        proc.terminate()
+        proc.wait(5)
+
+
+def fmt(value, spec='%8.2f'):
+    if value is None:
+        return '%8s' % '-'
+    return spec % value
+
+
+def print_report(results):
+    print("%-28s %7s %6s %8s %8s %8s %8s %8s" % (
+        'endpoint', 'count', 'err%', 'req/s', 'p50 ms', 'p90 ms',
+        'p99 ms', 'max ms'))
+    rows = sorted(results['endpoints'].items())
+    rows.append(('TOTAL', results['total']))
+    for name, st in rows:
+        print("%-28s %7d %6.2f %8.1f %s %s %s %s" % (
+            name, st['count'], 100.0 * st['error_rate'], st['throughput'],
+            fmt(st['p50_ms']), fmt(st['p90_ms']), fmt(st['p99_ms']),
+            fmt(st['max_ms'])))
+    print("\nlatency histogram, all endpoints:")
+    histogram = results['total']['histogram']
+    peak = max(histogram) or 1
+    low = 0.0
+    for bound, n in zip(BUCKETS, histogram):
+        label = '%g-%g ms' % (low, bound) if bound != float('inf') else (
+            '>%g ms' % low)
+        print("%16s %7d %s" % (label, n, '#' * int(50.0 * n / peak)))
+        low = bound
+
+
+def print_comparison(results, baseline):
+    print("\ncompared with %s:" % baseline.get('label', 'baseline'))
+    print("%-28s %14s %14s %14s" % (
+        'endpoint', 'p50 ms', 'p99 ms', 'req/s'))
+    names = sorted(set(results['endpoints']) & set(baseline['endpoints']))
+    for name in names + ['TOTAL']:
+        if name == 'TOTAL':
+            new, old = results['total'], baseline['total']
+        else:
+            new, old = results['endpoints'][name], baseline['endpoints'][name]
+        cells = []
+        for key in ('p50_ms', 'p99_ms', 'throughput'):
+            if new[key] is None or not old[key]:
+                cells.append('%14s' % '-')
+            else:
+                cells.append('%8.2f %+4.0f%%' % (
+                    new[key], 100.0 * (new[key] - old[key]) / old[key]))
+        print("%-28s %s" % (name, ' '.join(cells)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='sr700api REST server load test.')
+    parser.add_argument('--url', default='http://127.0.0.1:58700',
+                        help='REST server base URL')
+    parser.add_argument('--start-server', action='store_true',
+                        help='start a server on simulated hardware, and '
+                             'shut it down afterwards')
+    parser.add_argument('--clients', type=int, default=2,
+                        help='number of concurrent clients')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='requests per second per client, '
+                             '0 for as fast as possible')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='test duration, in seconds')
+    parser.add_argument('--warmup', type=float, default=1.0,
+                        help='seconds of traffic before measuring')
+    parser.add_argument('--mix',
+                        help='METHOD:PATH[:FIELD=VALUE]:WEIGHT,... '
+                             'defaults to every resource')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', help='name of this run in the results')
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--compare', help='previous JSON results')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    parsed = urllib.parse.urlparse(args.url)
+    proc = start_server(args.url) if args.start_server else None
+    try:
+        if args.warmup > 0:
+            stop = threading.Event()
+            warm = [Client(parsed.hostname, parsed.port, mix, args.rate,
+                           stop, args.seed + i)
+                    for i in range(args.clients)]
+            for c in warm:
+                c.start()
+            time.sleep(args.warmup)
+            stop.set()
+            for c in warm:
+                c.join()
+        stop = threading.Event()
+        clients = [Client(parsed.hostname, parsed.port, mix, args.rate,
+                          stop, args.seed + 1000 + i)
+                   for i in range(args.clients)]
+        start = time.perf_counter()
+        for c in clients:
+            c.start()
+        time.sleep(args.duration)
+        stop.set()
+        for c in clients:
+            c.join()
+        duration = time.perf_counter() - start
+    finally:
+        if proc is not None:
+            stop_server(proc, args.url)
+
+    endpoints = {}
+    all_latencies = []
+    all_errors = 0
+    for op in mix:
+        name = op_name(op)
+        latencies = []
+        errors = 0
+        for c in clients:
+            latencies.extend(c.latencies[name])
+            errors += c.errors[name]
+        all_latencies.extend(latencies)
+        all_errors += errors
+        endpoints[name] = summarize(latencies, errors, duration)
+    results = {
+        'label': args.label or time.strftime('%Y-%m-%d %H:%M:%S'),
+        'url': args.url,
+        'clients': args.clients,
+        'rate': args.rate,
+        'duration': duration,
+        'python': platform.python_version(),
+        'bucket_bounds_ms': [b if b != float('inf') else None
+                             for b in BUCKETS],
+        'endpoints': endpoints,
+        'total': summarize(all_latencies, all_errors, duration),
+    }
+    print_report(results)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
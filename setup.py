@@ -38,6 +38,14 @@ setup(
         'freshroastsr700>=0.2.4'
         # 'pyBusPirateLite'
     ],
+    extras_require={
+        # vectorized bulk decoding, sr700api.analytics
+        'numpy': ['numpy'],
+        # multi-threaded, keep-alive HTTP server
+        'production': ['cheroot'],
+        # sr700api.asyncserver
+        'asyncio': ['aiohttp'],
+    },
     scripts=['bin/sr700api']
     # This requires git OAuth tokens to run,
     # and requires pip install with --process-dependency-links option
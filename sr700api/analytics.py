@@ -0,0 +1,396 @@
+"""
+analytics.py
+
+Offline analysis of recorded roasts, see recorder.py. A recording is
+loaded as numpy arrays, memory-mapped rather than read, and the rate of
+rise, roast phases, first crack estimate and summary statistics are
+computed on whole arrays at once. A directory of recordings is analyzed
+in parallel by a process pool, and the results compared across roasts.
+Requires numpy.
+
+Run as a script to analyze and compare a directory of recordings:
+    python3 -m sr700api.analytics ~/.sr700api/roasts [--f] [--json]
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import warnings
+
+from sr700api import history
+from sr700api import recorder
+from sr700api import utils
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# seconds over which the rate of rise is measured, and over which the
+# bean temperature is averaged first
+ROR_WINDOW = 30.0
+ROR_SMOOTH = 10.0
+# bean temperature ending the drying phase, degC
+DRY_END_C = 150.0
+# bean temperature range searched for first crack, degC
+FIRST_CRACK_RANGE_C = (185.0, 215.0)
+
+# the numpy layout of recorder.RECORD
+if np is not None:
+    RECORD_DTYPE = np.dtype([
+        ('timestamp', '<f8'),
+        ('bean_temp', '<f4'),
+        ('junc_t', '<f4'),
+        ('current_temp', '<f4'),
+        ('fan_speed', 'i1'),
+        ('heater_level', 'i1'),
+        ('state', 'u1'),
+        ('faults', 'u1'),
+    ])
+else:
+    RECORD_DTYPE = None
+
+ROASTING = history.state_code('roasting')
+COOLING = history.state_code('cooling')
+
+# summary values compared across roasts by compare()
+COMPARE_METRICS = (
+    'roast_time', 'drying_time', 'maillard_time', 'development_time',
+    'development_ratio', 'first_crack_temp_c', 'drop_temp_c',
+    'max_ror', 'mean_heater_level', 'mean_fan_speed')
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("analytics - requires numpy.")
+
+
+def load_session(path):
+    """ Loads a recording as numpy arrays, memory-mapped, so that only
+        what a computation touches is read from disk.
+        Returns:
+            dict with the recording's name and start time, and arrays
+            time (seconds since the start), bean_temp and chamber_temp
+            (degC, NaN if unavailable), fan_speed and heater_level (-1
+            if unavailable), and state (history.STATES indices). """
+    _require_numpy()
+    with recorder.RoastRecording(path) as rec:
+        start = rec.start_time
+        count = len(rec)
+    if count:
+        data = np.memmap(path, dtype=RECORD_DTYPE, mode='r',
+                         offset=recorder.HEADER.size, shape=(count,))
+    else:
+        data = np.zeros(0, dtype=RECORD_DTYPE)
+    return {
+        'name': os.path.basename(path),
+        'start': start,
+        'time': data['timestamp'] - start,
+        'bean_temp': data['bean_temp'].astype(float),
+        'chamber_temp': utils.f_to_c(data['current_temp'].astype(float)),
+        'fan_speed': np.asarray(data['fan_speed']),
+        'heater_level': np.asarray(data['heater_level']),
+        'state': np.asarray(data['state']),
+    }
+
+
+def moving_average(t, values, window):
+    """ The average of values over the trailing window seconds at each
+        time t, skipping NaNs. t must be increasing. """
+    _require_numpy()
+    valid = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    # first sample of each window
+    first = np.searchsorted(t, t - window, side='right')
+    last = np.arange(1, len(t) + 1)
+    n = counts[last] - counts[first]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 0, (sums[last] - sums[first]) / n, np.nan)
+
+
+def rate_of_rise(t, temp, window=ROR_WINDOW, smooth=ROR_SMOOTH):
+    """ The rate of rise of temp, in degrees per minute, at each time t:
+        the change of its smoothed value over the last window seconds,
+        or since the first valid sample early on. NaN where temp is,
+        and over the first half window, too short to be meaningful. """
+    _require_numpy()
+    smoothed = moving_average(t, temp, smooth) if smooth else temp
+    valid = ~np.isnan(smoothed) & ~np.isnan(temp)
+    ror = np.full(len(t), np.nan)
+    if valid.sum() < 2:
+        return ror
+    tv = t[valid]
+    sv = smoothed[valid]
+    lag_t = np.maximum(tv - window, tv[0])
+    span = tv - lag_t
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ror[valid] = np.where(
+            span >= window / 2.0,
+            (sv - np.interp(lag_t, tv, sv)) / span * 60.0, np.nan)
+    return ror
+
+
+def _first(mask):
+    """ index of the first True in mask, or None. """
+    indices = np.flatnonzero(mask)
+    return int(indices[0]) if len(indices) else None
+
+
+def first_crack(t, bean_temp, ror, first, stop):
+    """ Estimates the first crack, between sample indices first and stop,
+        as the steepest fall in the rate of rise while the beans are in
+        FIRST_CRACK_RANGE_C: the moisture flashing off at first crack
+        takes heat from the beans, bending the RoR curve down. Returns
+        the sample index, or None. """
+    low, high = FIRST_CRACK_RANGE_C
+    window = slice(first, stop)
+    candidates = (
+        (bean_temp[window] >= low) & (bean_temp[window] <= high) &
+        ~np.isnan(ror[window]))
+    if candidates.sum() < 3:
+        return None
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.gradient(
+            np.where(np.isnan(ror[window]), 0.0, ror[window]), t[window])
+    slope = np.where(candidates & ~np.isnan(slope), slope, np.inf)
+    index = int(np.argmin(slope))
+    if not slope[index] < 0:
+        return None
+    return first + index
+
+
+def _round(value, digits=1):
+    """ a numpy scalar as a rounded float, None if NaN or missing. """
+    if value is None:
+        return None
+    value = float(value)
+    if value != value:
+        return None
+    return round(value, digits)
+
+
+def _nanstat(func, values):
+    """ func over values, skipping NaNs, None if there are none. """
+    if not len(values) or np.isnan(values).all():
+        return None
+    return func(values)
+
+
+def summarize(session):
+    """ Phases and summary statistics of a loaded recording, as a dict
+        of plain values, None when not available. Times are in seconds
+        from charge, the first roasting sample; temperatures in degC,
+        rates of rise in degC per minute. The roast ends at drop, the
+        first cooling sample, or the last sample if it never cooled. """
+    _require_numpy()
+    t = session['time']
+    bean_temp = session['bean_temp']
+    state = session['state']
+    summary = {'name': session['name'], 'start': session['start'],
+               'samples': len(t)}
+    charge = _first(state == ROASTING)
+    if charge is None:
+        summary['error'] = 'No roasting samples.'
+        return summary
+    drop = _first((state == COOLING) & (np.arange(len(t)) > charge))
+    end = drop if drop is not None else len(t) - 1
+    ror = rate_of_rise(t, bean_temp)
+    smoothed = moving_average(t, bean_temp, ROR_SMOOTH)
+    dry_end = _first(
+        (smoothed >= DRY_END_C) & (np.arange(len(t)) >= charge) &
+        (np.arange(len(t)) <= end))
+    fc = first_crack(t, smoothed, ror, dry_end or charge, end + 1)
+    roast = slice(charge, end + 1)
+
+    def at(index, values):
+        return None if index is None else _round(values[index])
+
+    def elapsed(index):
+        return None if index is None else _round(t[index] - t[charge])
+
+    def between(a, b):
+        if a is None or b is None:
+            return None
+        return _round(t[b] - t[a])
+
+    roast_time = elapsed(end)
+    development = between(fc, end)
+    summary.update({
+        'finished': drop is not None,
+        'roast_time': roast_time,
+        'cooling_time': (
+            between(drop, len(t) - 1) if drop is not None else None),
+        'dry_end_time': elapsed(dry_end),
+        'first_crack_time': elapsed(fc),
+        'drying_time': between(charge, dry_end),
+        'maillard_time': between(dry_end, fc),
+        'development_time': development,
+        'development_ratio': (
+            _round(development / roast_time * 100.0)
+            if development is not None and roast_time else None),
+        'charge_temp_c': at(charge, smoothed),
+        'dry_end_temp_c': at(dry_end, smoothed),
+        'first_crack_temp_c': at(fc, smoothed),
+        'drop_temp_c': at(end, smoothed),
+        'max_bean_temp_c': _round(_nanstat(np.nanmax, bean_temp[roast])),
+        'max_ror': _round(_nanstat(np.nanmax, ror[roast])),
+        'drop_ror': at(end, ror),
+        'drying_ror': _round(_nanstat(
+            np.nanmean, ror[charge:dry_end])) if dry_end else None,
+        'maillard_ror': _round(_nanstat(
+            np.nanmean, ror[dry_end:fc])) if dry_end and fc else None,
+        'development_ror': _round(_nanstat(
+            np.nanmean, ror[fc:end + 1])) if fc else None,
+        'mean_chamber_temp_c': _round(_nanstat(
+            np.nanmean, session['chamber_temp'][roast])),
+        'max_chamber_temp_c': _round(_nanstat(
+            np.nanmax, session['chamber_temp'][roast])),
+    })
+    for name in ('heater_level', 'fan_speed'):
+        values = session[name][roast]
+        values = values[values >= 0]
+        summary['mean_' + name] = (
+            _round(values.mean(), 2) if len(values) else None)
+    return summary
+
+
+def analyze(path):
+    """ summarize(load_session(path)), with any error reported in the
+        summary instead of raised, for use in a process pool. """
+    try:
+        return summarize(load_session(path))
+    except Exception as e:
+        logging.exception("analytics.analyze - failed on %s." % path)
+        return {'name': os.path.basename(path), 'error': str(e)}
+
+
+def analyze_directory(directory, workers=None):
+    """ Summarizes every complete recording in directory, oldest first,
+        in a pool of workers processes, defaulting to one per CPU. """
+    _require_numpy()
+    paths = [os.path.join(directory, name)
+             for name in recorder.list_recordings(directory)
+             if name.endswith(recorder.EXTENSION)]
+    if not paths:
+        return []
+    if workers == 1 or len(paths) == 1:
+        return [analyze(path) for path in paths]
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        # a few chunks per worker, to spread the work without a round
+        # trip per recording
+        return list(pool.map(
+            analyze, paths,
+            chunksize=max(1, len(paths) // (workers * 4))))
+
+
+def compare(summaries, metrics=COMPARE_METRICS):
+    """ Statistics of summary values across roasts.
+        Returns:
+            dict of metric: {'mean', 'std', 'min', 'max', 'count'},
+            over the roasts it is available for. """
+    _require_numpy()
+    table = np.array(
+        [[np.nan if s.get(m) is None else s[m] for m in metrics]
+         for s in summaries if 'error' not in s],
+        dtype=float).reshape(-1, len(metrics))
+    counts = (~np.isnan(table)).sum(axis=0)
+    if not len(table):
+        table = np.full((1, len(metrics)), np.nan)
+    with warnings.catch_warnings():
+        # metrics no roast has, all NaN columns
+        warnings.simplefilter('ignore', RuntimeWarning)
+        stats = {
+            'mean': np.nanmean(table, axis=0),
+            'std': np.nanstd(table, axis=0),
+            'min': np.nanmin(table, axis=0),
+            'max': np.nanmax(table, axis=0),
+        }
+    result = {}
+    for i, metric in enumerate(metrics):
+        result[metric] = dict(
+            (name, _round(values[i], 2)) for name, values in stats.items())
+        result[metric]['count'] = int(counts[i])
+    return result
+
+
+# columns printed by the script: summary key, title, is a temperature
+TABLE = (
+    ('roast_time', 'roast s', False),
+    ('drying_time', 'dry s', False),
+    ('maillard_time', 'maill. s', False),
+    ('development_time', 'dev s', False),
+    ('development_ratio', 'DTR %', False),
+    ('first_crack_temp_c', 'FC', True),
+    ('drop_temp_c', 'drop', True),
+    ('max_ror', 'max RoR', True),
+)
+
+
+def _format(value, temperature, units, delta=False):
+    if value is None:
+        return '-'
+    if temperature and units == 'f':
+        # a rate of rise is a temperature difference, not offset
+        value = value * 1.8 if delta else utils.c_to_f(value)
+    return '%.1f' % value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Analyzes and compares sr700api roast recordings.')
+    parser.add_argument('directory', nargs='?', default=recorder.record_dir(),
+                        help='recordings directory')
+    parser.add_argument('--workers', type=int,
+                        help='analysis processes, defaults to one per CPU')
+    parser.add_argument('--f', action='store_true',
+                        help='temperatures in deg F')
+    parser.add_argument('--json', action='store_true',
+                        help='print summaries and comparison as JSON')
+    args = parser.parse_args()
+    summaries = analyze_directory(args.directory, args.workers)
+    comparison = compare(summaries)
+    if args.json:
+        print(json.dumps(
+            {'roasts': summaries, 'comparison': comparison}, indent=1))
+    else:
+        units = 'f' if args.f else 'c'
+        print('%-30s' % 'roast' + ''.join('%10s' % t for k, t, c in TABLE))
+        for s in summaries:
+            if 'error' in s:
+                print('%-30s %s' % (s['name'], s['error']))
+                continue
+            print('%-30s' % s['name'] + ''.join(
+                '%10s' % _format(s.get(k), c, units, k == 'max_ror')
+                for k, t, c in TABLE))
+        for stat in ('mean', 'std', 'min', 'max'):
+            print('%-30s' % stat + ''.join(
+                '%10s' % _format(
+                    comparison[k][stat], c, units,
+                    k == 'max_ror' or stat == 'std')
+                for k, t, c in TABLE))
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+asyncserver.py
+
+An asyncio variant of the REST server, built on aiohttp, serving the same
+routes and JSON bodies as restserver.py. Requests are handled by a single
+event loop thread, so idle polling and /stream clients cost a socket and
+a coroutine each, not a worker thread. Anything touching the hardware
+runs in a small dedicated thread pool, and the bean probe is read by the
+sampler's own thread, so a slow serial transfer never holds up the loop
+or any unrelated endpoint.
+
+Start with 'python -m sr700api.asyncserver start_server', or
+'sr700api startup --asyncio'.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import signal
+import time
+import freshroastsr700
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+from sr700api import cache
+from sr700api import metrics
+from sr700api import readiness
+from sr700api import recorder
+from sr700api import restserver as rs
+from sr700api import utils
+from sr700api import validation
+
+# threads running hardware access on behalf of request handlers
+DEVICE_WORKERS = 4
+
+NOT_CONNECTED = {'error': 'Hardware not connected.'}
+OUT_OF_RANGE = {'error': 'Could not set requested value. Out of range?'}
+
+
+def json_response(body, status=200):
+    """ a response encoded like flask_restful's, so both servers send
+        byte-identical bodies. """
+    return web.Response(
+        text=json.dumps(body) + '\n', status=status,
+        content_type='application/json')
+
+
+def cached_response(entry, request):
+    """ a response from a cache.CacheEntry, as restserver's
+        cached_response() would send it. """
+    if entry.status != 200:
+        return web.Response(
+            body=entry.body, status=entry.status,
+            content_type='application/json')
+    if cache.etag_matches(entry.etag, request.headers.get('If-None-Match')):
+        rs.response_cache.count_not_modified()
+        return web.Response(status=304, headers={'ETag': entry.etag})
+    return web.Response(
+        body=entry.body, content_type='application/json',
+        headers={'ETag': entry.etag})
+
+
+def parse_fields(value):
+    """ the fields argument of /snapshot and /stream, as a list. """
+    if not value:
+        return rs.SNAPSHOT_FIELDS
+    fields = [f for f in value.split(',') if f]
+    unknown = [f for f in fields if f not in rs.SNAPSHOT_FIELDS]
+    if unknown:
+        raise validation.ValidationError({
+            'message': {
+                'fields': 'Unknown field(s): ' + ', '.join(unknown) + '.'
+            }
+        })
+    return fields
+
+
+def find_roaster(request):
+    """ the roasters.Roaster a request is for, as
+        restserver.find_roaster(), or None if there is no such roaster. """
+    roaster_id = request.match_info.get('roaster_id')
+    if roaster_id is None:
+        return rs.default_roaster
+    return rs.roaster_registry.get(roaster_id)
+
+
+def no_such_roaster(request):
+    return json_response({
+        'error':
+        'No such roaster: ' + request.match_info['roaster_id'] + '.'
+    }, 404)
+
+
+# blocking hardware access, run in the device thread pool
+
+def set_value(roaster, name, value):
+    try:
+        with roaster.lock:
+            setattr(roaster.device_sr700, name, value)
+        rs.response_cache.invalidate(roaster.cache_key(name))
+        return {name: value}, 200
+    except freshroastsr700.exceptions.RoasterValueError:
+        return OUT_OF_RANGE, 400
+
+
+def set_target_temp(roaster, value_c, value_f):
+    if value_f is None:
+        if value_c is not None:
+            value_f = int(round(utils.c_to_f(value_c), 0))
+        else:
+            return {
+                'error': 'Must supply target_temp_c or target_temp_f.'
+            }, 400
+    try:
+        with roaster.lock:
+            roaster.device_sr700.target_temp = value_f
+            value_f = roaster.device_sr700.target_temp
+        rs.response_cache.invalidate(roaster.cache_key('target_temp'))
+        return {
+            'target_temp_f': value_f,
+            'target_temp_c': int(round(utils.f_to_c(value_f), 0))
+        }, 200
+    except freshroastsr700.exceptions.RoasterValueError:
+        return OUT_OF_RANGE, 400
+
+
+def set_state(roaster, state):
+    with roaster.lock:
+        getattr(roaster.device_sr700, rs.STATE_SETTERS[state])()
+    rs.response_cache.invalidate(roaster.cache_key('state'))
+    return {'state': state}, 200
+
+
+def cached_entry(resource, roaster):
+    """ the response_cache entry of a restserver CachedResource. """
+    return rs.response_cache.get(
+        roaster.cache_key(resource.cache_key), resource.cache_token(roaster),
+        lambda: resource.render(roaster))
+
+
+def call_resource(method, *args):
+    """ calls a restserver resource method that takes no request
+        arguments, returns (body, status). """
+    result = method(*args)
+    if isinstance(result, tuple):
+        return result
+    return result, 200
+
+
+if web is not None:
+    @web.middleware
+    async def time_request(request, handler):
+        """ times every request into restserver.request_seconds, as
+            restserver.observe_request(). """
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            resource = request.match_info.route.resource
+            rs.request_seconds.observe(time.perf_counter() - start, (
+                request.method,
+                resource.canonical if resource is not None else 'unmatched',
+                str(status)))
+
+
+class AsyncRestServer(object):
+    """ The aiohttp application, and the thread pool it hands hardware
+        access to. """
+    # resources whose GET takes no arguments, served by calling the
+    # restserver resource itself
+    GET_RESOURCES = (
+        ('/', rs.TestEndpoint),
+        ('/cache_stats', rs.CacheStats),
+        ('/pid', rs.PidControl),
+        ('/profile', rs.RoastProfile),
+        ('/roasts', rs.Roasts),
+        ('/roasters', rs.Roasters),
+    )
+    # handlers of the restserver.ROASTER_RESOURCES, served at the top
+    # level for the default roaster and under /roasters/{roaster_id}/ for
+    # every roaster. A GET reading request arguments, or streaming, is
+    # served by a method of this class, any other by calling the
+    # resource itself, see _roaster_get_handler().
+    ROASTER_GET_HANDLERS = {
+        'snapshot': 'get_snapshot',
+        'history': 'get_history',
+        'stream': 'get_stream',
+    }
+    # a PUT setting one roaster value, checked against the resource's
+    # schema, is served by _put_handler(), any other by these methods
+    ROASTER_PUT_HANDLERS = {
+        'target_temp': 'put_target_temp',
+        'state': 'put_state',
+        'sampler': 'put_sampler',
+        'command': 'put_command',
+    }
+
+    def __init__(self, workers=DEVICE_WORKERS):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='sr700api-device')
+        self._stop = None
+        self._streams = set()
+        self.app = web.Application(
+            middlewares=[time_request] if rs.METRICS else [])
+        self.app.on_shutdown.append(self._close_streams)
+        for path, resource in self.GET_RESOURCES:
+            self.app.router.add_get(path, self._get_handler(resource()))
+        for prefix in ('/', '/roasters/{roaster_id}/'):
+            for name, resource in rs.ROASTER_RESOURCES:
+                if name in self.ROASTER_GET_HANDLERS:
+                    get = getattr(self, self.ROASTER_GET_HANDLERS[name])
+                else:
+                    get = self._roaster_get_handler(resource())
+                self.app.router.add_get(prefix + name, get)
+                if not hasattr(resource, 'put'):
+                    continue
+                if name in self.ROASTER_PUT_HANDLERS:
+                    put = getattr(self, self.ROASTER_PUT_HANDLERS[name])
+                else:
+                    put = self._put_handler(name, resource.schema)
+                self.app.router.add_put(prefix + name, put)
+        self.app.router.add_put('/pid', self.put_pid)
+        self.app.router.add_put('/profile', self.put_profile)
+        self.app.router.add_get('/roasts/{name}', self.get_roast)
+        self.app.router.add_post('/server_shutdown', self.post_shutdown)
+        if rs.METRICS:
+            self.app.router.add_get('/metrics', self.get_metrics)
+
+    async def run_blocking(self, func, *args):
+        """ runs func(*args) in the device thread pool. """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def respond(self, func, *args):
+        body, status = await self.run_blocking(func, *args)
+        return json_response(body, status)
+
+    async def request_args(self, request, schema):
+        """ PUT and POST arguments, checked against a validation.Schema,
+            taken from the JSON body, else from the query string and form,
+            as restserver.request_values(). """
+        source = dict(request.query)
+        if request.content_type == 'application/json':
+            try:
+                body = await request.json()
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                # JSON values take precedence
+                source.update(body)
+        else:
+            source.update(await request.post())
+        return schema.parse(source)
+
+    async def json_field(self, request, name):
+        """ a value of the request's JSON body, as
+            restserver.json_field(). """
+        if request.content_type == 'application/json':
+            try:
+                body = await request.json()
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                return body.get(name)
+        return None
+
+    def _get_handler(self, resource):
+        if isinstance(resource, rs.CachedResource):
+            async def handler(request):
+                entry = await self.run_blocking(
+                    cached_entry, resource, rs.default_roaster)
+                return cached_response(entry, request)
+        else:
+            async def handler(request):
+                return await self.respond(call_resource, resource.get)
+        return handler
+
+    def _roaster_get_handler(self, resource):
+        if isinstance(resource, rs.CachedResource):
+            async def handler(request):
+                roaster = find_roaster(request)
+                if roaster is None:
+                    return no_such_roaster(request)
+                entry = await self.run_blocking(
+                    cached_entry, resource, roaster)
+                return cached_response(entry, request)
+        else:
+            async def handler(request):
+                roaster = find_roaster(request)
+                if roaster is None:
+                    return no_such_roaster(request)
+                return await self.respond(
+                    call_resource, resource.get, roaster.id)
+        return handler
+
+    def _put_handler(self, name, schema):
+        async def handler(request):
+            roaster = find_roaster(request)
+            if roaster is None:
+                return no_such_roaster(request)
+            if not roaster.device_sr700.connected:
+                # as restserver, which returns nothing in this case
+                return json_response(None)
+            try:
+                args = await self.request_args(request, schema)
+            except validation.ValidationError as e:
+                return json_response(e.body, 400)
+            return await self.respond(set_value, roaster, name, args[name])
+        return handler
+
+    async def put_target_temp(self, request):
+        roaster = find_roaster(request)
+        if roaster is None:
+            return no_such_roaster(request)
+        if not roaster.device_sr700.connected:
+            return json_response(None)
+        try:
+            args = await self.request_args(request, rs.TargetTemp.schema)
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        return await self.respond(
+            set_target_temp, roaster, args['target_temp_c'],
+            args['target_temp_f'])
+
+    async def put_state(self, request):
+        roaster = find_roaster(request)
+        if roaster is None:
+            return no_such_roaster(request)
+        if not roaster.device_sr700.connected:
+            return json_response(NOT_CONNECTED, 503)
+        try:
+            args = await self.request_args(request, rs.State.schema)
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        return await self.respond(set_state, roaster, args['state'])
+
+    async def put_sampler(self, request):
+        roaster = find_roaster(request)
+        if roaster is None:
+            return no_such_roaster(request)
+        try:
+            args = await self.request_args(request, rs.Sampler.schema)
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        return await self.respond(
+            call_resource, rs.configure_sampler, roaster,
+            args['rate'], args['oversample'], args['method'])
+
+    async def put_command(self, request):
+        roaster = find_roaster(request)
+        if roaster is None:
+            return no_such_roaster(request)
+        try:
+            args = await self.request_args(request, rs.Command.schema)
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        return await self.respond(rs.apply_command, args, roaster)
+
+    async def put_pid(self, request):
+        try:
+            args = await self.request_args(request, rs.PidControl.schema)
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        segments = await self.json_field(request, 'profile')
+        return await self.respond(rs.configure_pid, args, segments)
+
+    async def put_profile(self, request):
+        try:
+            args = await self.request_args(request, rs.RoastProfile.schema)
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        points = await self.json_field(request, 'points')
+        return await self.respond(rs.configure_profile, args, points)
+
+    async def get_roast(self, request):
+        try:
+            args = rs.RoastExport.schema.parse(request.query)
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        name = request.match_info['name']
+        path = recorder.recording_path(rs.RECORD_DIR, name)
+        if path is None:
+            return json_response(
+                {'error': 'No such roast: ' + name + '.'}, 404)
+        if args['format'] != 'csv':
+            body = await self.run_blocking(
+                recorder.export_artisan, path, args['start'], args['end'],
+                args['units'].upper())
+            return json_response(body)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/csv',
+            'Content-Disposition':
+                'attachment; filename=' + name.split('.')[0] + '.csv',
+        })
+        await response.prepare(request)
+        chunks = recorder.export_csv(path, args['start'], args['end'])
+        try:
+            while True:
+                # the recording is read in the device thread pool
+                chunk = await self.run_blocking(next, chunks, None)
+                if chunk is None:
+                    break
+                await response.write(chunk.encode('utf-8'))
+        finally:
+            chunks.close()
+        await response.write_eof()
+        return response
+
+    async def get_snapshot(self, request):
+        roaster = find_roaster(request)
+        if roaster is None:
+            return no_such_roaster(request)
+        try:
+            args = rs.Snapshot.schema.parse(request.query)
+            fields = parse_fields(args['fields'])
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        if not (roaster.device_bt.is_connected() or
+                roaster.device_sr700.connected):
+            return json_response(NOT_CONNECTED, 503)
+        snap = await self.run_blocking(rs.acquire_snapshot, roaster)
+        return json_response(rs.format_snapshot(snap, fields, args['units']))
+
+    async def get_history(self, request):
+        roaster = find_roaster(request)
+        if roaster is None:
+            return no_such_roaster(request)
+        try:
+            args = rs.History.schema.parse(request.query)
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        if args['limit'] is not None and args['limit'] < 1:
+            return json_response({
+                'message': {'limit': 'limit must be a positive integer.'}
+            }, 400)
+        body = await self.run_blocking(
+            rs.history_body, args['since'], args['limit'], args['units'],
+            roaster)
+        return json_response(body)
+
+    async def get_stream(self, request):
+        roaster = find_roaster(request)
+        if roaster is None:
+            return no_such_roaster(request)
+        try:
+            args = rs.Stream.schema.parse(request.query)
+            fields = parse_fields(args['fields'])
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        units = args['units']
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        sub = roaster.broadcaster.subscribe_async(
+            asyncio.get_running_loop(),
+            min_interval=max(args['interval'], 0.0))
+        self._streams.add(sub)
+        event_id = 0
+        try:
+            await response.prepare(request)
+            # tell the client how long to wait before reconnecting
+            await response.write(b'retry: 1000\n\n')
+            while not sub.closed:
+                snap = await sub.get(timeout=rs.STREAM_HEARTBEAT)
+                if snap is None:
+                    if not sub.closed:
+                        await response.write(b': keep-alive\n\n')
+                    continue
+                body = rs.format_snapshot(snap, fields, units)
+                body['dropped'] = sub.dropped
+                event_id += 1
+                await response.write((
+                    'id: %d\nevent: sample\ndata: %s\n\n' % (
+                        event_id, json.dumps(body))).encode('utf-8'))
+        except (ConnectionError, asyncio.CancelledError):
+            # client went away, or server is shutting down
+            pass
+        finally:
+            sub.close()
+            self._streams.discard(sub)
+        return response
+
+    async def _close_streams(self, app):
+        for sub in list(self._streams):
+            sub.close()
+
+    async def get_metrics(self, request):
+        return web.Response(
+            text=rs.metrics_registry.render(),
+            headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    async def post_shutdown(self, request):
+        try:
+            args = await self.request_args(
+                request, rs.ServerShutdown.schema)
+        except validation.ValidationError as e:
+            return json_response(e.body, 400)
+        if args['server_shutdown'] != 'sr700api':
+            return json_response({
+                'message': {'server_shutdown': 'Incorrect shutdown code.'}
+            }, 400)
+        if self._stop is None:
+            return json_response({'server_shutdown': 'fail'})
+        # let this response go out before the server stops
+        asyncio.get_running_loop().call_soon(self._stop.set)
+        return json_response({'server_shutdown': 'ok', 'pid': os.getpid()})
+
+    async def serve(self, host='127.0.0.1', port=rs.SERVER_PORT,
+                    on_ready=None):
+        """ Serves until /server_shutdown, SIGINT or SIGTERM. on_ready, if
+            given, is called once listening. """
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self._stop.set)
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        try:
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            if on_ready is not None:
+                on_ready()
+            await self._stop.wait()
+        finally:
+            await runner.cleanup()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            self.executor.shutdown(wait=True)
+
+
+def start_server(debug=False, sample_rate=None, oversample=None,
+                 method=None):
+    """
+    Start the asyncio server and connect to the hardware device. Same
+    arguments as restserver.start_server().
+    Returns:
+        True if successful, False otherwise.
+    """
+    if web is None:
+        logging.error(
+            "asyncserver.start_server - aiohttp not installed, "
+            "pip install aiohttp.")
+        readiness.notify(False)
+        return False
+
+    def serve(on_ready):
+        asyncio.run(
+            AsyncRestServer().serve(on_ready=on_ready), debug=debug)
+
+    return rs.run_with_devices(
+        serve, 'asyncserver.start_server', sample_rate, oversample, method)
+
+
+if __name__ == '__main__':
+    start_server(debug=False)
@@ -0,0 +1,131 @@
+"""
+cache.py
+
+Cache of pre-encoded JSON responses for the read-only resources. Each
+entry remembers the raw device values it was rendered from, its token,
+and is served for as long as the device reports the same values, so a
+poller costs a couple of value reads and a lookup rather than building
+and marshalling a new response. Every entry carries an ETag, letting
+clients revalidate with If-None-Match and get an empty 304 back.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import collections
+import json
+import threading
+import zlib
+
+# body - the encoded JSON, as flask_restful would send it
+# etag - quoted strong entity tag of body
+CacheEntry = collections.namedtuple(
+    'CacheEntry', ['token', 'body', 'status', 'etag'])
+
+
+def encode_json(body):
+    """ encodes a response body the way flask_restful's output_json
+        does outside of debug mode. """
+    return (json.dumps(body) + '\n').encode('utf-8')
+
+
+def etag_matches(etag, if_none_match):
+    """ True if a raw If-None-Match header value matches etag. """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            # weak comparison is fine for GET revalidation
+            tag = tag[2:]
+        if tag == etag or tag == '*':
+            return True
+    return False
+
+
+class ResponseCache(object):
+    """ Encoded responses, keyed by resource. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._hits = 0
+        self._misses = 0
+        self._not_modified = 0
+        self._invalidations = 0
+
+    def get(self, key, token, render):
+        """ Returns the CacheEntry for key, rendering a new one with
+            render() if there is none, or if it was built from other
+            values than token.
+            Args:
+                key - the resource name
+                token - hashable snapshot of the values the response is
+                        built from, compared by equality
+                render - returns body, or (body, status), as a
+                         flask_restful resource method would """
+        entry = self._entries.get(key)
+        if entry is not None and entry.token == token:
+            with self._lock:
+                self._hits += 1
+            return entry
+        result = render()
+        if isinstance(result, tuple):
+            body, status = result
+        else:
+            body, status = result, 200
+        data = encode_json(body)
+        entry = CacheEntry(
+            token, data, status, '"%08x"' % zlib.crc32(data))
+        with self._lock:
+            self._misses += 1
+            self._entries[key] = entry
+        return entry
+
+    def count_not_modified(self):
+        """ records a 304 answered from an entry. """
+        with self._lock:
+            self._not_modified += 1
+
+    def invalidate(self, key=None):
+        """ drops the entry of a resource, or every entry if key is
+            None. """
+        with self._lock:
+            if key is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                dropped = int(self._entries.pop(key, None) is not None)
+            self._invalidations += dropped
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': (
+                    round(self._hits / float(lookups), 4) if lookups
+                    else 0.0),
+                'not_modified': self._not_modified,
+                'invalidations': self._invalidations,
+            }
@@ -0,0 +1,83 @@
+"""
+filters.py
+
+Reduction of a burst of MAX31855K readings into a single, less noisy
+reading. Frames with the fault bit set are discarded before reducing.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+from sr700api.max31855kdevice import Max31855Sample
+
+
+def median(values):
+    """ median of a non-empty sequence of numbers. """
+    ordered = sorted(values)
+    n = len(ordered)
+    mid = n // 2
+    if n % 2:
+        return ordered[mid]
+    return (ordered[mid - 1] + ordered[mid]) / 2.0
+
+
+def trimmed_mean(values, proportion=0.2):
+    """ mean of a non-empty sequence of numbers, after dropping the
+        given proportion of the lowest and of the highest values. """
+    ordered = sorted(values)
+    n = len(ordered)
+    cut = int(n * proportion)
+    if n - 2 * cut < 1:
+        cut = (n - 1) // 2
+    kept = ordered[cut:n - cut]
+    return sum(kept) / float(len(kept))
+
+
+FILTERS = {
+    'median': median,
+    'trimmed_mean': trimmed_mean,
+}
+
+
+def reduce_burst(readings, method='median'):
+    """ Reduces a burst of Max31855kDevice.read() results to one.
+
+        Args:
+            readings - non-empty list of readings
+            method - a FILTERS key
+        Returns:
+            (reading, discarded) - the reduced reading and the number of
+            fault-flagged readings that were left out. If every reading
+            was flagged, the last one is returned as is, so that its
+            detailed fault bits reach the client."""
+    func = FILTERS[method]
+    good = [r for r in readings if not r[1]]
+    discarded = len(readings) - len(good)
+    if not good:
+        return readings[-1], discarded
+    if len(good) == 1:
+        return good[0], discarded
+    return Max31855Sample(
+        func([r[0] for r in good]),
+        0,
+        func([r[2] for r in good]),
+        0, 0, 0), discarded
@@ -0,0 +1,170 @@
+"""
+history.py
+
+A fixed-capacity, array-backed ring buffer of timestamped roaster and
+probe samples. Memory use is allocated up front and never grows, so the
+buffer can run for a whole roasting day.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import array
+import threading
+
+# roaster states, stored as their index in this tuple. 'disconnected'
+# marks samples taken while the SR700 was not connected.
+STATES = (
+    'disconnected', 'idle', 'roasting', 'cooling', 'sleeping',
+    'connecting', 'unknown')
+_STATE_CODES = dict((name, code) for code, name in enumerate(STATES))
+
+# fault bits, packed into a single byte per sample
+FAULT = 0x01
+FAULT_SCV = 0x02
+FAULT_SCG = 0x04
+FAULT_OC = 0x08
+
+# typecode of each column
+COLUMNS = (
+    ('timestamp', 'd'),
+    ('bean_temp', 'd'),      # degC, NaN if unavailable
+    ('junc_t', 'd'),         # degC, NaN if unavailable
+    ('current_temp', 'd'),   # degF, NaN if unavailable
+    ('fan_speed', 'b'),      # -1 if unavailable
+    ('heater_level', 'b'),   # -1 if unavailable
+    ('state', 'B'),          # index into STATES
+    ('faults', 'B'),         # FAULT* bits
+)
+
+
+def fault_bits(fault, scv, scg, oc):
+    """ Packs the fault flags returned by Max31855kDevice.read() into
+        a single FAULT* bitmask. """
+    bits = 0
+    if fault:
+        bits |= FAULT
+    if scv:
+        bits |= FAULT_SCV
+    if scg:
+        bits |= FAULT_SCG
+    if oc:
+        bits |= FAULT_OC
+    return bits
+
+
+def state_code(state):
+    """ Returns the STATES index for a roaster state string. """
+    return _STATE_CODES.get(state, _STATE_CODES['unknown'])
+
+
+class SampleHistory(object):
+    """ A ring buffer holding the most recent `capacity` samples.
+        Samples must be appended in timestamp order. Thread-safe. """
+    def __init__(self, capacity=65536):
+        if capacity < 1:
+            raise ValueError("SampleHistory - capacity must be positive.")
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._columns = dict(
+            (name, array.array(typecode, [0]) * capacity)
+            for name, typecode in COLUMNS)
+        # physical index of the oldest sample, and number of samples held
+        self._start = 0
+        self._count = 0
+        # timestamp of the newest sample that was overwritten
+        self._last_dropped = None
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, bean_temp, junc_t, current_temp,
+               fan_speed, heater_level, state, faults):
+        """ Adds a sample, overwriting the oldest one once full.
+            Pass None for any temperature or setting that is unavailable,
+            state is a roaster state string, faults a FAULT* bitmask. """
+        nan = float('nan')
+        with self._lock:
+            if self._count < self.capacity:
+                i = (self._start + self._count) % self.capacity
+                self._count += 1
+            else:
+                i = self._start
+                self._start = (self._start + 1) % self.capacity
+                self._last_dropped = self._columns['timestamp'][i]
+            c = self._columns
+            c['timestamp'][i] = timestamp
+            c['bean_temp'][i] = nan if bean_temp is None else bean_temp
+            c['junc_t'][i] = nan if junc_t is None else junc_t
+            c['current_temp'][i] = (
+                nan if current_temp is None else current_temp)
+            c['fan_speed'][i] = -1 if fan_speed is None else fan_speed
+            c['heater_level'][i] = (
+                -1 if heater_level is None else heater_level)
+            c['state'][i] = state_code(state)
+            c['faults'][i] = faults
+
+    def _first_after(self, since):
+        """ Binary search for the logical index of the first sample
+            newer than since. Call with the lock held. """
+        timestamps = self._columns['timestamp']
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if timestamps[(self._start + mid) % self.capacity] <= since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def since(self, since=None, limit=None):
+        """ Returns the samples newer than `since` (all samples if None),
+            oldest first, as a dict of per-column lists. At most `limit`
+            samples are returned, the oldest ones first, so a client can
+            page through a backlog. Also returns whether samples newer
+            than `since` were already overwritten. """
+        with self._lock:
+            if since is None:
+                first = 0
+            else:
+                first = self._first_after(since)
+            last = self._count
+            if limit is not None:
+                last = min(last, first + limit)
+            # split the logical range into at most two physical slices
+            begin = (self._start + first) % self.capacity
+            length = last - first
+            end = begin + length
+            out = {}
+            for name, typecode in COLUMNS:
+                column = self._columns[name]
+                if end <= self.capacity:
+                    out[name] = column[begin:end].tolist()
+                else:
+                    out[name] = (column[begin:].tolist() +
+                                 column[:end - self.capacity].tolist())
+            last_dropped = self._last_dropped
+        # a fresh client (since=None) hasn't lost anything.
+        out['overwritten'] = (
+            since is not None and last_dropped is not None and
+            since < last_dropped)
+        return out
@@ -0,0 +1,174 @@
+"""
+lineserver.py
+
+A tiny line-oriented protocol server on a Unix domain socket.
+Each request is one line of text (for instance
+'get_multi current_temp bean_temp'), each response is one line of
+text, exactly as the sr700api command-line script would print it.
+This lets the command-line script answer Artisan's polls without
+importing requests or building its argparse tree.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+# socket file name in the user's runtime directory, or in /tmp with
+# the user id appended when there is no runtime directory. The
+# sr700api script uses the same default. Both honour the
+# SR700API_SOCKET environment variable; setting it to an empty string
+# disables the socket altogether.
+SOCKET_NAME = 'sr700api.sock'
+# only the user running the server may connect to its socket.
+SOCKET_MODE = 0o600
+
+
+def default_socket_path():
+    """ Returns the per-user default socket path. """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, SOCKET_NAME)
+    return '/tmp/sr700api-%d.sock' % os.getuid()
+
+
+def socket_path():
+    """ Returns the socket path to use, or None if disabled. """
+    path = os.environ.get('SR700API_SOCKET', default_socket_path())
+    if not path:
+        return None
+    return path
+
+
+def socket_in_use(path):
+    """ Returns True if a server is accepting connections on the
+        socket at path. """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(0.5)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    except OSError:
+        # can't tell, so assume somebody else owns it
+        return True
+    finally:
+        sock.close()
+    return True
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    """ Serves request lines until the client closes the connection. """
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').strip()
+            if not line:
+                continue
+            try:
+                response = self.server.command_func(line)
+            except Exception:
+                logging.exception(
+                    "LineProtocolServer - command failed: %s" % line)
+                response = 'ERR: server error.'
+            self.wfile.write(
+                (str(response).replace('\n', ' ') + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # take group and other permissions off the socket file before
+        # server_activate() listens on it, so no other user can ever
+        # connect. The process umask is left alone: other threads are
+        # creating files already.
+        socketserver.UnixStreamServer.server_bind(self)
+        os.chmod(self.server_address, SOCKET_MODE)
+
+
+class LineProtocolServer(object):
+    """ Runs a threaded Unix domain socket server in the background,
+        passing every received line to command_func and writing back
+        its return value. """
+    def __init__(self, path, command_func):
+        self.path = path
+        self.command_func = command_func
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """ Binds the socket and starts serving. Returns False if the
+            socket could not be created. """
+        # a previous server instance may have left its socket behind.
+        # Only remove it if it is a socket nobody is listening on.
+        if os.path.lexists(self.path):
+            if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                logging.error(
+                    "LineProtocolServer.start - %s exists and is not "
+                    "a socket." % self.path)
+                return False
+            if socket_in_use(self.path):
+                logging.error(
+                    "LineProtocolServer.start - another server is "
+                    "listening on %s." % self.path)
+                return False
+            try:
+                os.unlink(self.path)
+            except OSError:
+                logging.error(
+                    "LineProtocolServer.start - cannot remove stale "
+                    "socket %s." % self.path)
+                return False
+        try:
+            self._server = _UnixServer(self.path, _LineHandler)
+        except OSError:
+            logging.error(
+                "LineProtocolServer.start - cannot bind %s." % self.path)
+            self._server = None
+            return False
+        self._server.command_func = self.command_func
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='sr700api-lineserver')
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """ Stops serving and removes the socket file. """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -28,10 +28,20 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import logging
+import collections
 import ctypes
 import serial
-from pyBusPirateLite.SPI import SPI as busprtspi
-from pyBusPirateLite.SPI import PIN_POWER, PIN_CS, CFG_PUSH_PULL, CFG_IDLE
+import time
+try:
+    from pyBusPirateLite.SPI import SPI as busprtspi
+    from pyBusPirateLite.SPI import PIN_POWER, PIN_CS, CFG_PUSH_PULL, CFG_IDLE
+except ImportError:
+    # not on PyPI; only needed to talk to real hardware
+    busprtspi = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Max31855_bitfield( ctypes.BigEndianStructure ):
     _pack_ = 1
@@ -51,47 +61,259 @@ class Max31855_data(ctypes.Union):
                 ("bytes", ctypes.c_uint8 * 4)]
 
 
-class Max31855kDevice(object):
-    """ A class to control a MAX31855K thermocouple chip connected via SPI to
-        a Sparkfun Bus Pirate v3.6. """
-    def __init__(self):
-        """ Creates a BusprtMax31855k object, optionally specifying the
-            dev port to which the Bus Pirate is attached."""
-        # init vars
+# The bitfield classes above document the MAX31855K frame layout, and are
+# the reference decode_frame() is verified against. Reads use the faster
+# shift and mask decoding below.
+Max31855Sample = collections.namedtuple(
+    'Max31855Sample',
+    ['thermocouple_temp', 'fault', 'int_junc_temp',
+     'scv_fault', 'scg_fault', 'oc_fault'])
+
+# returned by read() when no reading could be taken
+NO_HARDWARE_SAMPLE = Max31855Sample(0.0, 1, 0.0, 0, 0, 0)
+
+_new_sample = tuple.__new__
+
+
+def decode_frame(frame):
+    """ Decodes one 4-byte MAX31855K frame (a bytes-like object or a
+        sequence of ints, most significant byte first), bit-for-bit
+        like the Max31855_bitfield layout.
+
+        Returns a Max31855Sample, temperatures in degrees Celsius."""
+    b0, b1, b2, b3 = frame
+    hi = (b0 << 8) | b1
+    lo = (b2 << 8) | b3
+    return _new_sample(Max31855Sample, (
+        # 14-bit and 12-bit two's complement fields, sign extended
+        (((hi >> 2) ^ 0x2000) - 0x2000) / 4.0,
+        hi & 1,
+        (((lo >> 4) ^ 0x800) - 0x800) / 16.0,
+        (lo >> 2) & 1,
+        (lo >> 1) & 1,
+        lo & 1))
+
+
+def encode_frame(sample):
+    """ The 4-byte MAX31855K frame, most significant byte first, that
+        decode_frame() decodes to sample, a Max31855Sample or a tuple in
+        its field order, temperatures rounded to the chip's resolution.
+        Reserved bits are 0. Used to feed simulated and fake devices. """
+    tc, fault, ij, scv, scg, oc = sample
+    hi = ((int(round(tc * 4.0)) & 0x3FFF) << 2) | (fault & 1)
+    lo = (((int(round(ij * 16.0)) & 0xFFF) << 4) | ((scv & 1) << 2) |
+          ((scg & 1) << 1) | (oc & 1))
+    return bytes((hi >> 8, hi & 0xFF, lo >> 8, lo & 0xFF))
+
+
+def decode_frames(buf):
+    """ Decodes many MAX31855K frames at once, for bulk or offline
+        processing. Requires numpy.
+
+        Args:
+            buf - a bytes-like object holding 4*N bytes of raw frames,
+                  or a numpy array of N frames as uint8 (N, 4) or
+                  big-endian-decoded unsigned 32-bit integers.
+        Returns:
+            a numpy structured array of N records, with the same field
+            names as Max31855Sample."""
+    if np is None:
+        raise RuntimeError(
+            "max31855kdevice.decode_frames - requires numpy.")
+    if isinstance(buf, np.ndarray):
+        if buf.dtype.kind == 'u' and buf.dtype.itemsize == 4:
+            raw = buf.astype(np.uint32, copy=False).reshape(-1)
+        else:
+            raw = np.ascontiguousarray(
+                buf, dtype=np.uint8).view('>u4').reshape(-1)
+    else:
+        raw = np.frombuffer(buf, dtype='>u4')
+    out = np.empty(len(raw), dtype=[
+        ('thermocouple_temp', np.float64),
+        ('fault', np.uint8),
+        ('int_junc_temp', np.float64),
+        ('scv_fault', np.uint8),
+        ('scg_fault', np.uint8),
+        ('oc_fault', np.uint8)])
+    tc = ((raw >> 18) & 0x3FFF).astype(np.int32)
+    out['thermocouple_temp'] = ((tc ^ 0x2000) - 0x2000) / 4.0
+    out['fault'] = (raw >> 16) & 1
+    ij = ((raw >> 4) & 0xFFF).astype(np.int32)
+    out['int_junc_temp'] = ((ij ^ 0x800) - 0x800) / 16.0
+    out['scv_fault'] = (raw >> 2) & 1
+    out['scg_fault'] = (raw >> 1) & 1
+    out['oc_fault'] = raw & 1
+    return out
+
+
+class Max31855kDriver(object):
+    """ A MAX31855K thermocouple chip on some SPI bus. Connects, reads
+        and decodes frames, and keeps track of the connection, leaving
+        the bus itself to subclasses: Max31855kDevice for a Bus Pirate,
+        sr700api.spidevdevice for a Linux spidev device. Subclasses
+        implement _connect(), _transfer(), _close() and _shut_down(). """
+    # prefix of log messages
+    log_name = 'Max31855kDriver'
+
+    def __init__(self, speed):
+        # the bus connection, as returned by _connect(), None when
+        # disconnected
         self.spi = None
-        self.max31855_pkt = Max31855_bitfield()
-        self.max31855_union = Max31855_data()
+        self.speed = speed
+        # instrumentation: successful connects, connections lost on a
+        # failed read, and a metrics histogram series timing every SPI
+        # transfer, if set
+        self.connects = 0
+        self.connection_losses = 0
+        self.transfer_histogram = None
+        # whether read() already warned that there is no hardware
+        self._absent_logged = False
 
     def disconnect(self):
-        """ disconnects from a previously connected Bus Pirate,
+        """ disconnects from previously connected hardware,
             if such connection exists, else, no action is performed. """
-        if self.spi is not None:
-            # power down the hardware on exit
-            self.spi.config = 0
-            self.spi.pins = 0
-            # disconnect from hardware
-            self.spi.disconnect()
-            self.spi = None
+        spi, self.spi = self.spi, None
+        if spi is not None:
+            self._shut_down(spi)
 
     def find_connect(self):
-        """ Looks for an FTDI chip with Vendor IS 0x0403 and Product ID
-            0x6002, then verifies that the device is a bus pirate,
-            before returning success/fail. """
+        """ Connects to the hardware, before returning success/fail.
+            The connection is set up aside and only handed to read()
+            once configured, so that a sampler thread may keep reading
+            while another thread reconnects. """
         if self.spi is not None:
             # um, what do we do here?
             return True
-        # pyBusPirateLite can auto-find the bus pirate...
-        self.spi = busprtspi(connect=False)
-        port = self.spi.get_port()
-        # when no hardware present, port is None
-        if port is None:
-            self.spi = None
+        spi = self._connect()
+        if spi is None:
             return False
-        self.spi = busprtspi(portname=("/dev/%s" % (port)))
-        if self.spi is None:
+        self._absent_logged = False
+        self.connects += 1
+        # only now does read() see the new connection
+        self.spi = spi
+        return True
+
+    def _connect(self):
+        """ a new, configured connection, or None. """
+        raise NotImplementedError
+
+    def _transfer(self, spi):
+        """ one 4-byte frame transfer. Raises OSError. """
+        raise NotImplementedError
+
+    def _close(self, spi):
+        """ closes a connection whose I/O failed, ignoring whatever
+            the vanished device raises. """
+        raise NotImplementedError
+
+    def _shut_down(self, spi):
+        """ powers down and closes a working connection. """
+        raise NotImplementedError
+
+    def _timed_transfer(self, spi):
+        if self.transfer_histogram is None:
+            return self._transfer(spi)
+        start = time.perf_counter()
+        frame = self._transfer(spi)
+        self.transfer_histogram.observe(time.perf_counter() - start)
+        return frame
+
+    def read(self):
+        """ Read the temps and bitflags from the device.
+            All temperatures in degrees Celsius.
+
+            Returns a Max31855Sample tuple of:
+                thermoocuple_temp (degC, float)
+                fault - hardsware fault detected, see detailed fault
+                int_junc_temp (degC, float)
+                scv_fault
+                scg_fault
+                oc_fault
+
+            If hardware not present, will set fault to 1,
+            and all detailed fault bits to 0.
+            """
+        # the connection may be swapped by find_connect() meanwhile
+        spi = self.spi
+        # bail if we're not connected!
+        if spi is None:
+            if not self._absent_logged:
+                # once, not on every sample until the probe is back
+                logging.warning(
+                    "%s.read - hardware not present!" % self.log_name)
+                self._absent_logged = True
+            return NO_HARDWARE_SAMPLE
+
+        try:
+            bytes_read = self._timed_transfer(spi)
+        except OSError:
+            # serial.SerialException included
+            logging.error(
+                "%s - connection lost, I/O failed on read." %
+                self.log_name)
+            self.connection_losses += 1
+            if self.spi is spi:
+                self.spi = None
+            self._close(spi)
+            return NO_HARDWARE_SAMPLE
+        return decode_frame(bytes_read)
+
+    def is_connected(self):
+        """ Reports whether we are actively connected to hardware.
+            Returns:
+                True if connected, otherwise False """
+        if self.spi is not None:
+            return True
+        return False
+
+
+class Max31855kDevice(Max31855kDriver):
+    """ A class to control a MAX31855K thermocouple chip connected via SPI to
+        a Sparkfun Bus Pirate v3.6. """
+    log_name = 'BusprtMax31855k'
+
+    def __init__(self, speed='30kHz', port=None):
+        """ Creates a BusprtMax31855k object, optionally specifying the
+            SPI clock speed, see _connect() for acceptable values.
+            The MAX31855K supports up to 5MHz. port, such as
+            '/dev/ttyUSB0', pins the Bus Pirate to use when several are
+            plugged in; by default the first one found is used. """
+        super(Max31855kDevice, self).__init__(speed)
+        self.port = port
+        # the port of the last connection, tried first on a reconnect
+        self._last_portname = None
+
+    def _shut_down(self, spi):
+        # power down the hardware on exit
+        spi.config = 0
+        spi.pins = 0
+        # disconnect from hardware
+        spi.disconnect()
+
+    def _connect(self):
+        """ Looks for an FTDI chip with Vendor IS 0x0403 and Product ID
+            0x6002, then verifies that the device is a bus pirate,
+            before returning a configured connection, or None. """
+        if busprtspi is None:
+            logging.error(
+                "BusprtMax31855k.find_connect - pyBusPirateLite is not "
+                "installed.")
+            return None
+        # a pinned port, or on a reconnect the port that worked last
+        # time, which saves looking for the bus pirate
+        portname = self.port or self._last_portname
+        spi = self._open(portname) if portname is not None else None
+        if spi is None and self.port is None:
+            # pyBusPirateLite can auto-find the bus pirate...
+            port = busprtspi(connect=False).get_port()
+            # when no hardware present, port is None
+            if port is not None and "/dev/%s" % (port) != portname:
+                portname = "/dev/%s" % (port)
+                spi = self._open(portname)
+        if spi is None:
             logging.warning(
                 "BusprtMax31855k.find_connect - hardware not found.")
-            return False
+            return None
         # we've successfully connected
         # now let's configure the details
         """ pins byte:
@@ -108,7 +330,7 @@ class Max31855kDevice(object):
                 Features not present in a specific hardware version are ignored.
                 Bus Pirate responds 0x01 on success.
         """
-        self.spi.pins = PIN_POWER | PIN_CS
+        spi.pins = PIN_POWER | PIN_CS
         """ config byte: 0000wxyz
                 This command configures the SPI settings.
                 Options and start-up defaults are the same as the user terminal
@@ -128,7 +350,7 @@ class Max31855kDevice(object):
            0x04 CFG_IDLE: clock idle phase (0 = low)
            0x08 CFG_PUSH_PULL: pin output (0 = HiZ, 1 = push-pull)
         """
-        self.spi.config = CFG_PUSH_PULL | CFG_IDLE
+        spi.config = CFG_PUSH_PULL | CFG_IDLE
         """ speed: acceptable strings are
              '30kHz' : 0b000,
              '125kHz': 0b001,
@@ -139,70 +361,41 @@ class Max31855kDevice(object):
              '4MHz'  : 0b110,
              '8MHz'  : 0b111
         """
-        self.spi.speed = '30kHz'
+        spi.speed = self.speed
 
         # the first read after an init gives some wonky results,
         # so let's just perform a throwaway read right away.
-        self.read()
-
-        return True
-
-    def read(self):
-        """ Read the temps and bitflags from the device.
-            All temperatures in degrees Celsius.
-
-            Returns:
-                thermoocuple_temp (degC, float)
-                fault - hardsware fault detected, see detailed fault
-                int_junc_temp (degC, float)
-                scv_fault
-                scg_fault
-                oc_fault
+        try:
+            self._transfer(spi)
+        except serial.serialutil.SerialException:
+            logging.warning(
+                "BusprtMax31855k.find_connect - I/O failed on first read.")
+            self._close(spi)
+            return None
 
-            If hardware not present, will set fault to 1,
-            and all detailed fault bits to 0.
-            """
-        # bail if we're not connected!
-        if self.spi is None:
-            logging.warning("BusprtMax31855k.read - hardware not present!")
-            return( 0.0,1,0.0,0,0,0)
+        self._last_portname = portname
+        return spi
 
+    def _open(self, portname):
+        """ a Bus Pirate SPI connection on portname, or None. """
         try:
-            self.spi.cs = True
-            bytes_read = self.spi.transfer([0,0,0,0])
-            self.spi.cs = False
+            return busprtspi(portname=portname)
         except serial.serialutil.SerialException:
-            logging.error(
-                "BusprtMax31855k - connection lost, I/O failed on read.")
-            self.spi = None
-            return( 0.0,1,0.0,0,0,0)
-        # print(bytes_read)
-        # analyze bytes
-        self.max31855_union.bytes = (
-            (ctypes.c_ubyte * len(bytes_read))(*bytes_read))
-        # print("max31855_union: ",
-        #     ["0x%02x" % x for x in self.max31855_union.bytes])
-        # print("thermocouple_temp: ",
-        #     self.max31855_union.bit_values.thermocouple_temp/4.0)
-        # print("fault: ", self.max31855_union.bit_values.fault)
-        # print("int_junc_temp: ",
-        #     self.max31855_union.bit_values.int_junc_temp/16.0)
-        # print("scv_fault: ", self.max31855_union.bit_values.scv_fault)
-        # print("scg_fault: ", self.max31855_union.bit_values.scg_fault)
-        # print("oc_fault: ", self.max31855_union.bit_values.oc_fault)
-        return (
-            self.max31855_union.bit_values.thermocouple_temp/4.0,
-            self.max31855_union.bit_values.fault,
-            self.max31855_union.bit_values.int_junc_temp/16.0,
-            self.max31855_union.bit_values.scv_fault,
-            self.max31855_union.bit_values.scg_fault,
-            self.max31855_union.bit_values.oc_fault
-            )
+            return None
 
-    def is_connected(self):
-        """ Reports whether we are actively connected to hardware.
-            Returns:
-                True if connected, otherwise False """
-        if self.spi is not None:
-            return True
-        return False
+    def _close(self, spi):
+        """ closes a connection whose I/O failed, ignoring whatever
+            the vanished port raises. """
+        try:
+            spi.disconnect()
+        except Exception:
+            pass
+
+    def _transfer(self, spi):
+        """ one 4-byte frame transfer, a serial round trip for each of
+            chip select, the transfer and chip deselect. Raises
+            SerialException. """
+        spi.cs = True
+        bytes_read = spi.transfer([0,0,0,0])
+        spi.cs = False
+        return bytes_read
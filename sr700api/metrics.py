@@ -0,0 +1,229 @@
+"""
+metrics.py
+
+Counters and latency histograms for the server's hot paths, exposed in
+the Prometheus text format by /metrics. Histograms keep one count per
+bucket and only accumulate them when the page is rendered, so that an
+observation is a bisect and two additions under a lock. Values that the
+server already keeps, such as sampler statistics, are read through
+callbacks at render time only. Nothing is instrumented at all when
+SR700API_METRICS is 0, see enabled().
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# histogram bucket upper bounds, in seconds, from a fast SPI frame to a
+# slow request
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def enabled():
+    """ False if SR700API_METRICS is set to 0 (or off, false, or an
+        empty string), in which case the server neither instruments its
+        hot paths nor serves /metrics. """
+    value = os.environ.get('SR700API_METRICS', '1')
+    return value.strip().lower() not in ('0', 'off', 'false', '')
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    value = float(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value.is_integer() and abs(value) < 1e15:
+        return '%d' % value
+    return repr(value)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('\n', '\\n')
+            .replace('"', '\\"'))
+
+
+def _labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append('%s="%s"' % extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+class _HistogramSeries(object):
+    """ The buckets of one label set of a Histogram. """
+    __slots__ = ('_bounds', '_lock', '_counts', '_sum')
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._lock = threading.Lock()
+        # per bucket, not cumulative, the last one being +Inf
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(object):
+    """ Observed values, counted in buckets, by label values. Call
+        labels() once and keep the series for a hot path. """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def labels(self, *values):
+        """ the series for the given label values, created if needed. """
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(
+                    values, _HistogramSeries(self.buckets))
+        return series
+
+    def observe(self, value, labels=()):
+        self.labels(*labels).observe(value)
+
+    def samples(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        out = []
+        for labels, s in series:
+            counts, total = s.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                out.append(
+                    ('_bucket', labels, ('le', _format_value(bound)),
+                     cumulative))
+            cumulative += counts[-1]
+            out.append(('_bucket', labels, ('le', '+Inf'), cumulative))
+            out.append(('_sum', labels, None, total))
+            out.append(('_count', labels, None, cumulative))
+        return out
+
+
+class Callback(object):
+    """ A gauge or counter whose values are read when rendered.
+        func returns a sequence of (label values, value). """
+    def __init__(self, kind, name, help, labelnames, func):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.func = func
+
+    def samples(self):
+        return [('', tuple(labels), None, value)
+                for labels, value in self.func()]
+
+
+class Registry(object):
+    """ The metrics served by /metrics, rendered in registration
+        order. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(),
+                  buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge_callback(self, name, help, labelnames, func):
+        return self.register(
+            Callback('gauge', name, help, labelnames, func))
+
+    def counter_callback(self, name, help, labelnames, func):
+        return self.register(
+            Callback('counter', name, help, labelnames, func))
+
+    def render(self):
+        """ every metric, in the Prometheus text exposition format. A
+            callback that fails is left out, and logged. """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                logging.exception(
+                    "Registry.render - collecting %s failed." % metric.name)
+                continue
+            lines.append('# HELP %s %s' % (
+                metric.name, metric.help.replace('\\', '\\\\')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for suffix, labels, extra, value in samples:
+                lines.append('%s%s%s %s' % (
+                    metric.name, suffix,
+                    _labels(metric.labelnames, labels, extra),
+                    _format_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class LastSeen(object):
+    """ When something last happened, such as a packet from the
+        roaster, by the monotonic clock. """
+    __slots__ = ('time',)
+
+    def __init__(self):
+        self.time = None
+
+    def touch(self):
+        self.time = time.monotonic()
+
+    def age(self):
+        """ seconds since the last touch(), None if never. """
+        if self.time is None:
+            return None
+        return time.monotonic() - self.time
@@ -0,0 +1,299 @@
+"""
+pid.py
+
+Closed-loop bean temperature control inside the server. A PidLoop runs
+its own thread at a fixed control rate, reads the latest bean probe
+sample, and drives the roaster's heater level through a PidController,
+towards either a fixed setpoint or a playing roast profile, see
+profile.py. This replaces the round trip through Artisan's PID, two
+spawned sr700api processes and several HTTP requests, with a function
+call per control tick.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import math
+import threading
+import time
+
+
+class PidController(object):
+    """ A PID controller with a clamped output and anti-windup. The
+        derivative acts on the measurement rather than on the error, so
+        setpoint steps and ramps don't kick the output. """
+    def __init__(self, kp, ki, kd, out_min=0.0, out_max=8.0):
+        """ Args:
+                kp - proportional gain, output units per degree
+                ki - integral gain, output units per degree second
+                kd - derivative gain, output units per degree/second
+                out_min, out_max - output range """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.out_min = out_min
+        self.out_max = out_max
+        self.reset()
+
+    def reset(self, output=None):
+        """ Forgets the controller history. With output given, the
+            integral term starts there, so that taking over from manual
+            control doesn't bump the output. """
+        self._integral = self._clamp(output if output is not None else 0.0)
+        self._last_measurement = None
+
+    def _clamp(self, value):
+        return min(max(value, self.out_min), self.out_max)
+
+    def update(self, setpoint, measurement, dt):
+        """ Returns the output for the current measurement, dt seconds
+            after the previous update. """
+        error = setpoint - measurement
+        p = self.kp * error
+        if self._last_measurement is None or dt <= 0:
+            d = 0.0
+        else:
+            d = -self.kd * (measurement - self._last_measurement) / dt
+        self._last_measurement = measurement
+        integral = self._integral + self.ki * error * max(dt, 0.0)
+        output = p + integral + d
+        # anti-windup: stop integrating while the output is saturated
+        # and the error would push it further out, and never let the
+        # integral alone exceed the output range.
+        if ((output > self.out_max and error > 0) or
+                (output < self.out_min and error < 0)):
+            integral = self._integral
+            output = p + integral + d
+        self._integral = self._clamp(integral)
+        return self._clamp(output)
+
+
+class PidLoop(object):
+    """ Runs a PidController at a fixed rate from a dedicated thread.
+        Temperatures are in degC. """
+    def __init__(self, controller, read_input, write_output,
+                 rate=1.0, is_active=None):
+        """ Args:
+                controller - a PidController
+                read_input - returns the current temperature, or None
+                             when no valid reading is available
+                write_output - sets the heater level, an int
+                rate - control ticks per second
+                is_active - returns whether the process can be
+                            controlled, e.g. the roaster is roasting.
+                            While it isn't, the output is left alone. """
+        self.controller = controller
+        self.read_input = read_input
+        self.write_output = write_output
+        self.is_active = is_active
+        self.period = 1.0 / rate
+        self._lock = threading.Lock()
+        self._setpoint = None
+        self._profile = None
+        self._measurement = None
+        self._output = None
+        self._level = None
+        self._was_active = False
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.reset_stats()
+
+    def set_rate(self, rate):
+        if rate <= 0:
+            raise ValueError("PidLoop - rate must be positive.")
+        self.period = 1.0 / rate
+
+    def set_setpoint(self, setpoint):
+        """ Holds a fixed setpoint, replacing any profile. """
+        with self._lock:
+            self._setpoint = setpoint
+            self._profile = None
+
+    def set_profile(self, profile):
+        """ Follows a profile.ProfilePlayer, or any object with the
+            setpoint(now), elapsed(now) and duration it provides. """
+        with self._lock:
+            self._profile = profile
+
+    @property
+    def profile(self):
+        """ The profile followed, or None. """
+        return self._profile
+
+    def setpoint(self, now=None):
+        """ The current setpoint, or None if there is none. """
+        with self._lock:
+            if self._profile is None:
+                return self._setpoint
+            profile = self._profile
+        return profile.setpoint(now)
+
+    def reset_stats(self):
+        """ Clears the loop timing statistics reported by stats(). """
+        self._stats = {
+            'ticks': 0,
+            'missed_inputs': 0,
+            'overruns': 0,
+            'jitter_total': 0.0,
+            'jitter_sq_total': 0.0,
+            'jitter_max': 0.0,
+            'tick_time_total': 0.0,
+            'tick_time_max': 0.0,
+            'last_tick_mono': None,
+        }
+
+    def stats(self):
+        """ Control loop timing, in seconds. Jitter is the difference
+            between the actual and the nominal interval between ticks;
+            an overrun is an interval over one and a half periods. """
+        st = dict(self._stats)
+        ticks = st['ticks']
+        intervals = max(ticks - 1, 0)
+        if intervals:
+            mean = st['jitter_total'] / intervals
+            var = max(st['jitter_sq_total'] / intervals - mean * mean, 0.0)
+        else:
+            mean = var = 0.0
+        return {
+            'rate': 1.0 / self.period,
+            'ticks': ticks,
+            'missed_inputs': st['missed_inputs'],
+            'overruns': st['overruns'],
+            'jitter_avg': mean,
+            'jitter_std': math.sqrt(var),
+            'jitter_max': st['jitter_max'],
+            'tick_time_avg': st['tick_time_total'] / ticks if ticks else 0.0,
+            'tick_time_max': st['tick_time_max'],
+        }
+
+    def status(self):
+        """ Current setpoint, measurement and output. """
+        now = time.monotonic()
+        with self._lock:
+            profile = self._profile
+        status = {
+            'enabled': self.is_running(),
+            'setpoint': self.setpoint(now),
+            'measurement': self._measurement,
+            'output': self._output,
+            'heater_level': self._level,
+            'kp': self.controller.kp,
+            'ki': self.controller.ki,
+            'kd': self.controller.kd,
+            'mode': 'profile' if profile is not None else 'setpoint',
+        }
+        if profile is not None:
+            status['profile_elapsed'] = profile.elapsed(now)
+            status['profile_duration'] = profile.duration
+        return status
+
+    def start(self, initial_output=None):
+        """ Starts controlling, taking over from initial_output, the
+            current heater level. Returns False if already running. """
+        if self.is_running():
+            return False
+        self.controller.reset(initial_output)
+        self._output = initial_output
+        self._level = None
+        self._was_active = False
+        self._stats['last_tick_mono'] = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='pid-loop')
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def stop(self, timeout=2.0):
+        """ Stops controlling, and turns the heater off. """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.write_output(0)
+        except Exception:
+            logging.exception("PidLoop.stop - failed to turn heater off.")
+        self._level = self._output = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def tick(self, now):
+        """ One control step. """
+        st = self._stats
+        last = st['last_tick_mono']
+        dt = now - last if last is not None else self.period
+        if last is not None:
+            jitter = abs(dt - self.period)
+            st['jitter_total'] += jitter
+            st['jitter_sq_total'] += jitter * jitter
+            if jitter > st['jitter_max']:
+                st['jitter_max'] = jitter
+            if dt > 1.5 * self.period:
+                st['overruns'] += 1
+        st['last_tick_mono'] = now
+        st['ticks'] += 1
+
+        if self.is_active is not None and not self.is_active():
+            # nothing to control; pick up smoothly once active again
+            self._was_active = False
+            return
+        measurement = self.read_input()
+        self._measurement = measurement
+        setpoint = self.setpoint(now)
+        if measurement is None or setpoint is None:
+            # no valid reading: fail safe, heater off
+            st['missed_inputs'] += 1
+            output = 0.0
+            self.controller.reset(0.0)
+        else:
+            if not self._was_active:
+                self.controller.reset(self._output)
+                self._was_active = True
+            output = self.controller.update(setpoint, measurement, dt)
+        self._output = output
+        level = int(round(output))
+        if level != self._level:
+            self.write_output(level)
+            self._level = level
+
+    def _run(self):
+        """ control loop, at a fixed rate. """
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            try:
+                self.tick(start)
+            except Exception:
+                logging.exception("PidLoop._run - control tick failed.")
+            elapsed = time.monotonic() - start
+            st = self._stats
+            st['tick_time_total'] += elapsed
+            if elapsed > st['tick_time_max']:
+                st['tick_time_max'] = elapsed
+            next_time += self.period
+            now = time.monotonic()
+            if next_time < now:
+                next_time = now
+            self._stop_event.wait(next_time - now)
@@ -0,0 +1,398 @@
+"""
+profile.py
+
+Roast profile playback. A ProfileTable is built once from the profile's
+points, time -> bean temperature / fan speed / heater level, by sampling
+them on a fixed time step, so that the setpoints at any time into the
+roast are found with an index computation instead of a search. A
+ProfilePlayer keeps the roast clock on the server, applies the fan and
+heater setpoints as they come due, and serves the bean temperature
+setpoint to the PID loop, with pause, resume and seek.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import array
+import logging
+import math
+import threading
+import time
+
+# seconds between table rows
+TABLE_STEP = 0.1
+# longest profile accepted, in seconds, and most points
+MAX_DURATION = 3600.0
+MAX_POINTS = 1000
+
+# ProfilePlayer states
+EMPTY = 'empty'
+STOPPED = 'stopped'
+PLAYING = 'playing'
+PAUSED = 'paused'
+FINISHED = 'finished'
+
+NAN = float('nan')
+
+
+class ProfileTable(object):
+    """ The setpoints of a profile, sampled every step seconds. Bean
+        temperatures are interpolated linearly between points; fan
+        speed and heater level, being discrete, hold their value from
+        one point to the next. A column only takes values from the
+        points that set it, and is None before the first of them. """
+    def __init__(self, points, step=TABLE_STEP):
+        """ Args:
+                points - sequence of (time, bean_temp, fan_speed,
+                         heater_level), in order of time, any value but
+                         time may be None. Two points with the same
+                         time make a step change.
+                step - table resolution, in seconds
+            Raises:
+                ValueError """
+        points = [tuple(p) for p in points]
+        if not points:
+            raise ValueError("ProfileTable - at least one point is needed.")
+        last = 0.0
+        for p in points:
+            if p[0] < last:
+                raise ValueError(
+                    "ProfileTable - point times must not go backwards.")
+            last = p[0]
+        if last > MAX_DURATION:
+            raise ValueError(
+                "ProfileTable - profile is longer than %d seconds." %
+                MAX_DURATION)
+        self.points = tuple(points)
+        self.step = step
+        self.duration = last
+        self._inv_step = 1.0 / step
+        size = int(math.ceil(last * self._inv_step)) + 1
+        self.size = size
+        self._bean_temp = self._linear_column(
+            [(p[0], p[1]) for p in points if p[1] is not None], size)
+        self._fan_speed = self._hold_column(
+            [(p[0], p[2]) for p in points if p[2] is not None], size)
+        self._heater_level = self._hold_column(
+            [(p[0], p[3]) for p in points if p[3] is not None], size)
+        self.has_bean_temp = any(p[1] is not None for p in points)
+
+    def _linear_column(self, knots, size):
+        """ samples a piecewise linear function of time, NaN before its
+            first knot and held after its last one. """
+        column = array.array('d', [NAN]) * size
+        if not knots:
+            return column
+        k = 0
+        for i in range(size):
+            t = i * self.step
+            if t < knots[0][0]:
+                continue
+            # the last knot at or before t
+            while k + 1 < len(knots) and knots[k + 1][0] <= t:
+                k += 1
+            t0, v0 = knots[k]
+            if k + 1 < len(knots):
+                t1, v1 = knots[k + 1]
+                column[i] = v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+            else:
+                column[i] = v0
+        return column
+
+    def _hold_column(self, knots, size):
+        """ samples a step function of time, -1 before its first knot. """
+        column = array.array('b', [-1]) * size
+        k = -1
+        for i in range(size):
+            t = i * self.step
+            while k + 1 < len(knots) and knots[k + 1][0] <= t:
+                k += 1
+            if k >= 0:
+                column[i] = knots[k][1]
+        return column
+
+    def _index(self, elapsed):
+        i = int(elapsed * self._inv_step)
+        if i < 0:
+            return 0
+        if i >= self.size:
+            return self.size - 1
+        return i
+
+    def bean_temp(self, elapsed):
+        """ The bean temperature setpoint elapsed seconds into the
+            profile, or None. """
+        i = self._index(elapsed)
+        v0 = self._bean_temp[i]
+        if i + 1 < self.size:
+            v1 = self._bean_temp[i + 1]
+            if v1 == v1 and v0 == v0:
+                frac = elapsed * self._inv_step - i
+                if frac > 0.0:
+                    v0 += (v1 - v0) * frac
+        return v0 if v0 == v0 else None
+
+    def lookup(self, elapsed):
+        """ (bean_temp, fan_speed, heater_level) elapsed seconds into the
+            profile, each None if not set yet. The last row holds once
+            the profile is over. """
+        i = self._index(elapsed)
+        fan = self._fan_speed[i]
+        heater = self._heater_level[i]
+        return (
+            self.bean_temp(elapsed),
+            fan if fan >= 0 else None,
+            heater if heater >= 0 else None)
+
+
+def ramp_soak(segments, start_temp, step=TABLE_STEP):
+    """ A ProfileTable of bean temperatures from ramp/soak segments.
+        Args:
+            segments - sequence of (temp, ramp_seconds, soak_seconds),
+                       each ramping linearly from the previous
+                       temperature to temp, then holding it
+            start_temp - temperature the first ramp starts from
+        Raises:
+            ValueError """
+    if not segments:
+        raise ValueError("ramp_soak - at least one segment is required.")
+    points = [(0.0, start_temp, None, None)]
+    t = 0.0
+    for temp, ramp, soak in segments:
+        if ramp < 0 or soak < 0:
+            raise ValueError(
+                "ramp_soak - ramp and soak times can't be negative.")
+        t += ramp
+        points.append((t, temp, None, None))
+        t += soak
+        points.append((t, temp, None, None))
+    return ProfileTable(points, step)
+
+
+class ProfilePlayer(object):
+    """ Plays a ProfileTable back in real time from a dedicated thread.
+        Playback time comes from the monotonic clock, not from counting
+        ticks, so a late tick applies the setpoints that are due then
+        and never makes the roast drift. """
+    def __init__(self, apply, rate=4.0):
+        """ Args:
+                apply - called with (fan_speed, heater_level) when either
+                        one is due to change, the other one, or both,
+                        being None when unchanged
+                rate - ticks per second """
+        self.apply = apply
+        self.period = 1.0 / rate
+        self.table = None
+        self._lock = threading.Lock()
+        self._state = EMPTY
+        # playback position: _offset seconds in at monotonic _resumed,
+        # advancing only while playing
+        self._offset = 0.0
+        self._resumed = None
+        self._applied = (None, None)
+        self._late_max = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+        # serializes starting the playback thread
+        self._thread_lock = threading.Lock()
+        # set, under _lock, once the playback thread has decided to exit
+        self._exiting = False
+
+    @property
+    def duration(self):
+        return self.table.duration if self.table is not None else 0.0
+
+    @property
+    def state(self):
+        return self._state
+
+    def elapsed(self, now=None):
+        """ Seconds into the profile. """
+        with self._lock:
+            return self._elapsed(now)
+
+    def _elapsed(self, now):
+        if self._state != PLAYING:
+            return self._offset
+        if now is None:
+            now = time.monotonic()
+        return min(self._offset + now - self._resumed, self.duration)
+
+    def setpoint(self, now=None):
+        """ The bean temperature setpoint at monotonic time now, for
+            pid.PidLoop.set_profile(). Held while paused or finished. """
+        with self._lock:
+            if self.table is None:
+                return None
+            return self.table.bean_temp(self._elapsed(now))
+
+    def load(self, table):
+        """ Stops any playback and loads a new profile, at its start. """
+        self.stop()
+        with self._lock:
+            self.table = table
+            self._state = STOPPED
+            self._offset = 0.0
+
+    def play(self):
+        """ Plays from the current position, from the start once the
+            profile is over. Returns False if no profile is loaded. """
+        with self._lock:
+            if self.table is None:
+                return False
+            if self._state == PLAYING:
+                return True
+            if self._state == FINISHED:
+                self._offset = 0.0
+            self._resume()
+        self._start_thread()
+        return True
+
+    def pause(self):
+        """ Freezes the profile clock; setpoints hold until resumed. """
+        with self._lock:
+            if self._state == PLAYING:
+                self._offset = self._elapsed(None)
+                self._state = PAUSED
+
+    def resume(self):
+        with self._lock:
+            if self._state != PAUSED:
+                return False
+            self._resume()
+        self._start_thread()
+        return True
+
+    def _resume(self):
+        self._resumed = time.monotonic()
+        self._state = PLAYING
+        # apply every setpoint again from the new position
+        self._applied = (None, None)
+
+    def seek(self, position):
+        """ Moves to position seconds into the profile, keeping the
+            playing or paused state. """
+        with self._lock:
+            if self.table is None:
+                return False
+            self._offset = min(max(position, 0.0), self.duration)
+            if self._state == PLAYING:
+                self._resumed = time.monotonic()
+            elif self._state == FINISHED:
+                self._state = PAUSED
+            self._applied = (None, None)
+        return True
+
+    def stop(self, timeout=2.0):
+        """ Stops playback, rewinding to the start. """
+        self._stop_event.set()
+        if self._thread is not None:
+            if self._thread is not threading.current_thread():
+                self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            if self.table is not None:
+                self._state = STOPPED
+            self._offset = 0.0
+
+    def status(self):
+        """ Playback state and the setpoints due now. """
+        with self._lock:
+            elapsed = self._elapsed(None)
+            table = self.table
+            state = self._state
+        if table is not None:
+            bean_temp, fan_speed, heater_level = table.lookup(elapsed)
+        else:
+            bean_temp = fan_speed = heater_level = None
+        return {
+            'state': state,
+            'elapsed': elapsed,
+            'duration': self.duration,
+            'points': len(table.points) if table is not None else 0,
+            'bean_temp': bean_temp,
+            'fan_speed': fan_speed,
+            'heater_level': heater_level,
+            'late_max': self._late_max,
+        }
+
+    def _start_thread(self):
+        with self._thread_lock:
+            thread = self._thread
+            with self._lock:
+                exiting = self._exiting
+            if thread is not None and thread.is_alive():
+                if not exiting:
+                    return
+                # the profile finished, and the thread is on its way out
+                # without touching the player again
+                if thread is not threading.current_thread():
+                    thread.join()
+            self._stop_event.clear()
+            self._late_max = 0.0
+            with self._lock:
+                self._exiting = False
+            self._thread = threading.Thread(
+                target=self._run, name='profile-player')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def tick(self, now):
+        """ Applies the fan and heater setpoints due at monotonic time
+            now. Returns False once the profile is over. """
+        with self._lock:
+            if self._state != PLAYING:
+                return True
+            elapsed = self._elapsed(now)
+            bean_temp, fan, heater = self.table.lookup(elapsed)
+            last_fan, last_heater = self._applied
+            self._applied = (fan, heater)
+            finished = elapsed >= self.table.duration
+            if finished:
+                self._offset = self.table.duration
+                self._state = FINISHED
+                # _run() exits, play() must start a new thread
+                self._exiting = True
+        fan = fan if fan != last_fan else None
+        heater = heater if heater != last_heater else None
+        if fan is not None or heater is not None:
+            self.apply(fan, heater)
+        return not finished
+
+    def _run(self):
+        """ playback loop, at a fixed rate. """
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            late = now - next_time
+            if late > self._late_max:
+                self._late_max = late
+            try:
+                if not self.tick(now):
+                    break
+            except Exception:
+                logging.exception("ProfilePlayer._run - tick failed.")
+            next_time += self.period
+            now = time.monotonic()
+            if next_time < now:
+                next_time = now
+            self._stop_event.wait(next_time - now)
@@ -0,0 +1,82 @@
+"""
+readiness.py
+
+Tells the process that launched the server, such as the sr700api
+script, that the server is ready: listening, with a first bean
+temperature reading taken. The launcher passes the write end of a pipe,
+by file descriptor number in SR700API_READY_FD, and the server writes a
+single JSON line to it, with how long each startup phase took, instead
+of the launcher sleeping and polling the server until it answers.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import logging
+import os
+import time
+
+READY_FD_ENV = 'SR700API_READY_FD'
+
+
+class StartupTimer(object):
+    """ Times the phases of a server's startup, each from the end of
+        the previous one. """
+    def __init__(self):
+        self._last = time.monotonic()
+        self.phases = []
+
+    def mark(self, name):
+        """ ends the current phase, naming it. """
+        now = time.monotonic()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def timings(self):
+        """ {phase: seconds}, rounded to the millisecond. """
+        return dict((name, round(seconds, 3))
+                    for name, seconds in self.phases)
+
+
+def notify(ready, timer=None):
+    """ Writes the readiness line to the launcher's pipe, if any, and
+        closes it: ready is False when startup failed. Only the first
+        call writes anything. Returns True if the line was written. """
+    value = os.environ.pop(READY_FD_ENV, None)
+    if not value:
+        return False
+    message = {'ready': bool(ready), 'pid': os.getpid()}
+    if timer is not None:
+        message['timings'] = timer.timings()
+    try:
+        fd = int(value)
+        try:
+            os.write(fd, (json.dumps(message) + '\n').encode('utf-8'))
+        finally:
+            os.close(fd)
+    except (ValueError, OSError):
+        logging.exception(
+            "readiness.notify - could not notify the launcher on %s." %
+            value)
+        return False
+    return True
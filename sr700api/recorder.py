@@ -0,0 +1,500 @@
+"""
+recorder.py
+
+Durable roast recordings. RoastRecorder appends every sample taken
+during a roast to a file of fixed-width binary records, one file per
+roast, from a writer thread that flushes them in batches, so that the
+sampler never waits on the disk. RoastRecording memory-maps a recording,
+so that a long session can be sliced by time, replayed or exported to
+CSV or to an Artisan profile without reading it all into memory.
+
+Run as a script to export a recording:
+    python3 -m sr700api.recorder roast-20170601-101500.sr7rec --csv
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import csv
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from sr700api import history
+from sr700api import utils
+
+DEFAULT_RECORD_DIR = '~/.sr700api/roasts'
+EXTENSION = '.sr7rec'
+# suffix of the recording being written, dropped once the roast is over
+PARTIAL = '.part'
+
+# file header: magic, format version, record size, record count hint
+# (unused, 0), roast start wall clock time
+HEADER = struct.Struct('<8sHHId8x')
+MAGIC = b'SR700REC'
+VERSION = 1
+# one sample: timestamp, bean_temp (degC), junc_t (degC), current_temp
+# (degF), fan_speed, heater_level, state, faults. Unavailable
+# temperatures are NaN, unavailable settings -1, as in history.py.
+RECORD = struct.Struct('<dfffbbBB')
+FIELDS = (
+    'timestamp', 'bean_temp', 'junc_t', 'current_temp', 'fan_speed',
+    'heater_level', 'state', 'faults')
+
+# a roast starts when the roaster starts roasting, and ends once it is
+# idle or asleep again, so that cooling is part of the recording
+ROAST_START_STATES = ('roasting',)
+ROAST_END_STATES = ('idle', 'sleeping')
+
+# records read per block when iterating over a recording
+READ_BLOCK = 4096
+
+
+def record_dir():
+    """ Returns the recordings directory, or None if recording is
+        disabled by setting SR700API_RECORD_DIR to an empty string. """
+    path = os.environ.get('SR700API_RECORD_DIR', DEFAULT_RECORD_DIR)
+    if not path:
+        return None
+    return os.path.expanduser(path)
+
+
+class RoastRecorder(object):
+    """ Writes the samples of each roast to its own file in directory.
+        append() only packs the record and queues it; a writer thread
+        writes the queue out every flush_interval seconds, or as soon as
+        batch records are waiting, with a single write and fsync. """
+    def __init__(self, directory, flush_interval=1.0, batch=256):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.batch = batch
+        self._cond = threading.Condition()
+        # queued operations, in order: packed records, or ('open',
+        # timestamp) and ('close',) markers
+        self._pending = []
+        self._queued = 0
+        self._recording = False
+        self._stopping = False
+        self._thread = None
+        # writer thread state
+        self._file = None
+        self._path = None
+        self.current = None
+        self.written = 0
+        self.errors = 0
+
+    def append(self, timestamp, bean_temp, junc_t, current_temp,
+               fan_speed, heater_level, state, faults):
+        """ Records a sample, with the same arguments as
+            history.SampleHistory.append(). Samples outside of a roast
+            are dropped, as are all samples while the writer thread isn't
+            running. """
+        if self._thread is None:
+            return
+        starting = False
+        if not self._recording:
+            if state not in ROAST_START_STATES:
+                return
+            starting = True
+        elif state in ROAST_END_STATES:
+            with self._cond:
+                self._recording = False
+                self._pending.append(('close',))
+                self._cond.notify()
+            return
+        nan = float('nan')
+        record = RECORD.pack(
+            timestamp,
+            nan if bean_temp is None else bean_temp,
+            nan if junc_t is None else junc_t,
+            nan if current_temp is None else current_temp,
+            -1 if fan_speed is None else fan_speed,
+            -1 if heater_level is None else heater_level,
+            history.state_code(state), faults)
+        with self._cond:
+            if starting:
+                self._recording = True
+                self._pending.append(('open', timestamp))
+            self._pending.append(record)
+            self._queued += 1
+            if self._queued >= self.batch:
+                self._cond.notify()
+
+    def is_recording(self):
+        return self._recording
+
+    def start(self):
+        """ Starts the writer thread. """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name='roast-recorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """ Writes out everything queued, finishes the current
+            recording, if any, and stops the writer thread. """
+        with self._cond:
+            if self._recording:
+                self._recording = False
+                self._pending.append(('close',))
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        """ writer loop. """
+        while True:
+            with self._cond:
+                if not self._stopping and self._queued < self.batch:
+                    self._cond.wait(self.flush_interval)
+                pending, self._pending = self._pending, []
+                self._queued = 0
+                stopping = self._stopping
+            try:
+                self._write(pending)
+                if stopping:
+                    self._close()
+            except Exception:
+                self.errors += 1
+                logging.exception("RoastRecorder - write failed.")
+            if stopping:
+                return
+
+    def _write(self, pending):
+        """ writes out queued records, a batch at a time. """
+        records = []
+        for op in pending:
+            if isinstance(op, bytes):
+                records.append(op)
+                continue
+            if records:
+                self._write_records(records)
+                records = []
+            if op[0] == 'open':
+                self._open(op[1])
+            else:
+                self._close()
+        if records:
+            self._write_records(records)
+
+    def _write_records(self, records):
+        if self._file is None:
+            # the roast file couldn't be opened, nowhere to write these
+            return
+        self._file.write(b''.join(records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.written += len(records)
+
+    def _open(self, timestamp):
+        self._close()
+        stem = time.strftime('roast-%Y%m%d-%H%M%S', time.localtime(timestamp))
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # a roast started within the same second as the previous one gets
+        # a _2, _3... suffix, which sorts after it, rather than
+        # overwriting it
+        suffix = 1
+        while True:
+            name = stem + (
+                '_%d' % suffix if suffix > 1 else '') + EXTENSION
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path):
+                try:
+                    self._file = open(path + PARTIAL, 'xb')
+                    break
+                except FileExistsError:
+                    pass
+            suffix += 1
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0,
+                                     timestamp))
+        self._path = path
+        self.current = name
+
+    def _close(self):
+        """ finishes the current recording, giving it its final name. """
+        if self._file is None:
+            return
+        f, path = self._file, self._path
+        self._file = self._path = self.current = None
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(path + PARTIAL, path)
+
+
+def list_recordings(directory):
+    """ Returns the file names of the recordings in directory, oldest
+        first, including the one being written, if any. """
+    if directory is None or not os.path.isdir(directory):
+        return []
+    names = [n for n in os.listdir(directory)
+             if n.endswith(EXTENSION) or n.endswith(EXTENSION + PARTIAL)]
+    return sorted(names)
+
+
+def recording_path(directory, name):
+    """ Returns the path of a recording listed by list_recordings(), or
+        None if there is no such recording. """
+    if directory is None or name not in list_recordings(directory):
+        return None
+    return os.path.join(directory, name)
+
+
+class RoastRecording(object):
+    """ A recording, memory-mapped and read only. Records are tuples of
+        FIELDS values; a record cut short at the end of the file, by a
+        crash while writing it, is ignored. """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("RoastRecording - %s is empty." % path)
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise ValueError("RoastRecording - %s is truncated." % path)
+        magic, version, size, unused, start = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION or size != RECORD.size:
+            self.close()
+            raise ValueError(
+                "RoastRecording - %s is not a roast recording." % path)
+        self.start_time = start
+        self._count = (len(self._map) - HEADER.size) // RECORD.size
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def record(self, i):
+        return RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size)
+
+    def timestamp(self, i):
+        return struct.unpack_from(
+            '<d', self._map, HEADER.size + i * RECORD.size)[0]
+
+    def index(self, timestamp):
+        """ Binary search for the index of the first record at or after
+            timestamp. """
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def slice(self, start=None, end=None):
+        """ Returns the (first, stop) record indices of the samples taken
+            from start to end seconds into the roast. """
+        first = 0 if start is None else self.index(self.start_time + start)
+        stop = (self._count if end is None else
+                self.index(self.start_time + end))
+        return first, max(first, stop)
+
+    def records(self, first=0, stop=None):
+        """ Iterates over records first to stop, READ_BLOCK records at a
+            time, so only one block is ever copied out of the map. """
+        if stop is None or stop > self._count:
+            stop = self._count
+        while first < stop:
+            block = min(stop, first + READ_BLOCK)
+            data = self._map[HEADER.size + first * RECORD.size:
+                             HEADER.size + block * RECORD.size]
+            for record in RECORD.iter_unpack(data):
+                yield record
+            first = block
+
+    def summary(self):
+        """ Start time, duration and sample count. """
+        if self._count:
+            duration = self.timestamp(self._count - 1) - self.start_time
+        else:
+            duration = 0.0
+        return {
+            'start': self.start_time,
+            'duration': round(duration, 3),
+            'samples': self._count,
+        }
+
+    def csv_rows(self, first=0, stop=None):
+        """ Iterates over the CSV export lines of records first to stop,
+            header first. Unavailable values are left empty. """
+        yield ('timestamp,elapsed,bean_temp_c,junc_t_c,current_temp_f,'
+               'fan_speed,heater_level,state,faults\r\n')
+        rows = []
+        writer = csv.writer(_RowBuffer(rows))
+        for ts, bt, jt, ct, fan, heater, state, faults in self.records(
+                first, stop):
+            writer.writerow((
+                '%.3f' % ts,
+                '%.3f' % (ts - self.start_time),
+                '' if bt != bt else '%.2f' % bt,
+                '' if jt != jt else '%.2f' % jt,
+                '' if ct != ct else '%.1f' % ct,
+                '' if fan < 0 else fan,
+                '' if heater < 0 else heater,
+                history.STATES[state],
+                faults))
+            if len(rows) >= READ_BLOCK:
+                yield ''.join(rows)
+                del rows[:]
+        if rows:
+            yield ''.join(rows)
+
+    def artisan(self, first=0, stop=None, mode='C'):
+        """ Returns records first to stop as an Artisan profile, a dict
+            that encodes to JSON Artisan can load as an .alog file. ET
+            is the SR700's chamber temperature, BT the bean probe's;
+            unavailable temperatures are -1, as in Artisan. Fan speed
+            and heater level changes are Air and Burner events. """
+        if mode == 'C':
+            bt_convert, ct_convert = None, utils.f_to_c
+        else:
+            bt_convert, ct_convert = utils.c_to_f, None
+        timex, temp1, temp2 = [], [], []
+        events, types, values, strings = [], [], [], []
+        last_fan = last_heater = None
+        drop = 0
+        for i, (ts, bt, jt, ct, fan, heater, state, faults) in enumerate(
+                self.records(first, stop)):
+            timex.append(round(ts - self.start_time, 3))
+            if bt != bt:
+                temp2.append(-1)
+            else:
+                temp2.append(round(bt_convert(bt) if bt_convert else bt, 1))
+            if ct != ct:
+                temp1.append(-1)
+            else:
+                temp1.append(round(ct_convert(ct) if ct_convert else ct, 1))
+            # Artisan stores an event value v as v / 10 + 1
+            if fan >= 0 and fan != last_fan:
+                events.append(i)
+                types.append(0)
+                values.append(fan / 10.0 + 1.0)
+                strings.append('Fan %d' % fan)
+                last_fan = fan
+            if heater >= 0 and heater != last_heater:
+                events.append(i)
+                types.append(3)
+                values.append(heater / 10.0 + 1.0)
+                strings.append('Heater %d' % heater)
+                last_heater = heater
+            if not drop and history.STATES[state] == 'cooling':
+                drop = i
+        start = time.localtime(self.start_time)
+        return {
+            'version': '1.0',
+            'title': os.path.basename(self.path).split('.')[0],
+            'roastertype': 'FreshRoast SR700',
+            'mode': mode,
+            'roastdate': time.strftime('%a %b %d %Y', start),
+            'roastisodate': time.strftime('%Y-%m-%d', start),
+            'roasttime': time.strftime('%H:%M:%S', start),
+            'roastepoch': int(self.start_time),
+            'samplinginterval': (
+                round((timex[-1] - timex[0]) / (len(timex) - 1), 3)
+                if len(timex) > 1 else 0.0),
+            'timex': timex,
+            'temp1': temp1,
+            'temp2': temp2,
+            # CHARGE, DRY, FCs, FCe, SCs, SCe, DROP, COOL
+            'timeindex': [0, 0, 0, 0, 0, 0, drop, 0],
+            'etypes': ['Air', 'Drum', 'Damper', 'Burner', '--'],
+            'specialevents': events,
+            'specialeventstype': types,
+            'specialeventsvalue': values,
+            'specialeventsStrings': strings,
+        }
+
+
+def export_csv(path, start=None, end=None):
+    """ Iterates over the CSV export of a recording, from start to end
+        seconds into the roast, keeping it open until done. """
+    with RoastRecording(path) as rec:
+        first, stop = rec.slice(start, end)
+        for chunk in rec.csv_rows(first, stop):
+            yield chunk
+
+
+def export_artisan(path, start=None, end=None, mode='C'):
+    """ Returns the Artisan profile of a recording, from start to end
+        seconds into the roast. """
+    with RoastRecording(path) as rec:
+        first, stop = rec.slice(start, end)
+        return rec.artisan(first, stop, mode)
+
+
+class _RowBuffer(object):
+    """ file-like target collecting csv.writer output lines. """
+    def __init__(self, rows):
+        self.write = rows.append
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Exports an sr700api roast recording.')
+    parser.add_argument('path', help='recording file')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--csv', action='store_true',
+                       help='CSV export, the default')
+    group.add_argument('--artisan', action='store_true',
+                       help='Artisan profile JSON export')
+    parser.add_argument('--f', action='store_true',
+                        help='Artisan temperatures in deg F')
+    parser.add_argument('--start', type=float,
+                        help='seconds into the roast to export from')
+    parser.add_argument('--end', type=float,
+                        help='seconds into the roast to export to')
+    args = parser.parse_args()
+    if args.artisan:
+        json.dump(export_artisan(args.path, args.start, args.end,
+                                 'F' if args.f else 'C'),
+                  sys.stdout)
+        sys.stdout.write('\n')
+    else:
+        for chunk in export_csv(args.path, args.start, args.end):
+            sys.stdout.write(chunk)
@@ -29,13 +29,33 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-from flask import Flask
-from flask_restful import Resource, Api, reqparse, request
+from flask import Flask, Response, g
+import flask_restful
+from flask_restful import Resource, Api, request
 import logging
+import json
+import math
+import os
+import threading
+import time
 from sr700api.version import __version__
 import freshroastsr700
 from sr700api.max31855kdevice import Max31855kDevice as bp
+from sr700api.sampler import Max31855kSampler
+from sr700api import cache
+from sr700api import filters
+from sr700api import history
+from sr700api import lineserver
+from sr700api import metrics
+from sr700api import pid
+from sr700api import profile
+from sr700api import readiness
+from sr700api import recorder
+from sr700api import roasters
+from sr700api import serving
+from sr700api import spidevdevice
 from sr700api import utils as utils
+from sr700api import validation
 import logging
 logging.basicConfig(filename='sr700_restserver.log',level=logging.WARNING)
 
@@ -46,16 +66,418 @@ api = Api(app)
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.CRITICAL)
 
-# hardware interface
-device_bt = bp()  # bean temperature probe
-device_sr700 = freshroastsr700.freshroastsr700(ext_sw_heater_drive=True)
-# attempt to connect to sr700 device, or connect
-# later if not plugged in yet...
-device_sr700.auto_connect()
+# bean temperature probe sampling rate, in samples per second, and the
+# maximum age, in seconds, of a reading served by /bean_temp
+SAMPLE_RATE = float(os.environ.get('SR700API_SAMPLE_RATE', '4.0'))
+SAMPLE_MAX_AGE = 2.0
+# frames read per sample, and how they are reduced to one reading,
+# see sr700api.filters. Frames are spread over the sample period.
+SAMPLE_OVERSAMPLE = int(os.environ.get('SR700API_OVERSAMPLE', '1'))
+SAMPLE_FILTER = os.environ.get('SR700API_SAMPLE_FILTER', 'median')
+# Bus Pirate SPI clock, see Max31855kDevice._connect() for the values
+# it takes. Faster clocks shorten every frame transfer, which matters
+# most when oversampling, so the default is faster then.
+SPI_SPEED = os.environ.get(
+    'SR700API_SPI_SPEED', '1MHz' if SAMPLE_OVERSAMPLE > 1 else '30kHz')
+# bean probe driver on real hardware: 'buspirate', or 'spidev' for a
+# MAX31855K on a single-board computer's own SPI bus, see
+# sr700api.spidevdevice, along with its spidev device and SPI clock.
+PROBE_DRIVER = os.environ.get('SR700API_PROBE_DRIVER', 'buspirate')
+SPIDEV_DEVICE = os.environ.get(
+    'SR700API_SPIDEV', spidevdevice.DEFAULT_DEVICE)
+SPIDEV_SPEED = os.environ.get('SR700API_SPIDEV_SPEED', '4MHz')
+# server-side bean temperature PID control, see /pid: control ticks per
+# second, and starting gains in heater levels per degC (per degC second
+# for ki, per degC/s for kd). The gains are a starting point, not tuned.
+PID_RATE = 1.0
+PID_KP = 0.4
+PID_KI = 0.01
+PID_KD = 1.0
+# roast profile playback, see /profile: ticks per second
+PROFILE_RATE = 4.0
+# number of samples kept by /history, about 4.5 hours at 4 samples/s
+HISTORY_CAPACITY = 65536
+# roast recordings, see /roasts, None if disabled
+RECORD_DIR = recorder.record_dir()
+# hot path counters and latency histograms, see /metrics. When off
+# nothing is timed or counted, and /metrics isn't served.
+METRICS = metrics.enabled()
 
+# HTTP server: 'production' (cheroot, a thread pool with keep-alive),
+# 'development' (werkzeug) or 'auto', production when cheroot is
+# installed. Worker threads, connections allowed to queue for a free
+# worker, and the idle keep-alive timeout in seconds.
+SERVER_MODE = os.environ.get('SR700API_SERVER', 'auto')
+SERVER_PORT = 58700
+SERVER_THREADS = int(os.environ.get('SR700API_SERVER_THREADS', '8'))
+SERVER_QUEUE_SIZE = 16
+SERVER_KEEPALIVE = 10.0
+# /stream clients served at once. Each holds a worker thread for as
+# long as it stays connected, so most workers are kept for the other
+# resources; beyond this, /stream answers 503.
+STREAM_MAX_CLIENTS = int(os.environ.get(
+    'SR700API_STREAM_MAX_CLIENTS', str(max(SERVER_THREADS // 4, 1))))
 
-class TestEndpoint(Resource):
-    def get(self):
+# device backend, 'hardware' or 'simulated' (see sr700api.simulated).
+# The simulated backend's probe read latency, in seconds, its
+# probability of reporting a thermocouple fault and of losing the probe
+# connection on a read can also be set, as can the number of simulated
+# roasters, see /roasters.
+BACKEND = os.environ.get('SR700API_BACKEND', 'hardware')
+SIM_LATENCY = float(os.environ.get('SR700API_SIM_LATENCY', '0.005'))
+SIM_FAULT_RATE = float(os.environ.get('SR700API_SIM_FAULT_RATE', '0.0'))
+SIM_DISCONNECT_RATE = float(
+    os.environ.get('SR700API_SIM_DISCONNECT_RATE', '0.0'))
+SIM_ROASTERS = int(os.environ.get('SR700API_SIM_ROASTERS', '1'))
+
+
+def create_devices(ports=None):
+    """ A (bean temperature probe, roaster) pair of the configured
+        backend, on the given roasters.RoasterPorts if hardware. """
+    if BACKEND == 'simulated':
+        model = simulated.ThermalModel()
+        return (
+            simulated.SimulatedMax31855kDevice(
+                model, speed=SPI_SPEED, latency=SIM_LATENCY,
+                fault_rate=SIM_FAULT_RATE,
+                disconnect_rate=SIM_DISCONNECT_RATE),
+            simulated.SimulatedRoaster(model))
+    if ports is None:
+        ports = roasters.RoasterPorts(None, None)
+    if PROBE_DRIVER == 'spidev':
+        probe = spidevdevice.SpidevMax31855kDevice(
+            ports.bus_pirate or SPIDEV_DEVICE, speed=SPIDEV_SPEED)
+    else:
+        probe = bp(speed=SPI_SPEED, port=ports.bus_pirate)
+    return (
+        probe,
+        roasters.PinnedRoaster(port=ports.sr700, ext_sw_heater_drive=True))
+
+
+def create_sampler(device):
+    return Max31855kSampler(
+        device, rate=SAMPLE_RATE, max_age=SAMPLE_MAX_AGE,
+        oversample=SAMPLE_OVERSAMPLE, method=SAMPLE_FILTER)
+
+
+# hardware interface: the probe and roaster of every pair plugged in,
+# the first pair being the default roaster, see sr700api.roasters
+if BACKEND == 'simulated':
+    from sr700api import simulated
+    ROASTER_PORTS = [roasters.RoasterPorts(None, None)] * max(
+        SIM_ROASTERS, 1)
+else:
+    # with nothing plugged in yet, the default roaster takes the first
+    # pair found when it connects. A spidev probe is paired with the
+    # first SR700, unless SR700API_ROASTERS says otherwise.
+    ROASTER_PORTS = roasters.configured_ports(
+        [SPIDEV_DEVICE] if PROBE_DRIVER == 'spidev' else None) or [
+        roasters.RoasterPorts(None, None)]
+device_bt, device_sr700 = create_devices(ROASTER_PORTS[0])
+# serializes multi-step access to device_sr700 across request threads,
+# such as a write and its read-back, or a full snapshot
+device_lock = threading.RLock()
+# the sampler owns device_bt once started; handlers read its cached value
+sampler_bt = create_sampler(device_bt)
+# every probe sample, along with the roaster values at that time
+sample_history = history.SampleHistory(HISTORY_CAPACITY)
+# every sample taken during a roast, written to disk
+if RECORD_DIR is not None:
+    roast_recorder = recorder.RoastRecorder(RECORD_DIR)
+else:
+    roast_recorder = None
+
+# every roaster served, by id. The default roaster, served by the
+# top-level resources too, is the one above.
+roaster_registry = roasters.RoasterRegistry()
+default_roaster = roaster_registry.add(roasters.Roaster(
+    roasters.DEFAULT_ID, device_bt, device_sr700, device_lock, sampler_bt,
+    sample_history, ROASTER_PORTS[0]))
+for i, ports in enumerate(ROASTER_PORTS[1:], 1):
+    roaster_bt, roaster_sr700 = create_devices(ports)
+    roaster = roaster_registry.add(roasters.Roaster(
+        str(i), roaster_bt, roaster_sr700, threading.RLock(),
+        create_sampler(roaster_bt),
+        history.SampleHistory(HISTORY_CAPACITY), ports))
+    roaster.sampler.add_listener(roaster.record_sample)
+
+
+def roaster_values(func):
+    """ a metrics callback, func(roaster) of every roaster. """
+    return lambda: [((r.id,), func(r)) for r in roaster_registry]
+
+
+def probe_reading_age(roaster):
+    timestamp, age, reading = roaster.sampler.latest()
+    return age
+
+
+def packet_ages():
+    """ metrics callback, seconds since each roaster last sent a
+        packet, for those reporting them. """
+    return [((roaster_id,), last.age())
+            for roaster_id, last in sorted(roaster_packets.items())]
+
+
+def cache_lookups():
+    stats = response_cache.stats()
+    return [(('hit',), stats['hits']), (('miss',), stats['misses']),
+            (('not_modified',), stats['not_modified'])]
+
+
+def instrument_roaster(roaster):
+    """ hooks the devices of a roasters.Roaster up to the /metrics
+        histograms. Call before the roaster connects. """
+    roaster.device_bt.transfer_histogram = spi_transfer_seconds.labels(
+        roaster.id)
+    roaster.sampler.burst_histogram = sample_burst_seconds.labels(
+        roaster.id)
+    roaster.supervisor.recovery_histogram = (
+        probe_recovery_seconds.labels(roaster.id))
+    if hasattr(roaster.device_sr700, 'update_data_func'):
+        # freshroastsr700 calls it for every packet the roaster sends,
+        # the simulated roaster has no packets
+        last_packet = roaster_packets[roaster.id] = metrics.LastSeen()
+        roaster.device_sr700.update_data_func = last_packet.touch
+
+
+if METRICS:
+    metrics_registry = metrics.Registry()
+    request_seconds = metrics_registry.histogram(
+        'sr700api_request_seconds', 'REST request handling time.',
+        ('method', 'route', 'status'))
+    spi_transfer_seconds = metrics_registry.histogram(
+        'sr700api_spi_transfer_seconds',
+        'Bean probe SPI frame transfer time.', ('roaster',))
+    sample_burst_seconds = metrics_registry.histogram(
+        'sr700api_sample_burst_seconds',
+        'Bean probe sample time, all frames of a burst.', ('roaster',))
+    metrics_registry.counter_callback(
+        'sr700api_samples_total', 'Bean probe samples taken.',
+        ('roaster',), roaster_values(lambda r: r.sampler.stats()['samples']))
+    metrics_registry.gauge_callback(
+        'sr700api_sample_rate', 'Effective bean probe samples per second.',
+        ('roaster',),
+        roaster_values(lambda r: r.sampler.stats()['effective_rate']))
+    metrics_registry.gauge_callback(
+        'sr700api_probe_reading_age_seconds',
+        'Age of the latest bean probe reading.', ('roaster',),
+        roaster_values(probe_reading_age))
+    metrics_registry.counter_callback(
+        'sr700api_probe_connects_total', 'Bean probe connects.',
+        ('roaster',), roaster_values(lambda r: r.device_bt.connects))
+    metrics_registry.counter_callback(
+        'sr700api_probe_connection_losses_total',
+        'Bean probe connections lost to a serial error.', ('roaster',),
+        roaster_values(lambda r: r.device_bt.connection_losses))
+    probe_recovery_seconds = metrics_registry.histogram(
+        'sr700api_probe_recovery_seconds',
+        'Time from losing the bean probe connection to reconnecting.',
+        ('roaster',))
+    metrics_registry.counter_callback(
+        'sr700api_probe_reconnect_attempts_total',
+        'Bean probe reconnect attempts.', ('roaster',),
+        roaster_values(lambda r: r.supervisor.status()['attempts']))
+    metrics_registry.gauge_callback(
+        'sr700api_roaster_connected', 'Whether the SR700 is connected.',
+        ('roaster',),
+        roaster_values(lambda r: int(bool(r.device_sr700.connected))))
+    metrics_registry.gauge_callback(
+        'sr700api_roaster_packet_age_seconds',
+        'Seconds since the SR700 last sent a packet, that is the age of '
+        'its current_temp.', ('roaster',), packet_ages)
+    metrics_registry.counter_callback(
+        'sr700api_response_cache_lookups_total',
+        'Response cache lookups, by result.', ('result',), cache_lookups)
+    # roaster id: metrics.LastSeen of its latest packet
+    roaster_packets = {}
+    for roaster in roaster_registry:
+        instrument_roaster(roaster)
+else:
+    metrics_registry = None
+
+
+def record_sample(timestamp, reading):
+    """ sampler_bt listener, stores each probe reading and the current
+        roaster values in sample_history, and in the roast recording. """
+    sample = default_roaster.record_sample(timestamp, reading)
+    if roast_recorder is not None:
+        roast_recorder.append(*sample)
+
+
+sampler_bt.add_listener(record_sample)
+
+
+
+def sample_publisher(roaster):
+    """ a sampler listener pushing a snapshot of every value of a
+        roasters.Roaster to its /stream subscribers, if any. """
+    def publish_sample(timestamp, reading):
+        if roaster.broadcaster.has_subscribers():
+            roaster.broadcaster.publish(acquire_snapshot(roaster))
+    return publish_sample
+
+
+for roaster in roaster_registry:
+    roaster.sampler.add_listener(sample_publisher(roaster))
+
+
+def pid_input():
+    """ pid_loop input, the latest valid bean temperature in degC. """
+    if not device_bt.is_connected():
+        return None
+    reading = sampler_bt.read()
+    if reading is None or reading[1]:
+        # stale, or thermocouple fault
+        return None
+    return reading[0]
+
+
+def pid_output(level):
+    """ pid_loop output, the roaster heater level. """
+    with device_lock:
+        device_sr700.heater_level = level
+
+
+def pid_active():
+    """ pid_loop only controls while the roaster is roasting. """
+    return (device_sr700.connected and
+            device_sr700.get_roaster_state() == 'roasting')
+
+
+# bean temperature control loop, started through /pid
+pid_loop = pid.PidLoop(
+    pid.PidController(PID_KP, PID_KI, PID_KD, 0.0, 8.0),
+    pid_input, pid_output, rate=PID_RATE, is_active=pid_active)
+
+
+def profile_output(fan_speed, heater_level):
+    """ profile_player output, the fan speed and heater level that came
+        due. The heater is left to pid_loop while it runs. """
+    if not device_sr700.connected:
+        return
+    with device_lock:
+        if fan_speed is not None:
+            device_sr700.fan_speed = fan_speed
+        if heater_level is not None and not pid_loop.is_running():
+            device_sr700.heater_level = heater_level
+
+
+# roast profile playback, loaded and controlled through /profile
+profile_player = profile.ProfilePlayer(profile_output, rate=PROFILE_RATE)
+
+
+def connect_devices():
+    """ Attempts to connect every sr700 device, or connects later if not
+        plugged in yet, which each one's communication process does in
+        the background, and meanwhile looks for every bean probe, each
+        in its own thread, rather than one device after the other.
+        Returns once every probe was found, or not. """
+    for roaster in roaster_registry:
+        roaster.device_sr700.auto_connect()
+    finders = [
+        threading.Thread(
+            target=roaster.device_bt.find_connect,
+            name='probe-discovery-%s' % roaster.id)
+        for roaster in roaster_registry]
+    for finder in finders:
+        finder.start()
+    for finder in finders:
+        finder.join()
+
+
+def request_values():
+    """ PUT and POST arguments: the JSON body's values, else those of
+        the query string and form, as reqparse's default locations.
+        Unlike reqparse, a form-encoded body is not an error. """
+    values = request.values.to_dict()
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            values.update(body)
+    return values
+
+
+def json_field(name):
+    """ a value of the current request's JSON body, for arguments that
+        aren't flat values, or None. """
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            return body.get(name)
+    return None
+
+
+def parse_request(schema, source=None):
+    """ Returns the current request's arguments, checked against a
+        validation.Schema, from source or request_values(). Aborts with
+        reqparse's 400 response if they don't validate. """
+    if source is None:
+        source = request_values()
+    try:
+        return schema.parse(source)
+    except validation.ValidationError as e:
+        flask_restful.abort(400, **e.body)
+
+
+# encoded responses of the read-only resources, see sr700api.cache
+response_cache = cache.ResponseCache()
+
+
+def cached_response(key, token, render):
+    """ Serves a GET from response_cache, with an empty 304 when the
+        client's If-None-Match already names the current body. """
+    entry = response_cache.get(key, token, render)
+    if entry.status != 200:
+        return Response(entry.body, entry.status,
+                        mimetype='application/json')
+    if cache.etag_matches(entry.etag, request.headers.get('If-None-Match')):
+        response_cache.count_not_modified()
+        return Response(status=304, headers={'ETag': entry.etag})
+    return Response(entry.body, mimetype='application/json',
+                    headers={'ETag': entry.etag})
+
+
+class CachedResource(Resource):
+    """ A resource whose GET response only depends on a few device
+        values. Subclasses name their cache entry with cache_key, return
+        those values from cache_token(roaster), and build the response in
+        render(roaster), which is only called when the values change. """
+    cache_key = None
+
+    def cache_token(self, roaster):
+        return None
+
+    def get(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        return cached_response(
+            roaster.cache_key(self.cache_key), self.cache_token(roaster),
+            lambda: self.render(roaster))
+
+
+def find_roaster(roaster_id=None):
+    """ the roasters.Roaster a resource is requested for, the default
+        roaster for the top-level resources. Aborts with a 404 if there
+        is no such roaster. """
+    if roaster_id is None:
+        return default_roaster
+    roaster = roaster_registry.get(roaster_id)
+    if roaster is None:
+        flask_restful.abort(
+            404, error='No such roaster: ' + roaster_id + '.')
+    return roaster
+
+
+def roaster_token(roaster, name):
+    """ cache token of a resource reporting a device_sr700 value. """
+    device = roaster.device_sr700
+    return device.connected, getattr(device, name)
+
+
+class TestEndpoint(CachedResource):
+    cache_key = 'test'
+
+    def render(self, roaster):
         return {
             'project': 'sr700api',
             'version': __version__
@@ -63,15 +485,31 @@ class TestEndpoint(Resource):
 
 
 class BeanTemperature(Resource):
-    def get(self):
-        if device_bt.is_connected():
-            probe_t, fault, junc_t, scv, scg, oc = device_bt.read()
+    def get(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        if roaster.device_bt.is_connected():
+            reading = roaster.sampler.read()
+            if reading is None:
+                return ({
+                    'bean_temp_c': '0.0',
+                    'bean_temp_f': '0.0',
+                    'fault': 1,
+                    'junc_t_c': '0.0',
+                    'junc_t_f': '0.0',
+                    'fault_scv': 0,
+                    'fault_scg': 0,
+                    'fault_oc': 0,
+                    'error': 'No recent reading available.'
+                },
+                503
+                )
+            probe_t, fault, junc_t, scv, scg, oc = reading
             return {
-                'bean_temp_c': "%s" % round(probe_t, 1),
-                'bean_temp_f': "%s" % round(utils.c_to_f(probe_t), 1),
+                'bean_temp_c': utils.format_temp(probe_t),
+                'bean_temp_f': utils.format_temp(utils.c_to_f(probe_t)),
                 'fault': fault,
-                'junc_t_c': "%s" % round(junc_t, 1),
-                'junc_t_f': "%s" % round(utils.c_to_f(junc_t), 1),
+                'junc_t_c': utils.format_temp(junc_t),
+                'junc_t_f': utils.format_temp(utils.c_to_f(junc_t)),
                 'fault_scv': scv,
                 'fault_scg': scg,
                 'fault_oc': oc,
@@ -94,20 +532,25 @@ class BeanTemperature(Resource):
             )
 
 
-class FanSpeed(Resource):
+class FanSpeed(CachedResource):
     """ allows reading & writing of fan speed."""
-    def __init__(self, *args, **kwargs):
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument(
+    cache_key = 'fan_speed'
+
+    schema = validation.Schema(
+        validation.Argument(
             'fan_speed', type=int, choices=range(1, 10),
             required=True,
             help='Fan speed can be 1..9, wheere 1=min, 9=max'
-            )
+            ),
+        )
 
-    def get(self):
-        if device_sr700.connected:
+    def cache_token(self, roaster):
+        return roaster_token(roaster, 'fan_speed')
+
+    def render(self, roaster):
+        if roaster.device_sr700.connected:
             return {
-                'fan_speed': device_sr700.fan_speed
+                'fan_speed': roaster.device_sr700.fan_speed
             }
         else:
             return ({
@@ -116,12 +559,15 @@ class FanSpeed(Resource):
             503
             )
 
-    def put(self):
-        if device_sr700.connected:
-            kwargs = self.parser.parse_args()
+    def put(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        if roaster.device_sr700.connected:
+            kwargs = parse_request(self.schema)
             fs = kwargs['fan_speed']
             try:
-                device_sr700.fan_speed = fs
+                with roaster.lock:
+                    roaster.device_sr700.fan_speed = fs
+                response_cache.invalidate(roaster.cache_key('fan_speed'))
                 return {'fan_speed': fs}
             except freshroastsr700.exceptions.RoasterValueError:
                 return (
@@ -138,18 +584,19 @@ class TimeRemaining(Resource):
         doesn't really make sense on a non-ramp/soak method of operation,
         which is what the freshroastsr700 package was designed for.
         This often remains unused."""
-    def __init__(self, *args, **kwargs):
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument(
+    schema = validation.Schema(
+        validation.Argument(
             'time_remaining', type=int, choices=range(1, 600),
             required=True,
             help='Time remaining can be 1..599 seconds.'
-            )
+            ),
+        )
 
-    def get(self):
-        if device_sr700.connected:
+    def get(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        if roaster.device_sr700.connected:
             return {
-                'time_remaining': device_sr700.time_remaining
+                'time_remaining': roaster.device_sr700.time_remaining
             }
         else:
             return ({
@@ -158,12 +605,14 @@ class TimeRemaining(Resource):
             503
             )
 
-    def put(self):
-        if device_sr700.connected:
-            kwargs = self.parser.parse_args()
+    def put(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        if roaster.device_sr700.connected:
+            kwargs = parse_request(self.schema)
             value = kwargs['time_remaining']
             try:
-                device_sr700.time_remaining = value
+                with roaster.lock:
+                    roaster.device_sr700.time_remaining = value
                 return {'time_remaining': value}
             except freshroastsr700.exceptions.RoasterValueError:
                 return (
@@ -175,29 +624,35 @@ class TimeRemaining(Resource):
                     )
 
 
-class TargetTemp(Resource):
+class TargetTemp(CachedResource):
     """ When freshroastsr700 is in thermostat mode, this is the set
         point value for the chamber temperature."""
-    def __init__(self, *args, **kwargs):
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument(
+    cache_key = 'target_temp'
+
+    schema = validation.Schema(
+        validation.Argument(
             'target_temp_c', type=int, choices=range(150, 551),
             help='target_temp can be 150..550 deg F.  Note that '
                  'hardware seems to limit this to 520F.'
-            )
-        self.parser.add_argument(
+            ),
+        validation.Argument(
             'target_temp_f', type=int, choices=range(150, 551),
             help='target_temp can be 150..550 deg F.  Note that '
                  'hardware seems to limit this to 520F.'
-            )
+            ),
+        )
 
-    def get(self):
-        if device_sr700.connected:
+    def cache_token(self, roaster):
+        return roaster_token(roaster, 'target_temp')
+
+    def render(self, roaster):
+        device = roaster.device_sr700
+        if device.connected:
             # note we're dealing in whole numbers here.
             return {
-                'target_temp_f': round(device_sr700.target_temp, 0),
+                'target_temp_f': round(device.target_temp, 0),
                 'target_temp_c': round(
-                    utils.f_to_c(device_sr700.target_temp), 0)
+                    utils.f_to_c(device.target_temp), 0)
             }
         else:
             return ({
@@ -206,9 +661,10 @@ class TargetTemp(Resource):
             503
             )
 
-    def put(self):
-        if device_sr700.connected:
-            kwargs = self.parser.parse_args()
+    def put(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        if roaster.device_sr700.connected:
+            kwargs = parse_request(self.schema)
             value_c = kwargs['target_temp_c']
             value_f = kwargs['target_temp_f']
             if value_f is None:
@@ -223,11 +679,14 @@ class TargetTemp(Resource):
                         400
                         )
             try:
-                device_sr700.target_temp = value_f
+                with roaster.lock:
+                    roaster.device_sr700.target_temp = value_f
+                    value_f = roaster.device_sr700.target_temp
+                response_cache.invalidate(roaster.cache_key('target_temp'))
                 return {
-                        'target_temp_f': device_sr700.target_temp,
+                        'target_temp_f': value_f,
                         'target_temp_c': int(
-                            round(utils.f_to_c(device_sr700.target_temp), 0))
+                            round(utils.f_to_c(value_f), 0))
                     }
             except freshroastsr700.exceptions.RoasterValueError:
                 return (
@@ -239,14 +698,20 @@ class TargetTemp(Resource):
                     )
 
 
-class CurrentTemp(Resource):
+class CurrentTemp(CachedResource):
     """ This is the sr700's current chamber temperature (below the beans)."""
-    def get(self):
-        if device_sr700.connected:
+    cache_key = 'current_temp'
+
+    def cache_token(self, roaster):
+        return roaster_token(roaster, 'current_temp')
+
+    def render(self, roaster):
+        device = roaster.device_sr700
+        if device.connected:
             return {
-                'current_temp_f': round(device_sr700.current_temp, 1),
+                'current_temp_f': round(device.current_temp, 1),
                 'current_temp_c':
-                round(utils.f_to_c(device_sr700.current_temp), 1)
+                round(utils.f_to_c(device.current_temp), 1)
             }
         else:
             return ({
@@ -258,8 +723,9 @@ class CurrentTemp(Resource):
 
 class Dummy(Resource):
     """ Returns a 0 reading at all times, when hardware connected."""
-    def get(self):
-        if device_sr700.connected:
+    def get(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        if roaster.device_sr700.connected:
             return {
                 'dummy': 0
             }
@@ -271,22 +737,27 @@ class Dummy(Resource):
             )
 
 
-class HeaterLevel(Resource):
+class HeaterLevel(CachedResource):
     """ allows reading & writing of heater level. In this implementation,
         the number of heater segments is left to its default of 8,
         whichc means the acceptable range is 0 to 8 inclusive."""
-    def __init__(self, *args, **kwargs):
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument(
+    cache_key = 'heater_level'
+
+    schema = validation.Schema(
+        validation.Argument(
             'heater_level', type=int, choices=range(0, 9),
             required=True,
             help='Heater Level can be 0..8, wheere 0=off, 8=max'
-            )
+            ),
+        )
 
-    def get(self):
-        if device_sr700.connected:
+    def cache_token(self, roaster):
+        return roaster_token(roaster, 'heater_level')
+
+    def render(self, roaster):
+        if roaster.device_sr700.connected:
             return {
-                'heater_level': device_sr700.heater_level
+                'heater_level': roaster.device_sr700.heater_level
             }
         else:
             return ({
@@ -295,12 +766,15 @@ class HeaterLevel(Resource):
             503
             )
 
-    def put(self):
-        if device_sr700.connected:
-            kwargs = self.parser.parse_args()
+    def put(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        if roaster.device_sr700.connected:
+            kwargs = parse_request(self.schema)
             value = kwargs['heater_level']
             try:
-                device_sr700.heater_level = value
+                with roaster.lock:
+                    roaster.device_sr700.heater_level = value
+                response_cache.invalidate(roaster.cache_key('heater_level'))
                 return {'heater_level': value}
             except freshroastsr700.exceptions.RoasterValueError:
                 return (
@@ -312,16 +786,26 @@ class HeaterLevel(Resource):
                     )
 
 
-class State(Resource):
+# settable states, and the freshroastsr700 method entering each
+STATE_SETTERS = {
+    'idle': 'idle',
+    'roasting': 'roast',
+    'cooling': 'cool',
+    'sleeping': 'sleep',
+}
+
+
+class State(CachedResource):
     """
     allows reading/writing of SR700 state. States can be set, but have
     no effect unless the hardware is detected and time_remaining is
     greater than zero. When time_remaining counts down to 0, the software
     automatically changes the state to idle."""
 
-    def __init__(self, *args, **kwargs):
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument(
+    cache_key = 'state'
+
+    schema = validation.Schema(
+        validation.Argument(
             'state', type=str,
             required=True,
             choices=(
@@ -333,11 +817,16 @@ class State(Resource):
             help='Current state ' +
                  'of freshroastsr700 module as a string. Possible values: ' +
                  'idle, roasting, cooling, sleeping.'
-            )
+            ),
+        )
 
-    def get(self):
-        if device_sr700.connected:
-            return {'state': device_sr700.get_roaster_state()}
+    def cache_token(self, roaster):
+        device = roaster.device_sr700
+        return device.connected, device.get_roaster_state()
+
+    def render(self, roaster):
+        if roaster.device_sr700.connected:
+            return {'state': roaster.device_sr700.get_roaster_state()}
         else:
             return ({
                 'error': 'Hardware not connected.'
@@ -345,18 +834,15 @@ class State(Resource):
             503
             )
 
-    def put(self):
-        if device_sr700.connected:
-            args = self.parser.parse_args()
+    def put(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        if roaster.device_sr700.connected:
+            args = parse_request(self.schema)
             state = args['state']
-            if state == 'idle':
-                device_sr700.idle()
-            elif state == 'roasting':
-                device_sr700.roast()
-            elif state == 'cooling':
-                device_sr700.cool()
-            elif state == 'sleeping':
-                device_sr700.sleep()
+            if state in STATE_SETTERS:
+                with roaster.lock:
+                    getattr(roaster.device_sr700, STATE_SETTERS[state])()
+                response_cache.invalidate(roaster.cache_key('state'))
             else:
                 # no way to set other states
                 return(
@@ -379,37 +865,953 @@ class State(Resource):
             )
 
 
+def acquire_snapshot(roaster=None):
+    """ Reads every probe and roaster value of a roasters.Roaster, the
+        default roaster if None, exactly once.
+        Returns a dict of raw values, with probe temperatures in degC and
+        roaster temperatures in degF, as reported by the hardware. Values
+        from a device that is not connected (or a stale probe reading)
+        are left out."""
+    if roaster is None:
+        roaster = default_roaster
+    snap = {'timestamp': time.time()}
+    if roaster.device_bt.is_connected():
+        timestamp, age, reading = roaster.sampler.latest()
+        if reading is not None and age <= roaster.sampler.max_age:
+            probe_t, fault, junc_t, scv, scg, oc = reading
+            snap['bean_temp'] = probe_t
+            snap['junc_t'] = junc_t
+            snap['fault'] = fault
+            snap['fault_scv'] = scv
+            snap['fault_scg'] = scg
+            snap['fault_oc'] = oc
+            snap['bean_temp_age'] = age
+    device = roaster.device_sr700
+    if device.connected:
+        # hold off writers, so the values are consistent with each other
+        with roaster.lock:
+            snap['current_temp'] = device.current_temp
+            snap['target_temp'] = device.target_temp
+            snap['fan_speed'] = device.fan_speed
+            snap['heater_level'] = device.heater_level
+            snap['time_remaining'] = device.time_remaining
+            snap['state'] = device.get_roaster_state()
+        snap['dummy'] = 0
+    return snap
+
+
+# snapshot temperature fields: native unit, and a formatter matching the
+# one used by the corresponding single-value resource.
+SNAPSHOT_TEMPS = {
+    'bean_temp': ('c', utils.format_temp),
+    'junc_t': ('c', utils.format_temp),
+    'current_temp': ('f', lambda t: round(t, 1)),
+    'target_temp': ('f', lambda t: round(t, 0)),
+}
+SNAPSHOT_FIELDS = (
+    'bean_temp', 'junc_t', 'fault', 'fault_scv', 'fault_scg', 'fault_oc',
+    'current_temp', 'target_temp', 'fan_speed', 'heater_level',
+    'time_remaining', 'state', 'dummy',
+)
+
+
+def format_snapshot(snap, fields=SNAPSHOT_FIELDS, units='both'):
+    """ Formats the output of acquire_snapshot() for a REST response.
+        Temperatures are reported as <field>_c and/or <field>_f depending
+        on units ('c', 'f' or 'both'), everything else as <field>."""
+    body = {'timestamp': snap['timestamp']}
+    missing = []
+    for field in fields:
+        if field not in snap:
+            missing.append(field)
+            continue
+        value = snap[field]
+        if field in SNAPSHOT_TEMPS:
+            native, fmt = SNAPSHOT_TEMPS[field]
+            if native == 'c':
+                value_c, value_f = value, utils.c_to_f(value)
+            else:
+                value_c, value_f = utils.f_to_c(value), value
+            if units != 'f':
+                body[field + '_c'] = fmt(value_c)
+            if units != 'c':
+                body[field + '_f'] = fmt(value_f)
+        else:
+            body[field] = value
+    if 'bean_temp' in fields and 'bean_temp_age' in snap:
+        body['bean_temp_age'] = round(snap['bean_temp_age'], 3)
+    if missing:
+        body['error'] = 'Not available: ' + ', '.join(missing) + '.'
+    else:
+        body['error'] = 'None'
+    return body
+
+
+class Snapshot(Resource):
+    """ Returns every probe and roaster value from a single acquisition,
+        so that a client can take a complete sample in one request.
+        Optional query arguments:
+            fields - comma-separated list of fields, defaults to all.
+            units - c, f or both (default)."""
+    schema = validation.Schema(
+        validation.Argument(
+            'fields', type=str,
+            help='Comma-separated list of fields. Possible values: ' +
+                 ', '.join(SNAPSHOT_FIELDS) + '.'
+            ),
+        validation.Argument(
+            'units', type=str, default='both',
+            choices=('c', 'f', 'both'),
+            help='Temperature units can be c, f or both.'
+            ),
+        )
+
+    def get(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        args = parse_request(self.schema, request.args)
+        if args['fields']:
+            fields = [f for f in args['fields'].split(',') if f]
+            unknown = [f for f in fields if f not in SNAPSHOT_FIELDS]
+            if unknown:
+                return(
+                    {
+                        'message':
+                        {
+                            'fields':
+                            'Unknown field(s): ' + ', '.join(unknown) + '.'
+                        }
+                    },
+                    400
+                    )
+        else:
+            fields = SNAPSHOT_FIELDS
+        if not (roaster.device_bt.is_connected() or
+                roaster.device_sr700.connected):
+            return ({
+                'error': 'Hardware not connected.'
+            },
+            503
+            )
+        return format_snapshot(
+            acquire_snapshot(roaster), fields, args['units'])
+
+
+def _history_temps(values, native, units, name, body):
+    """ adds a temperature column to a /history response body, in the
+        requested units, with NaN placeholders turned into nulls."""
+    if native == 'c':
+        to_c, to_f = None, utils.c_to_f
+    else:
+        to_c, to_f = utils.f_to_c, None
+    for unit, convert in (('c', to_c), ('f', to_f)):
+        if units != 'both' and units != unit:
+            continue
+        if convert is None:
+            column = values
+        else:
+            # the whole column at once
+            column = convert(values)
+        # NaN, value was not available
+        body[name + '_' + unit] = [
+            None if v != v else round(v, 1) for v in column]
+
+
+def history_body(since, limit, units, roaster=None):
+    """ builds a /history response body, see History, from the
+        history of a roasters.Roaster, the default roaster if None."""
+    if roaster is None:
+        roaster = default_roaster
+    samples = roaster.history.since(since, limit)
+    timestamps = samples['timestamp']
+    body = {'timestamp': [round(t, 3) for t in timestamps]}
+    _history_temps(samples['bean_temp'], 'c', units, 'bean_temp', body)
+    _history_temps(samples['junc_t'], 'c', units, 'junc_t', body)
+    _history_temps(
+        samples['current_temp'], 'f', units, 'current_temp', body)
+    body['fan_speed'] = samples['fan_speed']
+    body['heater_level'] = samples['heater_level']
+    body['state'] = samples['state']
+    body['faults'] = samples['faults']
+    body['states'] = history.STATES
+    body['count'] = len(timestamps)
+    body['overwritten'] = samples['overwritten']
+    if timestamps:
+        body['next_since'] = timestamps[-1]
+    else:
+        body['next_since'] = since
+    return body
+
+
+class History(Resource):
+    """ Returns the samples taken after a given time, as columns.
+        Optional query arguments:
+            since - wall clock timestamp, in seconds. Only samples newer
+                    than this are returned. Pass the previous response's
+                    next_since to catch up. Defaults to all samples.
+            limit - maximum number of samples to return.
+            units - c, f or both (default).
+        state values are indices into the returned states list, faults
+        are bitmasks of 1=fault, 2=scv, 4=scg, 8=oc. Unavailable values
+        are null (temperatures) or -1 (fan_speed, heater_level)."""
+    schema = validation.Schema(
+        validation.Argument(
+            'since', type=float,
+            help='since must be a timestamp, in seconds.'
+            ),
+        validation.Argument(
+            'limit', type=int,
+            help='limit must be a positive integer.'
+            ),
+        validation.Argument(
+            'units', type=str, default='both',
+            choices=('c', 'f', 'both'),
+            help='Temperature units can be c, f or both.'
+            ),
+        )
+
+    def get(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        args = parse_request(self.schema, request.args)
+        if args['limit'] is not None and args['limit'] < 1:
+            return(
+                {
+                    'message':
+                    {
+                        'limit': 'limit must be a positive integer.'
+                    }
+                },
+                400
+                )
+        return history_body(
+            args['since'], args['limit'], args['units'], roaster)
+
+
+# seconds between keep-alive comments on an idle /stream connection
+STREAM_HEARTBEAT = 15.0
+# a worker thread may only be held by STREAM_MAX_CLIENTS streams
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_CLIENTS)
+
+
+class Stream(Resource):
+    """ Pushes every new sample to the client as Server-Sent Events, in
+        the same format as /snapshot. Optional query arguments:
+            fields - comma-separated list of fields, defaults to all.
+            units - c, f or both (default).
+            interval - minimum seconds between events, defaults to 0,
+                       i.e. every sample.
+        Each event carries the number of events dropped so far for this
+        client, because it was not reading fast enough. At most
+        STREAM_MAX_CLIENTS streams are served at once, returns 503
+        beyond that."""
+    schema = validation.Schema(
+        validation.Argument(
+            'fields', type=str,
+            help='Comma-separated list of fields. Possible values: ' +
+                 ', '.join(SNAPSHOT_FIELDS) + '.'
+            ),
+        validation.Argument(
+            'units', type=str, default='both',
+            choices=('c', 'f', 'both'),
+            help='Temperature units can be c, f or both.'
+            ),
+        validation.Argument(
+            'interval', type=float, default=0.0,
+            help='interval must be a number of seconds.'
+            ),
+        )
+
+    def get(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        args = parse_request(self.schema, request.args)
+        if args['fields']:
+            fields = [f for f in args['fields'].split(',') if f]
+            unknown = [f for f in fields if f not in SNAPSHOT_FIELDS]
+            if unknown:
+                return(
+                    {
+                        'message':
+                        {
+                            'fields':
+                            'Unknown field(s): ' + ', '.join(unknown) + '.'
+                        }
+                    },
+                    400
+                    )
+        else:
+            fields = SNAPSHOT_FIELDS
+        units = args['units']
+        if not stream_slots.acquire(blocking=False):
+            return(
+                {
+                    'error':
+                    'Too many /stream clients, at most %d.' %
+                    STREAM_MAX_CLIENTS
+                },
+                503
+                )
+        sub = roaster.broadcaster.subscribe(
+            min_interval=max(args['interval'], 0.0))
+
+        def close():
+            # the generator's finally clause doesn't run if the client
+            # left before the first event
+            sub.close()
+            stream_slots.release()
+
+        def events():
+            event_id = 0
+            try:
+                # tell the client how long to wait before reconnecting
+                yield 'retry: 1000\n\n'
+                while not sub.closed:
+                    snap = sub.get(timeout=STREAM_HEARTBEAT)
+                    if snap is None:
+                        yield ': keep-alive\n\n'
+                        continue
+                    body = format_snapshot(snap, fields, units)
+                    body['dropped'] = sub.dropped
+                    event_id += 1
+                    yield 'id: %d\nevent: sample\ndata: %s\n\n' % (
+                        event_id, json.dumps(body))
+            finally:
+                # client went away, or server is shutting down
+                sub.close()
+
+        response = Response(
+            events(),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+        response.call_on_close(close)
+        return response
+
+
+def configure_sampler(roaster, rate, oversample, method):
+    """ Applies /sampler settings to the sampler of a roasters.Roaster,
+        and restarts its statistics. Returns the sampler's stats. """
+    roaster.sampler.configure(rate, oversample, method)
+    roaster.sampler.reset_stats()
+    return roaster.sampler.stats()
+
+
+class Sampler(Resource):
+    """ Reports the bean probe acquisition settings and timing, and
+        allows changing them. Times are in seconds, rates in samples
+        per second. A burst is the set of oversampled frames that are
+        reduced into one sample."""
+    schema = validation.Schema(
+        validation.Argument(
+            'rate', type=float, bounds=(0.1, 50.0),
+            help='rate can be 0.1..50 samples per second.'
+            ),
+        validation.Argument(
+            'oversample', type=int, choices=range(1, 33),
+            help='oversample can be 1..32 frames per sample.'
+            ),
+        validation.Argument(
+            'method', type=str, choices=tuple(filters.FILTERS),
+            help='method can be ' + ', '.join(filters.FILTERS) + '.'
+            ),
+        )
+
+    def get(self, roaster_id=None):
+        return find_roaster(roaster_id).sampler.stats()
+
+    def put(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        args = parse_request(self.schema)
+        return configure_sampler(
+            roaster, args['rate'], args['oversample'], args['method'])
+
+
+# settings accepted by /command, in the order they are applied. The
+# state goes last, so that a state change takes effect with the new
+# settings already in place.
+COMMAND_SETTINGS = (
+    'fan_speed', 'heater_level', 'target_temp', 'time_remaining', 'state')
+
+
+def roaster_settings(roaster):
+    """ the current /command settings of a roasters.Roaster. Call with
+        roaster.lock held. """
+    device = roaster.device_sr700
+    return {
+        'fan_speed': device.fan_speed,
+        'heater_level': device.heater_level,
+        'target_temp_f': device.target_temp,
+        'target_temp_c': int(
+            round(utils.f_to_c(device.target_temp), 0)),
+        'time_remaining': device.time_remaining,
+        'state': device.get_roaster_state()
+    }
+
+
+def apply_command(args, roaster=None):
+    """ Applies the settings parsed by Command.schema to a
+        roasters.Roaster, the default roaster if None, in a single
+        critical section. Returns (body, status), the body being the
+        roaster settings once applied. """
+    if args['target_temp_f'] is None and args['target_temp_c'] is not None:
+        args['target_temp_f'] = int(
+            round(utils.c_to_f(args['target_temp_c']), 0))
+    settings = {
+        'fan_speed': args['fan_speed'],
+        'heater_level': args['heater_level'],
+        'target_temp': args['target_temp_f'],
+        'time_remaining': args['time_remaining'],
+        'state': args['state']
+    }
+    if all(value is None for value in settings.values()):
+        return {
+            'error': 'Must supply at least one of ' +
+                     ', '.join(COMMAND_SETTINGS) + '.'
+        }, 400
+    if roaster is None:
+        roaster = default_roaster
+    device = roaster.device_sr700
+    if not device.connected:
+        return {'error': 'Hardware not connected.'}, 503
+    try:
+        with roaster.lock:
+            for name in COMMAND_SETTINGS:
+                value = settings[name]
+                if value is None:
+                    continue
+                if name == 'state':
+                    getattr(device, STATE_SETTERS[value])()
+                else:
+                    setattr(device, name, value)
+            body = roaster_settings(roaster)
+    except freshroastsr700.exceptions.RoasterValueError:
+        return {
+            'error': 'Could not set requested value. Out of range?'
+        }, 400
+    finally:
+        for name in COMMAND_SETTINGS:
+            if settings[name] is not None:
+                response_cache.invalidate(roaster.cache_key(name))
+    return body, 200
+
+
+class Command(Resource):
+    """ Applies several roaster settings at once, such as
+        fan_speed=7, heater_level=8 and state=roasting. Every value is
+        validated before any is applied, then all are applied under the
+        device lock, so no other request sees or interleaves with a
+        partial update. Accepts fan_speed, heater_level, target_temp_c
+        or target_temp_f, time_remaining and state, with the ranges of
+        the corresponding resources. Returns the resulting settings."""
+    schema = validation.Schema(
+        *[arg.optional() for arg in (
+            FanSpeed.schema.arguments + HeaterLevel.schema.arguments +
+            TargetTemp.schema.arguments + TimeRemaining.schema.arguments +
+            State.schema.arguments)],
+        strict=True
+        )
+
+    def get(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        if roaster.device_sr700.connected:
+            with roaster.lock:
+                return roaster_settings(roaster)
+        else:
+            return ({
+                'error': 'Hardware not connected.'
+            },
+            503
+            )
+
+    def put(self, roaster_id=None):
+        roaster = find_roaster(roaster_id)
+        return apply_command(parse_request(self.schema), roaster)
+
+
+RAMP_SOAK_HELP = (
+    'profile must be a list of segments, each with temp_c (0..300) or '
+    'temp_f (32..572), and ramp and soak times in seconds.')
+# segment temperatures, in degC, as /pid setpoint_c
+RAMP_SOAK_TEMP_C = (0.0, 300.0)
+
+
+def parse_ramp_soak(segments, start_temp):
+    """ Builds a profile.ProfileTable from /pid profile segments, such as
+        [{"temp_c": 150, "ramp": 240, "soak": 60}, ...]. The first ramp
+        starts from start_temp, in degC, if known.
+        Raises:
+            validation.ValidationError """
+    error = validation.ValidationError(
+        {'message': {'profile': RAMP_SOAK_HELP}})
+    if not isinstance(segments, list) or not segments:
+        raise error
+    parsed = []
+    try:
+        for segment in segments:
+            if 'temp_c' in segment:
+                temp = float(segment['temp_c'])
+            else:
+                temp = utils.f_to_c(float(segment['temp_f']))
+            ramp = float(segment.get('ramp', 0))
+            soak = float(segment.get('soak', 0))
+            low, high = RAMP_SOAK_TEMP_C
+            # NaN fails every comparison
+            if not low <= temp <= high:
+                raise error
+            if not (math.isfinite(ramp) and ramp >= 0 and
+                    math.isfinite(soak) and soak >= 0):
+                raise error
+            parsed.append((temp, ramp, soak))
+        if start_temp is None:
+            start_temp = parsed[0][0]
+        return profile.ramp_soak(parsed, start_temp)
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise error
+
+
+def pid_status():
+    """ the /pid response body. """
+    status = pid_loop.status()
+    for name in ('setpoint', 'measurement'):
+        value = status.pop(name)
+        key = 'bean_temp' if name == 'measurement' else name
+        if value is None:
+            status[key + '_c'] = status[key + '_f'] = None
+        else:
+            status[key + '_c'] = round(value, 1)
+            status[key + '_f'] = round(utils.c_to_f(value), 1)
+    if status['output'] is not None:
+        status['output'] = round(status['output'], 3)
+    if 'profile_elapsed' in status:
+        status['profile_elapsed'] = round(status['profile_elapsed'], 3)
+    status['timing'] = pid_loop.stats()
+    return status
+
+
+def start_pid():
+    """ Starts pid_loop, taking over from the current heater level.
+        Returns False if it has no setpoint to control towards. """
+    if pid_loop.setpoint() is None:
+        return False
+    with device_lock:
+        level = device_sr700.heater_level
+    if pid_loop.start(initial_output=level):
+        pid_loop.reset_stats()
+    return True
+
+
+def configure_pid(args, segments=None):
+    """ Applies /pid settings parsed by PidControl.schema, and an
+        optional list of ramp/soak segments. Returns (body, status). """
+    if segments is not None:
+        try:
+            table = parse_ramp_soak(segments, pid_input())
+        except validation.ValidationError as e:
+            return e.body, 400
+    controller = pid_loop.controller
+    for gain in ('kp', 'ki', 'kd'):
+        if args[gain] is not None:
+            setattr(controller, gain, args[gain])
+    if args['rate'] is not None:
+        pid_loop.set_rate(args['rate'])
+    if args['setpoint_f'] is not None:
+        pid_loop.set_setpoint(utils.f_to_c(args['setpoint_f']))
+    elif args['setpoint_c'] is not None:
+        pid_loop.set_setpoint(args['setpoint_c'])
+    if segments is not None:
+        # played back as any other profile, see /profile
+        profile_player.load(table)
+        profile_player.play()
+        pid_loop.set_profile(profile_player)
+    if args['enabled'] is True:
+        if not start_pid():
+            return {'error': 'Must supply a setpoint or profile.'}, 400
+    elif args['enabled'] is False and pid_loop.is_running():
+        # leaves a heater level set by hand alone
+        pid_loop.stop()
+    return pid_status(), 200
+
+
+class PidControl(Resource):
+    """ Server-side PID control of the default roaster's bean
+        temperature, through its heater level. Optional arguments:
+            enabled - true starts the control loop, false stops it and
+                      turns the heater off, if it was running.
+            setpoint_c or setpoint_f - a fixed bean temperature target.
+            profile - JSON body only, a ramp/soak profile replacing the
+                      setpoint, as a list of segments like
+                      {"temp_c": 200, "ramp": 300, "soak": 60}, ramping
+                      from the current bean temperature. It is loaded
+                      into, and played by, the /profile player.
+            kp, ki, kd - controller gains, per degC.
+            rate - control ticks per second.
+        The loop only acts while the roaster is roasting, and turns the
+        heater off whenever no valid bean temperature is available.
+        Returns the controller status and loop timing statistics."""
+    schema = validation.Schema(
+        validation.Argument(
+            'enabled', type=validation.boolean,
+            help='enabled can be true or false.'
+            ),
+        validation.Argument(
+            'setpoint_c', type=float, bounds=(0.0, 300.0),
+            help='setpoint_c can be 0..300 deg C.'
+            ),
+        validation.Argument(
+            'setpoint_f', type=float, bounds=(32.0, 572.0),
+            help='setpoint_f can be 32..572 deg F.'
+            ),
+        validation.Argument(
+            'kp', type=float, bounds=(0.0, 100.0),
+            help='kp can be 0..100.'
+            ),
+        validation.Argument(
+            'ki', type=float, bounds=(0.0, 100.0),
+            help='ki can be 0..100.'
+            ),
+        validation.Argument(
+            'kd', type=float, bounds=(0.0, 100.0),
+            help='kd can be 0..100.'
+            ),
+        validation.Argument(
+            'rate', type=float, bounds=(0.1, 10.0),
+            help='rate can be 0.1..10 control ticks per second.'
+            ),
+        )
+
+    def get(self):
+        return pid_status()
+
+    def put(self):
+        args = parse_request(self.schema)
+        return configure_pid(args, json_field('profile'))
+
+
+POINTS_HELP = (
+    'points must be a list of up to %d points in order of time, each '
+    'with a time in seconds up to %d, and any of bean_temp_c or '
+    'bean_temp_f (0..300 deg C), fan_speed (1..9) and heater_level '
+    '(0..8).' % (profile.MAX_POINTS, profile.MAX_DURATION))
+
+
+def parse_points(points):
+    """ Builds a profile.ProfileTable from /profile points, such as
+        [{"time": 0, "fan_speed": 9, "heater_level": 8},
+         {"time": 240, "bean_temp_c": 150}, ...].
+        Raises:
+            validation.ValidationError """
+    error = validation.ValidationError({'message': {'points': POINTS_HELP}})
+    if (not isinstance(points, list) or not points or
+            len(points) > profile.MAX_POINTS):
+        raise error
+    parsed = []
+    try:
+        for point in points:
+            if 'bean_temp_c' in point:
+                bean_temp = float(point['bean_temp_c'])
+            elif 'bean_temp_f' in point:
+                bean_temp = utils.f_to_c(float(point['bean_temp_f']))
+            else:
+                bean_temp = None
+            if bean_temp is not None and not 0.0 <= bean_temp <= 300.0:
+                raise error
+            fan_speed = point.get('fan_speed')
+            if fan_speed is not None:
+                fan_speed = int(fan_speed)
+                if not 1 <= fan_speed <= 9:
+                    raise error
+            heater_level = point.get('heater_level')
+            if heater_level is not None:
+                heater_level = int(heater_level)
+                if not 0 <= heater_level <= 8:
+                    raise error
+            parsed.append((
+                float(point['time']), bean_temp, fan_speed, heater_level))
+        return profile.ProfileTable(parsed)
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise error
+
+
+def profile_status():
+    """ the /profile response body. """
+    status = profile_player.status()
+    bean_temp = status.pop('bean_temp')
+    if bean_temp is None:
+        status['bean_temp_c'] = status['bean_temp_f'] = None
+    else:
+        status['bean_temp_c'] = round(bean_temp, 1)
+        status['bean_temp_f'] = round(utils.c_to_f(bean_temp), 1)
+    status['elapsed'] = round(status['elapsed'], 3)
+    status['late_max'] = round(status['late_max'], 4)
+    status['pid'] = (
+        pid_loop.profile is profile_player and pid_loop.is_running())
+    return status
+
+
+def configure_profile(args, points=None):
+    """ Applies /profile settings parsed by RoastProfile.schema, and an
+        optional list of points to load. Returns (body, status). """
+    if points is not None:
+        try:
+            table = parse_points(points)
+        except validation.ValidationError as e:
+            return e.body, 400
+        profile_player.load(table)
+    action = args['action']
+    if action is None and args['position'] is None:
+        return profile_status(), 200
+    if profile_player.table is None:
+        return {'error': 'No profile loaded.'}, 400
+    if action == 'seek' and args['position'] is None:
+        return {'message': {'position': RoastProfile.POSITION_HELP}}, 400
+    if args['position'] is not None:
+        profile_player.seek(args['position'])
+    if action == 'play':
+        profile_player.play()
+        if profile_player.table.has_bean_temp:
+            pid_loop.set_profile(profile_player)
+            if args['pid'] is True:
+                start_pid()
+    elif action == 'pause':
+        profile_player.pause()
+    elif action == 'resume':
+        profile_player.resume()
+    elif action == 'stop':
+        profile_player.stop()
+        if pid_loop.profile is profile_player and pid_loop.is_running():
+            # stops following the profile, and turns the heater off
+            pid_loop.stop()
+    return profile_status(), 200
+
+
+class RoastProfile(Resource):
+    """ Plays a roast profile back on the default roaster, on the
+        server's own clock. Optional arguments:
+            points - JSON body only, a new profile replacing the loaded
+                     one, as a list of points like
+                     {"time": 0, "fan_speed": 9, "heater_level": 6} or
+                     {"time": 300, "bean_temp_c": 160}. Bean
+                     temperatures are interpolated between points, fan
+                     speed and heater level hold until the next point
+                     setting them.
+            action - play, pause, resume, seek or stop.
+            position - seconds into the profile to move to.
+            pid - with play, also start the /pid loop, following the
+                  profile's bean temperatures. The profile's heater
+                  levels are ignored while the loop runs.
+        Returns the playback state and the setpoints due now."""
+    POSITION_HELP = 'position can be 0..%d seconds.' % profile.MAX_DURATION
+    schema = validation.Schema(
+        validation.Argument(
+            'action', type=str,
+            choices=('play', 'pause', 'resume', 'seek', 'stop'),
+            help='action can be play, pause, resume, seek or stop.'
+            ),
+        validation.Argument(
+            'position', type=float, bounds=(0.0, profile.MAX_DURATION),
+            help=POSITION_HELP
+            ),
+        validation.Argument(
+            'pid', type=validation.boolean,
+            help='pid can be true or false.'
+            ),
+        )
+
+    def get(self):
+        return profile_status()
+
+    def put(self):
+        args = parse_request(self.schema)
+        return configure_profile(args, json_field('points'))
+
+
+def roast_list():
+    """ the /roasts response body. """
+    roasts = []
+    for name in recorder.list_recordings(RECORD_DIR):
+        try:
+            with recorder.RoastRecording(
+                    os.path.join(RECORD_DIR, name)) as rec:
+                roast = rec.summary()
+        except (OSError, ValueError):
+            # unreadable, or still empty
+            continue
+        roast['name'] = name
+        roast['complete'] = name.endswith(recorder.EXTENSION)
+        roasts.append(roast)
+    return {
+        'enabled': roast_recorder is not None,
+        'recording': (
+            roast_recorder.current if roast_recorder is not None
+            else None),
+        'roasts': roasts,
+    }
+
+
+class Roasts(Resource):
+    """ Lists the roast recordings, oldest first, with their start time,
+        duration and number of samples. A roast is recorded from the
+        moment the roaster starts roasting until it is idle or asleep
+        again; the one being recorded is not complete yet. """
+    def get(self):
+        return roast_list()
+
+
+class RoastExport(Resource):
+    """ Exports a roast recording. Optional query arguments:
+            format - artisan (default), an Artisan profile, or csv.
+            start, end - seconds into the roast to export from and to.
+            units - c (default) or f, for the artisan format. """
+    schema = validation.Schema(
+        validation.Argument(
+            'format', type=str, default='artisan',
+            choices=('artisan', 'csv'),
+            help='format can be artisan or csv.'
+            ),
+        validation.Argument(
+            'start', type=float,
+            help='start must be a number of seconds.'
+            ),
+        validation.Argument(
+            'end', type=float,
+            help='end must be a number of seconds.'
+            ),
+        validation.Argument(
+            'units', type=str, default='c', choices=('c', 'f'),
+            help='Temperature units can be c or f.'
+            ),
+        )
+
+    def get(self, name):
+        args = parse_request(self.schema, request.args)
+        path = recorder.recording_path(RECORD_DIR, name)
+        if path is None:
+            return {'error': 'No such roast: ' + name + '.'}, 404
+        if args['format'] == 'csv':
+            return Response(
+                recorder.export_csv(path, args['start'], args['end']),
+                mimetype='text/csv',
+                headers={
+                    'Content-Disposition':
+                    'attachment; filename=' + name.split('.')[0] + '.csv'
+                })
+        return recorder.export_artisan(
+            path, args['start'], args['end'], args['units'].upper())
+
+
+class Roasters(Resource):
+    """ Lists the roasters served, the probe and roaster ports of each,
+        and whether they are connected. The default roaster, id 0, is
+        also served by the top-level resources; every roaster's are
+        under /roasters/<id>/, see ROASTER_RESOURCES. """
+    def get(self):
+        return {'roasters': roaster_registry.status()}
+
+
+class Metrics(Resource):
+    """ Request, SPI transfer and sample timing histograms, and hardware
+        counters, in the Prometheus text format. Only served when
+        METRICS is on. """
+    def get(self):
+        return Response(
+            metrics_registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+def observe_request(response):
+    """ times every request into request_seconds, by route pattern, so
+        that /roasters/<id>/... requests share a series. """
+    start = g.pop('request_start', None)
+    if start is not None:
+        rule = request.url_rule
+        request_seconds.observe(time.perf_counter() - start, (
+            request.method, rule.rule if rule is not None else 'unmatched',
+            str(response.status_code)))
+    return response
+
+
+if METRICS:
+    app.before_request(start_request_timer)
+    app.after_request(observe_request)
+
+
+class CacheStats(Resource):
+    """ Reports how often the read-only resources were answered from
+        the response cache (hits), had to be rendered (misses) or were
+        answered with a 304 Not Modified. """
+    def get(self):
+        return response_cache.stats()
+
+
+# read-only commands answered over the line protocol socket.
+LINE_VERBS = ('get', 'get_multi', 'snapshot')
+
+
+def handle_line_command(line):
+    """ Answers a line protocol request, such as
+        'get_multi current_temp bean_temp --c', with the same output
+        the sr700api script prints for the equivalent command line.
+        All values come from a single acquire_snapshot() call."""
+    tokens = line.split()
+    verb = tokens[0]
+    if verb not in LINE_VERBS:
+        return 'ERR: unsupported command ' + verb + '.'
+    if '--c' in tokens:
+        units = 'c'
+    else:
+        units = 'f'
+    params = [t for t in tokens[1:] if not t.startswith('--')]
+    if not params:
+        return 'ERR: no parameters supplied.'
+    unknown = [p for p in params if p not in SNAPSHOT_FIELDS]
+    if unknown:
+        return 'ERR: unknown parameter(s) ' + ', '.join(unknown) + '.'
+    values = format_snapshot(acquire_snapshot(), params, units)
+    return_values = []
+    for param in params:
+        if param in values:
+            return_values.append(str(values[param]))
+        elif param + '_' + units in values:
+            return_values.append(str(values[param + '_' + units]))
+        elif verb == 'get':
+            return 'ERR: ' + values['error']
+        else:
+            # value not available, we won't signal it to the caller
+            return_values.append('0')
+    return ','.join(return_values)
+
+
 class ServerShutdown(Resource):
     """ allows a client to shut down the server.
         In a local server setting, it may be desirable to run the REST API
         server only for an end-user app's lifetime. """
 
-    def __init__(self, *args, **kwargs):
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument(
+    schema = validation.Schema(
+        validation.Argument(
             'server_shutdown', type=str, required=True,
             help='Used to shutdown a local REST API server instance. ' +
                  'Must supply valid server shutdown code.'
-            )
+            ),
+        strict=True
+        )
 
     def shutdown_server(self):
-        """shuts down the werkzeug server invoked by app.run().
-           TODO - change shutdown technique if we change the server type
-           from the current non-prod simple one to CherryPy."""
-        func = request.environ.get('werkzeug.server.shutdown')
-        if func is None:
+        """asks the server started by start_server() to stop once this
+           response has been sent. start_server() then runs the hardware
+           teardown."""
+        if server_runner is None:
             logging.error(
                 'ServerShutdown.shutdown_server: '
-                'Server is not a werkzeug server, cannot shut down.')
-            raise RuntimeError(
-                'ServerShutdown.shutdown_server: '
-                'Server is not a werkzeug server, cannot shut down.')
+                'Server was not started by start_server, cannot shut down.')
             return False
-        func()
+        server_runner.stop()
         return True
 
     def post(self):
-        args = self.parser.parse_args(strict=True)
+        args = parse_request(self.schema)
         code = args['server_shutdown']
         if code != 'sr700api':
             return(
@@ -422,42 +1824,137 @@ class ServerShutdown(Resource):
                 },
                 400
                 )
-        # shut down the server
+        # shut down the server. The pid lets a launcher wait for this
+        # process to let go of the hardware before starting another.
         if self.shutdown_server():
-            return {'server_shutdown': 'ok'}
+            return {'server_shutdown': 'ok', 'pid': os.getpid()}
         else:
             return {'server_shutdown': 'fail'}
 
+# resources of a single roaster, served at the top level for the default
+# roaster, and at /roasters/<id>/<name> for every roaster
+ROASTER_RESOURCES = (
+    ('bean_temp', BeanTemperature),
+    ('dummy', Dummy),
+    ('fan_speed', FanSpeed),
+    ('target_temp', TargetTemp),
+    ('current_temp', CurrentTemp),
+    ('state', State),
+    ('time_remaining', TimeRemaining),
+    ('heater_level', HeaterLevel),
+    ('snapshot', Snapshot),
+    ('history', History),
+    ('stream', Stream),
+    ('sampler', Sampler),
+    ('command', Command),
+)
+
 api.add_resource(TestEndpoint, '/')  # the test endpoint
-api.add_resource(BeanTemperature, '/bean_temp')
-api.add_resource(Dummy, '/dummy')
-api.add_resource(FanSpeed, '/fan_speed')
-api.add_resource(TargetTemp, '/target_temp')
-api.add_resource(CurrentTemp, '/current_temp')
-api.add_resource(State, '/state')
-api.add_resource(TimeRemaining, '/time_remaining')
-api.add_resource(HeaterLevel, '/heater_level')
+for name, resource in ROASTER_RESOURCES:
+    api.add_resource(
+        resource, '/' + name, '/roasters/<string:roaster_id>/' + name)
+api.add_resource(Roasters, '/roasters')
+api.add_resource(PidControl, '/pid')
+api.add_resource(RoastProfile, '/profile')
+api.add_resource(Roasts, '/roasts')
+api.add_resource(RoastExport, '/roasts/<string:name>')
+api.add_resource(CacheStats, '/cache_stats')
+if METRICS:
+    api.add_resource(Metrics, '/metrics')
 api.add_resource(ServerShutdown, '/server_shutdown')
 
-def start_server(debug=False):
+# the running server, set by start_server()
+server_runner = None
+
+
+def run_with_devices(serve, caller, sample_rate=None, oversample=None,
+                     method=None):
     """
-    Start the RESTful server and connect to the hardware device.
+    Connects the hardware and starts sampling every roaster, the roast
+    recorder and the line server, then calls serve(on_ready), which
+    serves until stopped, calling on_ready once listening. Stops all of
+    them again once serve() returns. Shared by this module's and
+    sr700api.asyncserver's start_server().
+    Args:
+        caller - the calling function's name, for log messages.
+        sample_rate, oversample, method - see start_server().
     Returns:
-        True if successful, False otherwise.
+        True if successful, False if no bean probe was found.
     """
-    if(device_bt.find_connect()):
+    # reported to the launcher, see sr700api.readiness
+    timer = readiness.StartupTimer()
+    connect_devices()
+    timer.mark('discovery')
+    if(device_bt.is_connected()):
+        if roast_recorder is not None:
+            roast_recorder.start()
+        # start sampling every roaster side by side, see /roasters, each
+        # taking one reading before serving, so the first request
+        # doesn't see an empty sample slot. A probe that is lost later
+        # is reconnected in the background.
+        roaster_registry.start(sample_rate, oversample, method)
+        timer.mark('first_reading')
+        # serve the command-line script's fast path, if enabled
+        line_server = None
+        path = lineserver.socket_path()
+        if path is not None:
+            line_server = lineserver.LineProtocolServer(
+                path, handle_line_command)
+            if not line_server.start():
+                line_server = None
+
+        def on_ready():
+            timer.mark('listening')
+            readiness.notify(True, timer)
 
-        app.run(port=58700, debug=debug)
-        # this is a blocking call, will only return once exited
-        device_bt.disconnect()
-        device_sr700.sleep()
-        device_sr700.disconnect()
+        try:
+            serve(on_ready)
+        finally:
+            if line_server is not None:
+                line_server.stop()
+            profile_player.stop()
+            pid_loop.stop()
+            # the default roaster too
+            roaster_registry.stop()
+            if roast_recorder is not None:
+                roast_recorder.stop()
         return True
     # failed to connect to hardware
     logging.error(
-        "restserver.start_server - failed to find temp probe HW, bailing.")
+        "%s - failed to find temp probe HW, bailing." % caller)
+    readiness.notify(False, timer)
     return False
 
+
+def start_server(debug=False, sample_rate=None, oversample=None,
+                 method=None):
+    """
+    Start the RESTful server and connect to the hardware device.
+    Args:
+        sample_rate - bean temperature samples per second, defaults to
+                      SAMPLE_RATE.
+        oversample - frames per sample, defaults to SAMPLE_OVERSAMPLE.
+        method - burst reduction, defaults to SAMPLE_FILTER.
+    Returns:
+        True if successful, False otherwise.
+    """
+    def serve(on_ready):
+        global server_runner
+        app.debug = debug
+        server_runner = serving.ServerRunner(
+            app, port=SERVER_PORT, mode=SERVER_MODE,
+            threads=SERVER_THREADS, queue_size=SERVER_QUEUE_SIZE,
+            keepalive_timeout=SERVER_KEEPALIVE)
+        try:
+            # this is a blocking call, will only return once stopped by
+            # /server_shutdown, SIGINT or SIGTERM
+            server_runner.run(on_ready)
+        finally:
+            server_runner = None
+
+    return run_with_devices(
+        serve, 'restserver.start_server', sample_rate, oversample, method)
+
 # this runs when invoked as a script, WE'RE DOING THIS.
 if __name__ == '__main__':
     start_server(debug=False)
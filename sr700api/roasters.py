@@ -0,0 +1,283 @@
+"""
+roasters.py
+
+Several SR700 roasters, each paired with its own Bus Pirate bean
+temperature probe, served by one process. Every pair is a Roaster with
+its own devices, device lock, sampler thread and sample history, so
+that the pairs never wait on each other. The RoasterRegistry finds the
+pairs, by USB VID:PID or from SR700API_ROASTERS, and looks them up by id
+for the /roasters/<id>/... resources.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import collections
+import logging
+import os
+import re
+import threading
+import time
+import freshroastsr700
+import serial
+from serial.tools import list_ports
+from sr700api import history
+from sr700api import stream
+from sr700api import supervisor
+
+# USB VID:PID of the SR700's CH340 serial chip, and of the Bus Pirate
+# v3's FTDI chip
+SR700_VIDPID = '1A86:5523'
+BUS_PIRATE_VIDPID = '0403:6001'
+
+# id of the roaster also served by the top-level resources
+DEFAULT_ID = '0'
+
+# probe and roaster ports of one pair, either may be None. The probe's
+# is a Bus Pirate serial port, or a spidev device.
+RoasterPorts = collections.namedtuple(
+    'RoasterPorts', ['bus_pirate', 'sr700'])
+
+
+def find_ports(vidpid):
+    """ Every serial port of a USB device with the given VID:PID, sorted
+        by device name. """
+    return sorted(
+        p[0] for p in list_ports.comports()
+        if re.search(vidpid, p[2], flags=re.IGNORECASE))
+
+
+def configured_ports(probe_ports=None):
+    """ The probe and roaster port of every pair, from SR700API_ROASTERS,
+        a comma separated list of bus_pirate_port:sr700_port, such as
+        /dev/ttyUSB0:/dev/ttyUSB1,/dev/ttyUSB2:/dev/ttyUSB3. When it isn't
+        set, the Bus Pirates and SR700s plugged in are paired in device
+        name order, which only matches them up if they were plugged in
+        pair by pair. Stable /dev/serial/by-id/ names in SR700API_ROASTERS
+        avoid that. probe_ports, such as spidev devices, replaces the
+        Bus Pirates found. Returns an empty list when nothing is plugged
+        in. """
+    spec = os.environ.get('SR700API_ROASTERS')
+    if spec:
+        pairs = []
+        for item in spec.split(','):
+            bus_pirate, _, sr700 = item.strip().partition(':')
+            pairs.append(RoasterPorts(bus_pirate or None, sr700 or None))
+        return pairs
+    if probe_ports is None:
+        bus_pirates = find_ports(BUS_PIRATE_VIDPID)
+    else:
+        bus_pirates = list(probe_ports)
+    sr700s = find_ports(SR700_VIDPID)
+    if len(bus_pirates) != len(sr700s):
+        logging.warning(
+            "roasters.configured_ports - found %d probe(s) and %d "
+            "SR700(s), unpaired devices are left out." % (
+                len(bus_pirates), len(sr700s)))
+    return [RoasterPorts(*pair) for pair in zip(bus_pirates, sr700s)]
+
+
+class PinnedRoaster(freshroastsr700.freshroastsr700):
+    """ freshroastsr700, connecting to one given serial port instead of
+        the first SR700 found, so that several roasters can be driven
+        side by side. With port None it behaves as freshroastsr700. """
+    def __init__(self, port=None, **kwargs):
+        # set before freshroastsr700 starts its communication process,
+        # which calls _connect()
+        self.port = port
+        super(PinnedRoaster, self).__init__(**kwargs)
+
+    def _connect(self):
+        """ freshroastsr700._connect(), on self.port. """
+        if self.port is None:
+            return super(PinnedRoaster, self)._connect()
+        # the port may be a /dev/serial/by-id/ link
+        plugged_in = [os.path.realpath(p[0]) for p in list_ports.comports()]
+        if os.path.realpath(self.port) not in plugged_in:
+            raise freshroastsr700.exceptions.RoasterLookupError
+        # as freshroastsr700, allow the port some time to become usable
+        wait_timeout = time.time() + 40.0
+        self._connect_state.value = self.CS_CONNECTING
+        while time.time() < wait_timeout:
+            try:
+                self._ser = serial.Serial(
+                    port=self.port,
+                    baudrate=9600,
+                    bytesize=8,
+                    parity='N',
+                    stopbits=1.5,
+                    timeout=0.25,
+                    xonxoff=False,
+                    rtscts=False,
+                    dsrdtr=False)
+                break
+            except serial.SerialException:
+                time.sleep(0.5)
+        else:
+            raise freshroastsr700.exceptions.RoasterLookupError
+        self._initialize()
+
+
+class Roaster(object):
+    """ One SR700 and its bean temperature probe. The sampler owns
+        device_bt once started, the supervisor reconnects it when lost,
+        lock serializes multi-step access to device_sr700, history
+        holds this pair's samples and broadcaster pushes them to /stream
+        subscribers. """
+    def __init__(self, roaster_id, device_bt, device_sr700, lock, sampler,
+                 sample_history, ports=None):
+        self.id = roaster_id
+        self.device_bt = device_bt
+        self.device_sr700 = device_sr700
+        self.lock = lock
+        self.sampler = sampler
+        self.history = sample_history
+        self.broadcaster = stream.Broadcaster()
+        self.ports = ports if ports is not None else RoasterPorts(None, None)
+        self.supervisor = supervisor.ProbeSupervisor(
+            device_bt, sampler, name='roaster %s probe' % roaster_id)
+
+    def cache_key(self, name):
+        """ the response_cache key of a resource of this roaster. """
+        if self.id == DEFAULT_ID:
+            return name
+        return 'roasters/%s/%s' % (self.id, name)
+
+    def record_sample(self, timestamp, reading):
+        """ sampler listener, stores each probe reading and the current
+            roaster values in history. Returns the stored sample, in
+            SampleHistory.append() argument order. """
+        probe_t, fault, junc_t, scv, scg, oc = reading
+        if not self.device_bt.is_connected():
+            probe_t = junc_t = None
+        device = self.device_sr700
+        if device.connected:
+            with self.lock:
+                current_temp = device.current_temp
+                fan_speed = device.fan_speed
+                heater_level = device.heater_level
+                state = device.get_roaster_state()
+        else:
+            current_temp = fan_speed = heater_level = None
+            state = 'disconnected'
+        sample = (
+            timestamp, probe_t, junc_t, current_temp, fan_speed,
+            heater_level, state, history.fault_bits(fault, scv, scg, oc))
+        self.history.append(*sample)
+        return sample
+
+    def start(self, rate=None, oversample=None, method=None):
+        """ Connects the probe, unless already connected, and starts
+            sampling it, see Max31855kSampler.configure() for the
+            arguments. A probe that isn't found is connected by the
+            supervisor once plugged in, the roaster connects on its own.
+            Returns False if the probe isn't found. """
+        connected = (
+            self.device_bt.is_connected() or self.device_bt.find_connect())
+        if not connected:
+            logging.warning(
+                "Roaster.start - roaster %s: failed to find temp probe "
+                "HW, waiting for it." % self.id)
+        self.sampler.configure(rate, oversample, method)
+        if connected:
+            # one reading before serving
+            self.sampler.sample_once()
+        self.sampler.start()
+        self.supervisor.start()
+        return connected
+
+    def stop(self):
+        self.supervisor.stop()
+        self.sampler.stop()
+        self.device_bt.disconnect()
+        with self.lock:
+            self.device_sr700.sleep()
+            self.device_sr700.disconnect()
+
+    def status(self):
+        """ id, ports and connection state, for /roasters. """
+        device = self.device_sr700
+        connected = bool(device.connected)
+        return {
+            'id': self.id,
+            'bus_pirate_port': self.ports.bus_pirate,
+            'sr700_port': self.ports.sr700,
+            'probe_connected': self.device_bt.is_connected(),
+            'roaster_connected': connected,
+            'state': (
+                device.get_roaster_state() if connected
+                else 'disconnected'),
+            'sampling': self.sampler.is_running(),
+            'probe_supervisor': self.supervisor.status(),
+        }
+
+
+class RoasterRegistry(object):
+    """ The roasters served, by id, in the order they were added. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._roasters = collections.OrderedDict()
+        self._started = []
+
+    def __len__(self):
+        return len(self._roasters)
+
+    def __iter__(self):
+        return iter(list(self._roasters.values()))
+
+    def add(self, roaster):
+        with self._lock:
+            if roaster.id in self._roasters:
+                raise ValueError(
+                    "RoasterRegistry - duplicate roaster id %s." %
+                    roaster.id)
+            self._roasters[roaster.id] = roaster
+        return roaster
+
+    def get(self, roaster_id):
+        """ the Roaster with roaster_id, or None. """
+        return self._roasters.get(roaster_id)
+
+    def start(self, rate=None, oversample=None, method=None):
+        """ Starts every roaster whose sampler isn't running yet, side by
+            side, each in its own thread. A roaster whose probe isn't
+            found is served all the same, and picks the probe up once
+            plugged in. """
+        stopped = [r for r in self if not r.sampler.is_running()]
+        starters = [
+            threading.Thread(
+                target=roaster.start, args=(rate, oversample, method),
+                name='roaster-start-%s' % roaster.id)
+            for roaster in stopped]
+        for starter in starters:
+            starter.start()
+        for starter in starters:
+            starter.join()
+        self._started.extend(stopped)
+
+    def stop(self):
+        """ Stops the roasters started by start(). """
+        while self._started:
+            self._started.pop().stop()
+
+    def status(self):
+        return [roaster.status() for roaster in self]
@@ -0,0 +1,276 @@
+"""
+sampler.py
+
+A background acquisition thread that owns a Max31855kDevice and keeps
+the latest thermocouple reading in a lock-protected slot, so that REST
+handlers never have to wait on the Bus Pirate serial link.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import math
+import threading
+import time
+from sr700api import filters
+
+# the MAX31855K needs up to 100ms to complete a conversion; frames read
+# closer together than this repeat the previous conversion.
+CONVERSION_TIME = 0.1
+
+
+class Max31855kSampler(object):
+    """ Periodically reads a Max31855kDevice from a dedicated thread.
+        Once started, the sampler is the only caller of device.read(),
+        so the serial port has exactly one owner. """
+    def __init__(self, device, rate=4.0, max_age=2.0,
+                 oversample=1, method='median'):
+        """ Creates a sampler for an already-instantiated device.
+
+            Args:
+                device - a Max31855kDevice (or compatible) object
+                rate - samples per second
+                max_age - readings older than this many seconds are
+                          considered stale by read()
+                oversample - number of frames read per sample, spread
+                             over the sample period and reduced to one
+                             reading, see filters.reduce_burst()
+                method - burst reduction, a filters.FILTERS key """
+        self.device = device
+        self.max_age = max_age
+        self.configure(rate, oversample, method)
+        self._lock = threading.Lock()
+        # (wall clock time, monotonic time, reading tuple)
+        self._sample = (None, None, None)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._listeners = []
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+        # a metrics histogram series timing every burst, if set
+        self.burst_histogram = None
+
+    def configure(self, rate=None, oversample=None, method=None):
+        """ Changes the sample rate, oversampling or reduction method.
+            Takes effect from the next sample. """
+        if rate is not None:
+            if not (math.isfinite(rate) and rate > 0):
+                raise ValueError(
+                    "Max31855kSampler - rate must be a positive, finite "
+                    "number.")
+            self.period = 1.0 / rate
+        if oversample is not None:
+            if oversample < 1:
+                raise ValueError(
+                    "Max31855kSampler - oversample must be at least 1.")
+            self.oversample = oversample
+        if method is not None:
+            if method not in filters.FILTERS:
+                raise ValueError(
+                    "Max31855kSampler - unknown method %s." % method)
+            self.method = method
+        if self.oversample > 1 and (
+                self.period / self.oversample < CONVERSION_TIME):
+            logging.warning(
+                "Max31855kSampler - %d frames per %.3fs sample are closer "
+                "together than the MAX31855K conversion time, frames "
+                "will repeat." % (self.oversample, self.period))
+
+    def reset_stats(self):
+        """ Clears the timing statistics reported by stats(). """
+        with self._stats_lock:
+            self._stats = {
+                'samples': 0,
+                'frames': 0,
+                'discarded_frames': 0,
+                'burst_time_last': 0.0,
+                'burst_time_max': 0.0,
+                'burst_time_total': 0.0,
+                'frame_time_max': 0.0,
+                'frame_time_total': 0.0,
+                'interval_avg': None,
+                'last_sample_mono': None,
+            }
+
+    def stats(self):
+        """ Returns acquisition statistics: configured and effective
+            sample rates, frame counts and burst/frame read timing, in
+            seconds. """
+        with self._stats_lock:
+            st = dict(self._stats)
+        samples = st['samples']
+        frames = st['frames']
+        interval = st['interval_avg']
+        return {
+            'rate': 1.0 / self.period,
+            'oversample': self.oversample,
+            'method': self.method,
+            'effective_rate': 1.0 / interval if interval else 0.0,
+            'samples': samples,
+            'frames': frames,
+            'discarded_frames': st['discarded_frames'],
+            'burst_time_last': st['burst_time_last'],
+            'burst_time_avg':
+                st['burst_time_total'] / samples if samples else 0.0,
+            'burst_time_max': st['burst_time_max'],
+            'frame_time_avg':
+                st['frame_time_total'] / frames if frames else 0.0,
+            'frame_time_max': st['frame_time_max'],
+        }
+
+    def add_listener(self, func):
+        """ Registers func(timestamp, reading) to be called from the
+            acquisition thread after every sample. Listeners must be
+            quick, they delay the next sample. """
+        self._listeners.append(func)
+
+    def start(self):
+        """ Starts the acquisition thread, if not already running. """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._stats_lock:
+            # a sample_once() just before isn't a sample period ago,
+            # and would skew the effective rate
+            self._stats['last_sample_mono'] = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='max31855k-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stops the acquisition thread and waits for it to exit, so
+            that the caller can safely take over the device again. """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self):
+        """ Reports whether the acquisition thread is alive. """
+        return self._thread is not None and self._thread.is_alive()
+
+    def _read_burst(self):
+        """ Reads `oversample` frames, spaced evenly over the sample
+            period, and reduces them to one reading. """
+        count = self.oversample
+        spacing = self.period / count
+        burst_start = time.monotonic()
+        readings = []
+        frame_times = []
+        for i in range(count):
+            if i:
+                # space frames out over the period, so that each one is
+                # a fresh conversion
+                delay = burst_start + i * spacing - time.monotonic()
+                if delay > 0 and self._stop_event.wait(delay):
+                    break
+            frame_start = time.monotonic()
+            readings.append(self.device.read())
+            frame_times.append(time.monotonic() - frame_start)
+        if count == 1:
+            reading, discarded = readings[0], 0
+        else:
+            reading, discarded = filters.reduce_burst(readings, self.method)
+        now = time.monotonic()
+        with self._stats_lock:
+            st = self._stats
+            burst_time = now - burst_start
+            st['samples'] += 1
+            st['frames'] += len(readings)
+            st['discarded_frames'] += discarded
+            st['burst_time_last'] = burst_time
+            st['burst_time_total'] += burst_time
+            st['burst_time_max'] = max(st['burst_time_max'], burst_time)
+            st['frame_time_total'] += sum(frame_times)
+            st['frame_time_max'] = max(
+                [st['frame_time_max']] + frame_times)
+            if st['last_sample_mono'] is not None:
+                interval = now - st['last_sample_mono']
+                if st['interval_avg'] is None:
+                    st['interval_avg'] = interval
+                else:
+                    # exponentially weighted, about the last 10 samples
+                    st['interval_avg'] += 0.1 * (
+                        interval - st['interval_avg'])
+            st['last_sample_mono'] = now
+        if self.burst_histogram is not None:
+            self.burst_histogram.observe(burst_time)
+        return reading
+
+    def sample_once(self):
+        """ Performs a single (possibly oversampled) device read and
+            publishes it. Called from the acquisition thread; only call
+            it directly when the thread is not running. """
+        reading = self._read_burst()
+        timestamp = time.time()
+        with self._lock:
+            self._sample = (timestamp, time.monotonic(), reading)
+        for func in self._listeners:
+            try:
+                func(timestamp, reading)
+            except Exception:
+                logging.exception(
+                    "Max31855kSampler.sample_once - listener failed.")
+        return reading
+
+    def latest(self):
+        """ Returns the latest sample as a (timestamp, age, reading)
+            tuple, where timestamp is wall clock time in seconds,
+            age is the number of seconds since the read, and reading
+            is the tuple returned by Max31855kDevice.read().
+            Returns (None, None, None) if nothing was sampled yet. """
+        with self._lock:
+            timestamp, mono, reading = self._sample
+        if reading is None:
+            return (None, None, None)
+        return (timestamp, time.monotonic() - mono, reading)
+
+    def read(self, max_age=None):
+        """ Returns the latest reading, in the same format as
+            Max31855kDevice.read(), or None if no reading is available
+            that is younger than max_age seconds (defaults to the
+            sampler's max_age). """
+        if max_age is None:
+            max_age = self.max_age
+        timestamp, age, reading = self.latest()
+        if reading is None or age > max_age:
+            return None
+        return reading
+
+    def _run(self):
+        """ acquisition loop. Runs at a fixed rate, skipping ahead
+            rather than bursting when a read overruns its period. """
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                self.sample_once()
+            except Exception:
+                # never let a bad read kill the acquisition thread
+                logging.exception(
+                    "Max31855kSampler._run - device read failed.")
+            next_time += self.period
+            now = time.monotonic()
+            if next_time < now:
+                next_time = now
+            self._stop_event.wait(next_time - now)
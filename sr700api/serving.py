@@ -0,0 +1,151 @@
+"""
+serving.py
+
+Runs the REST API's WSGI app on a production-grade server with a worker
+thread pool, keep-alive connections and a bounded connection queue, and
+stops it cleanly on SIGINT/SIGTERM or on request. Uses cheroot (the
+CherryPy server) when installed, and falls back on werkzeug's threaded
+development server otherwise.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import signal
+import threading
+try:
+    from cheroot import wsgi as cheroot_wsgi
+except ImportError:
+    cheroot_wsgi = None
+
+# 'production' requires cheroot, 'development' uses werkzeug, 'auto'
+# picks production when available.
+MODES = ('auto', 'production', 'development')
+
+
+class ServerRunner(object):
+    """ Serves a WSGI app until stop() is called, or the process
+        receives SIGINT or SIGTERM. """
+    def __init__(self, app, host='127.0.0.1', port=58700, mode='auto',
+                 threads=8, queue_size=16, keepalive_timeout=10.0,
+                 shutdown_timeout=5.0):
+        """ Args:
+                app - the WSGI application
+                mode - one of MODES
+                threads - worker threads (production mode)
+                queue_size - accepted connections allowed to wait for a
+                             free worker before new ones are refused
+                             (production mode)
+                keepalive_timeout - seconds an idle keep-alive
+                                    connection is held open
+                shutdown_timeout - seconds to let in-flight requests
+                                   finish on stop() """
+        if mode not in MODES:
+            raise ValueError("ServerRunner - unknown mode %s." % mode)
+        if mode == 'auto':
+            mode = 'production' if cheroot_wsgi is not None else (
+                'development')
+        if mode == 'production' and cheroot_wsgi is None:
+            raise RuntimeError(
+                "ServerRunner - production mode requires cheroot, "
+                "pip install cheroot.")
+        self.app = app
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.threads = threads
+        self.queue_size = queue_size
+        self.keepalive_timeout = keepalive_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self._server = None
+        self._stopping = threading.Event()
+
+    def _make_server(self):
+        if self.mode == 'production':
+            return cheroot_wsgi.Server(
+                (self.host, self.port), self.app,
+                numthreads=self.threads,
+                max=self.threads,
+                request_queue_size=self.queue_size,
+                accepted_queue_size=self.queue_size,
+                timeout=self.keepalive_timeout,
+                shutdown_timeout=self.shutdown_timeout)
+        from werkzeug.serving import make_server
+        return make_server(self.host, self.port, self.app, threaded=True)
+
+    def run(self, on_ready=None):
+        """ Serves until stopped. Blocking. Signal handlers are only
+            installed when called from the main thread. on_ready, if
+            given, is called once the server is listening. """
+        self._server = self._make_server()
+        previous = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous[signum] = signal.signal(
+                    signum, self._handle_signal)
+        try:
+            if self._stopping.is_set():
+                # stopped before we got going
+                return
+            if self.mode == 'production':
+                # as safe_start(), which binds and serves in one call
+                self._server.prepare()
+                if on_ready is not None:
+                    on_ready()
+                self._server.serve()
+            else:
+                # bound when made
+                if on_ready is not None:
+                    on_ready()
+                self._server.serve_forever()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            if self.mode == 'development':
+                self._server.server_close()
+            self._server = None
+
+    def _handle_signal(self, signum, frame):
+        logging.warning(
+            "ServerRunner - received signal %d, shutting down." % signum)
+        self.stop()
+
+    def stop(self):
+        """ Asks the server to stop, and returns immediately. Safe to call
+            from a request handler, a signal handler or any thread. The
+            server finishes in-flight requests, then run() returns. """
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        server = self._server
+        if server is None:
+            return
+        # both servers' stop calls block until serving has ended, which
+        # would deadlock when called from one of their own threads.
+        if self.mode == 'production':
+            target = server.stop
+        else:
+            target = server.shutdown
+        stopper = threading.Thread(target=target, name='server-stop')
+        stopper.daemon = True
+        stopper.start()
@@ -0,0 +1,337 @@
+"""
+simulated.py
+
+Simulated stand-ins for Max31855kDevice and freshroastsr700, driven by
+a simple thermal model of the roast chamber and bean mass. They let the
+REST server run, be load-tested and benchmarked without any hardware.
+Select them by setting the SR700API_BACKEND environment variable to
+'simulated' before starting the server.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import random
+import threading
+import time
+from freshroastsr700 import exceptions
+from sr700api.max31855kdevice import Max31855Sample, NO_HARDWARE_SAMPLE
+from sr700api import utils
+
+
+class ThermalModel(object):
+    """ A lumped two-mass model: the chamber air is heated by the heater
+        and cooled by the fan's fresh air, the beans exchange heat with
+        the chamber air. Temperatures in degrees Celsius. The model is
+        advanced lazily, whenever a temperature is read. """
+    # longest integration step, in seconds
+    MAX_STEP = 0.1
+
+    def __init__(self, ambient=22.0, max_rise=270.0):
+        """ Args:
+                ambient - room temperature
+                max_rise - chamber temperature rise above ambient at
+                           full heat and lowest fan speed """
+        self.ambient = ambient
+        self.max_rise = max_rise
+        self.chamber_temp = ambient
+        self.bean_temp = ambient
+        # inputs, set by SimulatedRoaster
+        self.heater = 0.0    # 0..1
+        self.airflow = 0.0   # 0..1
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+
+    def set_inputs(self, heater, airflow):
+        """ Sets heater power and airflow, both as fractions of the
+            maximum, after bringing the model up to date. """
+        with self._lock:
+            self._advance()
+            self.heater = heater
+            self.airflow = airflow
+
+    def temperatures(self):
+        """ Returns (chamber_temp, bean_temp), in degC. """
+        with self._lock:
+            self._advance()
+            return self.chamber_temp, self.bean_temp
+
+    def _advance(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        while elapsed > 0:
+            dt = min(elapsed, self.MAX_STEP)
+            elapsed -= dt
+            # more air carries more heat away, lowering the equilibrium
+            target = self.ambient + self.heater * self.max_rise * (
+                1.15 - 0.35 * self.airflow)
+            tau_chamber = 15.0 / (0.3 + self.airflow)
+            self.chamber_temp += (target - self.chamber_temp) * min(
+                dt / tau_chamber, 1.0)
+            # beans track the chamber air faster with more air moving
+            tau_beans = 60.0 / (0.2 + self.airflow)
+            self.bean_temp += (self.chamber_temp - self.bean_temp) * min(
+                dt / tau_beans, 1.0)
+
+
+class SimulatedMax31855kDevice(object):
+    """ Drop-in replacement for Max31855kDevice, reading the bean
+        temperature from a ThermalModel. """
+    def __init__(self, model, speed='30kHz', latency=0.005,
+                 fault_rate=0.0, disconnect_rate=0.0, noise=0.3,
+                 replug_time=1.0):
+        """ Args:
+                model - the ThermalModel to read
+                speed - accepted for compatibility, unused
+                latency - seconds spent in every read, standing in for
+                          the Bus Pirate serial round trip
+                fault_rate - probability of a read reporting an open
+                             thermocouple
+                disconnect_rate - probability of a read losing the
+                                  connection, as a SerialException would
+                noise - standard deviation of the probe noise, degC
+                replug_time - seconds after a lost connection during
+                              which find_connect() fails, as while USB
+                              enumerates the device again """
+        self.model = model
+        self.speed = speed
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.disconnect_rate = disconnect_rate
+        self.noise = noise
+        self.replug_time = replug_time
+        self.connected = False
+        self._random = random.Random()
+        # monotonic time the connection was lost
+        self._lost_at = None
+        # instrumentation, as Max31855kDevice
+        self.connects = 0
+        self.connection_losses = 0
+        self.transfer_histogram = None
+
+    def find_connect(self):
+        time.sleep(self.latency)
+        if (self._lost_at is not None and
+                time.monotonic() - self._lost_at < self.replug_time):
+            logging.warning(
+                "SimulatedMax31855kDevice.find_connect - hardware not "
+                "found.")
+            return False
+        self._lost_at = None
+        self.connected = True
+        self.connects += 1
+        return True
+
+    def disconnect(self):
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+    def read(self):
+        if not self.connected:
+            if self._lost_at is None:
+                logging.warning(
+                    "SimulatedMax31855kDevice.read - hardware not present!")
+            return NO_HARDWARE_SAMPLE
+        if self.transfer_histogram is not None:
+            start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        if self.transfer_histogram is not None:
+            self.transfer_histogram.observe(time.perf_counter() - start)
+        if self._random.random() < self.disconnect_rate:
+            logging.error(
+                "SimulatedMax31855kDevice - connection lost, "
+                "I/O failed on read.")
+            self.connection_losses += 1
+            self._lost_at = time.monotonic()
+            self.connected = False
+            return NO_HARDWARE_SAMPLE
+        if self._random.random() < self.fault_rate:
+            # open thermocouple: fault and oc bits set
+            return Max31855Sample(0.0, 1, self.model.ambient, 0, 0, 1)
+        chamber_t, bean_t = self.model.temperatures()
+        probe_t = bean_t + self._random.gauss(0.0, self.noise)
+        # the MAX31855K resolves 0.25degC, and 0.0625degC at the junction
+        return Max31855Sample(
+            round(probe_t * 4.0) / 4.0, 0,
+            round((self.model.ambient + 5.0) * 16.0) / 16.0, 0, 0, 0)
+
+
+class SimulatedRoaster(object):
+    """ Drop-in replacement for freshroastsr700.freshroastsr700, as used
+        by the REST server with ext_sw_heater_drive=True. """
+    def __init__(self, model, connect_delay=0.0, heater_segments=8):
+        self.model = model
+        self.connect_delay = connect_delay
+        self._heater_segments = heater_segments
+        self._lock = threading.RLock()
+        self._connected = 0
+        self._connect_at = None
+        self._fan_speed = 1
+        self._heater_level = 0
+        self._target_temp = 150
+        self._time_remaining = 0
+        self._total_time = 0
+        self._state = 'idle'
+        self._last_tick = time.monotonic()
+
+    # connection handling
+
+    def auto_connect(self):
+        self._connect_at = time.monotonic() + self.connect_delay
+
+    def connect(self):
+        self._connect_at = time.monotonic()
+
+    def disconnect(self):
+        self._connect_at = None
+        self._connected = 0
+
+    def terminate(self):
+        self.disconnect()
+
+    @property
+    def connected(self):
+        if (not self._connected and self._connect_at is not None and
+                time.monotonic() >= self._connect_at):
+            self._connected = 1
+        return self._connected
+
+    # settings
+
+    @property
+    def fan_speed(self):
+        return self._fan_speed
+
+    @fan_speed.setter
+    def fan_speed(self, value):
+        if value not in range(1, 10):
+            raise exceptions.RoasterValueError
+        with self._lock:
+            self._fan_speed = value
+            self._update_model()
+
+    @property
+    def heater_level(self):
+        return self._heater_level
+
+    @heater_level.setter
+    def heater_level(self, value):
+        if value not in range(0, self._heater_segments + 1):
+            raise exceptions.RoasterValueError
+        with self._lock:
+            self._heater_level = value
+            self._update_model()
+
+    @property
+    def target_temp(self):
+        return self._target_temp
+
+    @target_temp.setter
+    def target_temp(self, value):
+        if value not in range(150, 551):
+            raise exceptions.RoasterValueError
+        self._target_temp = value
+
+    @property
+    def time_remaining(self):
+        self._tick()
+        return self._time_remaining
+
+    @time_remaining.setter
+    def time_remaining(self, value):
+        with self._lock:
+            self._tick()
+            self._time_remaining = value
+
+    @property
+    def total_time(self):
+        self._tick()
+        return self._total_time
+
+    @property
+    def current_temp(self):
+        """ chamber temperature in whole degF, clamped to the 150..550
+            range the SR700 reports. """
+        chamber_t, bean_t = self.model.temperatures()
+        return int(min(max(round(utils.c_to_f(chamber_t)), 150), 550))
+
+    # states
+
+    def get_roaster_state(self):
+        self._tick()
+        if not self.connected:
+            return 'connecting'
+        return self._state
+
+    def idle(self):
+        self._set_state('idle')
+
+    def roast(self):
+        self._set_state('roasting')
+
+    def cool(self):
+        self._set_state('cooling')
+
+    def sleep(self):
+        self._set_state('sleeping')
+
+    def _set_state(self, state):
+        with self._lock:
+            self._tick()
+            self._state = state
+            self._update_model()
+
+    def _update_model(self):
+        """ feeds the current settings to the thermal model. Call with
+            the lock held. """
+        if self._state == 'roasting':
+            heater = float(self._heater_level) / self._heater_segments
+        else:
+            heater = 0.0
+        if self._state in ('roasting', 'cooling'):
+            airflow = self._fan_speed / 9.0
+        else:
+            airflow = 0.0
+        self.model.set_inputs(heater, airflow)
+
+    def _tick(self):
+        """ counts time_remaining down once per second while roasting or
+            cooling, then goes idle, like freshroastsr700's timer. """
+        with self._lock:
+            now = time.monotonic()
+            if self._state not in ('roasting', 'cooling'):
+                # nothing counts down, skip over the whole seconds
+                self._last_tick += int(now - self._last_tick)
+            while now - self._last_tick >= 1.0:
+                self._last_tick += 1.0
+                if self._state in ('roasting', 'cooling'):
+                    self._total_time += 1
+                    if self._time_remaining > 0:
+                        self._time_remaining -= 1
+                    else:
+                        self._state = 'idle'
+                        self._update_model()
@@ -0,0 +1,172 @@
+"""
+spidevdevice.py
+
+A MAX31855K thermocouple chip on a hardware SPI bus, read through the
+Linux spidev driver (/dev/spidevB.C), as found on single-board
+computers. Reading a frame is one read() system call, clocked at MHz
+rates, instead of three serial round trips to a Bus Pirate. Select it
+by setting SR700API_PROBE_DRIVER to 'spidev', see restserver.py.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import errno
+import io
+import logging
+import struct
+try:
+    import fcntl
+except ImportError:
+    # not on Windows, where there is no spidev anyway
+    fcntl = None
+from sr700api.max31855kdevice import Max31855kDriver, encode_frame
+
+DEFAULT_DEVICE = '/dev/spidev0.0'
+
+# spidev ioctl requests, _IOW('k', nr, type), as encoded on x86 and ARM
+SPI_IOC_WR_MODE = 0x40016b01
+SPI_IOC_WR_BITS_PER_WORD = 0x40016b03
+SPI_IOC_WR_MAX_SPEED_HZ = 0x40046b04
+
+# the MAX31855K shifts data out on the falling clock edge, to be sampled
+# on the rising one: clock idle low, SPI mode 0
+SPI_MODE = 0
+
+_SPEED_UNITS = (('mhz', 1000000), ('khz', 1000), ('hz', 1))
+
+
+def parse_speed(speed):
+    """ SPI clock rate in Hz, of a number of Hz, or of a string such as
+        '4MHz', '125kHz' or '4000000'. Raises ValueError. """
+    if not isinstance(speed, str):
+        return int(speed)
+    value = speed.strip().lower()
+    for unit, scale in _SPEED_UNITS:
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * scale)
+    return int(value)
+
+
+def frame_is_valid(frame):
+    """ False if either reserved bit, D17 or D3, of a frame is set. The
+        MAX31855K always clears them, so such a frame comes from no chip
+        at all, as when MISO is left floating high. """
+    return not (frame[1] & 0x02 or frame[3] & 0x08)
+
+
+def write_fake_device(path, samples):
+    """ Writes a fake spidev device file, for testing without hardware:
+        a regular file of the frames of samples, Max31855Sample tuples,
+        which SpidevMax31855kDevice(path, fake=True) reads back one per
+        read(), the first one when connecting. """
+    with open(path, 'wb') as f:
+        for sample in samples:
+            f.write(encode_frame(sample))
+
+
+class SpidevMax31855kDevice(Max31855kDriver):
+    """ A MAX31855K thermocouple chip on a Linux spidev device. """
+    log_name = 'SpidevMax31855k'
+
+    def __init__(self, path=DEFAULT_DEVICE, speed='4MHz', mode=SPI_MODE,
+                 fake=False):
+        """ Args:
+                path - the spidev device, /dev/spidev<bus>.<chip select>
+                speed - SPI clock rate, see parse_speed(). The MAX31855K
+                        supports up to 5MHz.
+                mode - SPI mode
+                fake - path is a fake device file, see
+                       write_fake_device(), which is read as it is.
+                       Otherwise, anything but a spidev device is
+                       refused. """
+        super(SpidevMax31855kDevice, self).__init__(speed)
+        self.path = path
+        self.speed_hz = parse_speed(speed)
+        self.mode = mode
+        self.fake = fake
+
+    def _connect(self):
+        """ opens and configures the device, then checks that a chip
+            answers, before returning the open device, or None. """
+        if fcntl is None:
+            logging.error(
+                "SpidevMax31855k.find_connect - spidev requires Linux.")
+            return None
+        try:
+            spi = io.FileIO(self.path, 'r+')
+        except OSError:
+            logging.warning(
+                "SpidevMax31855k.find_connect - %s not found." % self.path)
+            return None
+        try:
+            if not self.fake:
+                self._configure(spi)
+        except OSError as e:
+            if e.errno == errno.ENOTTY:
+                logging.error(
+                    "SpidevMax31855k.find_connect - %s is not a spidev "
+                    "device." % self.path)
+            else:
+                logging.warning(
+                    "SpidevMax31855k.find_connect - could not configure "
+                    "%s." % self.path)
+            self._close(spi)
+            return None
+        try:
+            frame = self._transfer(spi)
+        except OSError:
+            logging.warning(
+                "SpidevMax31855k.find_connect - I/O failed on first read.")
+            self._close(spi)
+            return None
+        if not frame_is_valid(frame):
+            logging.warning(
+                "SpidevMax31855k.find_connect - no MAX31855K answering on "
+                "%s." % self.path)
+            self._close(spi)
+            return None
+        return spi
+
+    def _configure(self, spi):
+        fcntl.ioctl(spi, SPI_IOC_WR_MODE, struct.pack('=B', self.mode))
+        fcntl.ioctl(spi, SPI_IOC_WR_BITS_PER_WORD, struct.pack('=B', 8))
+        fcntl.ioctl(
+            spi, SPI_IOC_WR_MAX_SPEED_HZ, struct.pack('=I', self.speed_hz))
+
+    def _transfer(self, spi):
+        """ one 4-byte frame, a half-duplex read with chip select held
+            throughout. Raises OSError. """
+        frame = spi.read(4)
+        if frame is None or len(frame) != 4:
+            raise OSError(errno.EIO, "short read on %s" % self.path)
+        return frame
+
+    def _close(self, spi):
+        try:
+            spi.close()
+        except OSError:
+            pass
+
+    def _shut_down(self, spi):
+        # the chip draws next to nothing, and has no power-down mode
+        spi.close()
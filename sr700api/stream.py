@@ -0,0 +1,179 @@
+"""
+stream.py
+
+Fan-out of acquisition samples to any number of streaming clients.
+Publishing never blocks: every subscriber has its own bounded queue,
+which drops its oldest entries when the subscriber falls behind, and
+its own minimum interval between delivered samples.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import asyncio
+import collections
+import threading
+import time
+
+
+class Subscription(object):
+    """ A single subscriber's queue. Created by Broadcaster.subscribe(),
+        read by the subscriber with get(). """
+    def __init__(self, broadcaster, min_interval, max_queue):
+        self.broadcaster = broadcaster
+        self.min_interval = min_interval
+        # number of items discarded because the queue was full
+        self.dropped = 0
+        self._queue = collections.deque(maxlen=max_queue)
+        self._cond = threading.Condition(threading.Lock())
+        self._last_offer = None
+        self._closed = False
+
+    def _accept(self, now):
+        """ rate limit, True if an item offered now is to be queued. """
+        if (self._last_offer is not None and
+                now - self._last_offer < self.min_interval):
+            return False
+        self._last_offer = now
+        return True
+
+    def offer(self, item, now):
+        """ Called by the publisher. Queues item unless it arrives less
+            than min_interval seconds after the previous accepted one.
+            Never blocks on the consumer. """
+        if not self._accept(now):
+            return
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                # deque drops the oldest entry for us
+                self.dropped += 1
+            self._queue.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """ Returns the oldest queued item, waiting up to timeout seconds
+            for one. Returns None on timeout or once closed. """
+        with self._cond:
+            if not self._queue and not self._closed:
+                self._cond.wait(timeout)
+            if self._queue:
+                return self._queue.popleft()
+            return None
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        """ Unsubscribes, and wakes up a consumer blocked in get(). """
+        self.broadcaster.unsubscribe(self)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class AsyncSubscription(Subscription):
+    """ A subscriber's queue, read from an asyncio event loop with
+        'await get()'. Items published from other threads are handed
+        over to the loop, so a waiting consumer holds no thread. Created
+        by Broadcaster.subscribe_async(). """
+    def __init__(self, broadcaster, min_interval, max_queue, loop):
+        Subscription.__init__(self, broadcaster, min_interval, max_queue)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def offer(self, item, now):
+        if not self._accept(now):
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:
+            # event loop closed, the consumer is gone
+            self.broadcaster.unsubscribe(self)
+
+    def _put(self, item):
+        # runs in the event loop, no locking needed
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(item)
+        self._ready.set()
+
+    async def get(self, timeout=None):
+        """ Returns the oldest queued item, waiting up to timeout seconds
+            for one. Returns None on timeout or once closed. """
+        if not self._queue and not self._closed:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._queue:
+            return self._queue.popleft()
+        return None
+
+    def close(self):
+        """ Unsubscribes, and wakes up a consumer waiting in get().
+            Call from the event loop. """
+        self.broadcaster.unsubscribe(self)
+        self._closed = True
+        self._ready.set()
+
+
+class Broadcaster(object):
+    """ Delivers every published item to all current subscribers. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = ()
+
+    def subscribe(self, min_interval=0.0, max_queue=64):
+        """ Adds a subscriber receiving at most one item per min_interval
+            seconds, and holding at most max_queue undelivered items. """
+        return self._add(Subscription(self, min_interval, max_queue))
+
+    def subscribe_async(self, loop, min_interval=0.0, max_queue=64):
+        """ Same as subscribe(), for a consumer running in the given
+            asyncio event loop. """
+        return self._add(
+            AsyncSubscription(self, min_interval, max_queue, loop))
+
+    def _add(self, sub):
+        with self._lock:
+            self._subscribers = self._subscribers + (sub,)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers = tuple(
+                s for s in self._subscribers if s is not sub)
+
+    def has_subscribers(self):
+        return len(self._subscribers) > 0
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def publish(self, item):
+        """ Offers item to every subscriber. The subscriber tuple is
+            replaced, never mutated, so no lock is needed to iterate. """
+        now = time.monotonic()
+        for sub in self._subscribers:
+            sub.offer(item, now)
@@ -0,0 +1,192 @@
+"""
+supervisor.py
+
+Brings a lost bean temperature probe back. A Max31855kDevice drops its
+connection when a read fails, and stays disconnected; the
+ProbeSupervisor notices, from the sampler's next sample, and calls
+find_connect() from its own thread, with exponential backoff, until the
+probe is back. Request threads and the sampler never wait on a
+reconnect, and the time it took to recover is reported.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import threading
+import time
+
+# seconds between reconnect attempts: the first one right away, then
+# from BACKOFF_MIN, growing by BACKOFF_FACTOR up to BACKOFF_MAX. USB
+# takes about a second to enumerate a replugged Bus Pirate, so early
+# attempts are close together.
+BACKOFF_MIN = 0.1
+BACKOFF_FACTOR = 1.5
+BACKOFF_MAX = 2.0
+# seconds between connection checks when no sample wakes the supervisor
+POLL_INTERVAL = 1.0
+
+# ProbeSupervisor states
+STOPPED = 'stopped'
+CONNECTED = 'connected'
+RECONNECTING = 'reconnecting'
+
+
+class ProbeSupervisor(object):
+    """ Watches a Max31855kDevice (or compatible) read by a
+        Max31855kSampler, and reconnects it in the background when its
+        connection is lost, or when it wasn't plugged in at start. """
+    def __init__(self, device, sampler, name='probe',
+                 backoff_min=BACKOFF_MIN, backoff_factor=BACKOFF_FACTOR,
+                 backoff_max=BACKOFF_MAX, poll_interval=POLL_INTERVAL):
+        """ Args:
+                device - the device, its find_connect() must be safe to
+                         call while the sampler reads it
+                sampler - the device's sampler, whose samples wake the
+                          supervisor as soon as the connection is lost
+                name - used in log messages """
+        self.device = device
+        self.name = name
+        self.backoff_min = backoff_min
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        # a metrics histogram series of recovery times, if set
+        self.recovery_histogram = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._state = STOPPED
+        self._losses = 0
+        self._recoveries = 0
+        self._attempts = 0
+        self._lost_at = None
+        self._last_lost = None
+        self._last_recovery = None
+        self._max_recovery = 0.0
+        self._downtime = 0.0
+        sampler.add_listener(self._check)
+
+    def _check(self, timestamp, reading):
+        """ sampler listener, wakes the supervisor on a lost
+            connection. """
+        if not self.device.is_connected():
+            self._wake.set()
+
+    def start(self):
+        """ Starts watching, if not already running. """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        with self._lock:
+            self._state = CONNECTED
+        self._thread = threading.Thread(
+            target=self._run, name='probe-supervisor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stops watching, abandoning a reconnect between attempts.
+            Call before disconnecting the device, so it isn't
+            reconnected behind the caller's back. """
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            self._state = STOPPED
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        """ connection state, loss and recovery counts, and recovery
+            times in seconds. """
+        with self._lock:
+            down_for = (
+                time.monotonic() - self._lost_at
+                if self._lost_at is not None else None)
+            return {
+                'state': self._state,
+                'losses': self._losses,
+                'recoveries': self._recoveries,
+                'attempts': self._attempts,
+                'last_lost': self._last_lost,
+                'down_for': down_for,
+                'last_recovery_time': self._last_recovery,
+                'max_recovery_time': self._max_recovery,
+                'downtime_total': self._downtime,
+            }
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                break
+            if not self.device.is_connected():
+                self._reconnect()
+
+    def _reconnect(self):
+        """ calls find_connect() until it succeeds, or the supervisor is
+            stopped. """
+        lost_at = time.monotonic()
+        with self._lock:
+            self._state = RECONNECTING
+            self._losses += 1
+            self._lost_at = lost_at
+            self._last_lost = time.time()
+        logging.warning(
+            "ProbeSupervisor - %s connection lost, reconnecting." %
+            self.name)
+        delay = self.backoff_min
+        while not self._stop_event.is_set():
+            with self._lock:
+                self._attempts += 1
+            try:
+                connected = self.device.find_connect()
+            except Exception:
+                logging.exception(
+                    "ProbeSupervisor - %s reconnect failed." % self.name)
+                connected = False
+            if connected:
+                break
+            if self._stop_event.wait(delay):
+                return
+            delay = min(delay * self.backoff_factor, self.backoff_max)
+        else:
+            return
+        recovery = time.monotonic() - lost_at
+        with self._lock:
+            self._state = CONNECTED
+            self._recoveries += 1
+            self._lost_at = None
+            self._last_recovery = recovery
+            self._max_recovery = max(self._max_recovery, recovery)
+            self._downtime += recovery
+        if self.recovery_histogram is not None:
+            self.recovery_histogram.observe(recovery)
+        logging.warning(
+            "ProbeSupervisor - %s reconnected after %.2fs." % (
+                self.name, recovery))
@@ -21,11 +21,141 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-def f_to_c(deg_f):
-    "utility to convert degrees fahrenheit to celsius"
-    return (deg_f - 32.0)/1.8
+import array
 
+# converted element-wise by f_to_c() and c_to_f()
+_SEQUENCES = (list, tuple, array.array)
+# magnitude below which '%.1f' formatting gives the same string as
+# str(round(value, 1)); far beyond any temperature
+_FORMAT_LIMIT = 1e9
 
-def c_to_f(deg_c):
-    "utility to convert degrees celsius to fahrenheit"
-    return deg_c * 1.8 + 32.0
+
+def _numpy():
+    """ the numpy module, or None if not installed. numpy is only
+        imported when a sequence is converted, to keep the command-line
+        script's startup fast. """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _bulk(values, out, np_convert, convert):
+    """ converts a list, tuple or array.array of temperatures, or any
+        values into out. np_convert(src, dst) does it with numpy ufuncs,
+        convert(v) for a single value. Same results as converting each
+        value on its own: numpy evaluates the same double precision
+        operations, in the same order. """
+    np = _numpy()
+    if np is None:
+        if out is None:
+            if isinstance(values, array.array):
+                out = array.array('d', values)
+            elif isinstance(values, tuple):
+                return tuple(convert(v) for v in values)
+            else:
+                return [convert(v) for v in values]
+        for i, v in enumerate(values):
+            out[i] = convert(v)
+        return out
+    if isinstance(values, array.array):
+        # no copy: a view of the array's buffer
+        src = np.frombuffer(values, dtype=values.typecode)
+    else:
+        src = np.asarray(values)
+    if src.dtype != np.float64:
+        src = src.astype(np.float64)
+    if out is None:
+        dst = np.empty(src.shape)
+        np_convert(src, dst)
+        # the same container type as values, whether or not numpy is
+        # installed
+        if isinstance(values, array.array):
+            return array.array('d', dst.tobytes())
+        if isinstance(values, np.ndarray):
+            return dst
+        if isinstance(values, tuple):
+            return tuple(dst.tolist())
+        return dst.tolist()
+    if isinstance(out, array.array):
+        dst = np.frombuffer(out, dtype=out.typecode)
+    else:
+        dst = out
+    if isinstance(dst, np.ndarray) and dst.dtype == np.float64:
+        # in place, no temporary array
+        np_convert(src, dst)
+    else:
+        result = np.empty(src.shape)
+        np_convert(src, result)
+        dst[:] = result.tolist() if isinstance(dst, list) else result
+    return out
+
+
+def _np_f_to_c(src, dst):
+    np = _numpy()
+    np.subtract(src, 32.0, out=dst)
+    np.divide(dst, 1.8, out=dst)
+
+
+def _np_c_to_f(src, dst):
+    np = _numpy()
+    np.multiply(src, 1.8, out=dst)
+    np.add(dst, 32.0, out=dst)
+
+
+def f_to_c(deg_f, out=None):
+    """ utility to convert degrees fahrenheit to celsius.
+        Also converts, element-wise:
+            numpy arrays, into a new array or into out.
+            lists and tuples, into a new list or tuple, or into out.
+            array.array, into a new array.array('d'), or into out.
+        out may be a numpy array, an array.array or a list, and may be
+        deg_f itself, converting in place. It is written without an
+        intermediate copy if it holds doubles. """
+    if type(deg_f) is float and out is None:
+        # the common case, first
+        return (deg_f - 32.0)/1.8
+    if out is None and not isinstance(deg_f, _SEQUENCES):
+        return (deg_f - 32.0)/1.8
+    return _bulk(deg_f, out, _np_f_to_c, lambda v: (v - 32.0)/1.8)
+
+
+def c_to_f(deg_c, out=None):
+    """ utility to convert degrees celsius to fahrenheit.
+        Converts arrays and sequences as f_to_c(). """
+    if type(deg_c) is float and out is None:
+        return deg_c * 1.8 + 32.0
+    if out is None and not isinstance(deg_c, _SEQUENCES):
+        return deg_c * 1.8 + 32.0
+    return _bulk(deg_c, out, _np_c_to_f, lambda v: v * 1.8 + 32.0)
+
+
+def format_temp(value):
+    """ value rounded to 0.1 degree, as a string: the same string as
+        "%s" % round(value, 1), in about half the time for a float. """
+    if isinstance(value, float) and -_FORMAT_LIMIT < value < _FORMAT_LIMIT:
+        return '%.1f' % value
+    # integers, which have no decimals, NaN, infinities, and the
+    # exponent notation of huge values
+    return "%s" % round(value, 1)
+
+
+def format_temps(values):
+    """ format_temp() of every value in a sequence or array, as a list.
+        Formats them all with a single string operation when it can. """
+    np = _numpy()
+    if np is not None and isinstance(values, np.ndarray):
+        in_range = (values.dtype.kind == 'f' and
+                    bool((np.abs(values) < _FORMAT_LIMIT).all()))
+        values = values.tolist()
+    else:
+        values = list(values)
+        in_range = all(
+            isinstance(v, float) and -_FORMAT_LIMIT < v < _FORMAT_LIMIT
+            for v in values)
+    if not values:
+        return []
+    if not in_range:
+        return [format_temp(v) for v in values]
+    return (('%.1f\n' * len(values)) % tuple(values))[:-1].split('\n')
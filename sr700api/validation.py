@@ -0,0 +1,131 @@
+"""
+validation.py
+
+Request argument validation for the REST servers. A Schema is built once,
+at import time, for each resource, and checks a mapping of request
+arguments with precomputed bounds and sets, instead of constructing a
+reqparse parser on every request. Error bodies are the ones reqparse
+produces, so clients see no difference.
+"""
+"""
+MIT License
+
+Copyright (c) 2017 int3ll3ct.ly@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import copy
+
+
+class ValidationError(Exception):
+    """ Raised by Schema.parse(). body is the 400 response body. """
+    def __init__(self, body):
+        Exception.__init__(self, body)
+        self.body = body
+
+
+def boolean(value):
+    """ argument type accepting JSON booleans, and true/false, yes/no,
+        on/off or 1/0 strings. """
+    if isinstance(value, bool):
+        return value
+    value = str(value).lower()
+    if value in ('true', 'yes', 'on', '1'):
+        return True
+    if value in ('false', 'no', 'off', '0'):
+        return False
+    raise ValueError("boolean - not a boolean: %s" % value)
+
+
+class Argument(object):
+    """ A single request argument, declared like a reqparse argument.
+        choices may be a range with a step of 1, checked as a pair of
+        bounds, or any other collection, checked as a set. bounds is an
+        inclusive (low, high) pair, for non-integer types. """
+    __slots__ = ('name', 'type', 'low', 'high', 'choices', 'required',
+                 'default', 'help', 'error')
+
+    def __init__(self, name, type=str, choices=None, required=False,
+                 default=None, help=None, bounds=None):
+        self.name = name
+        self.type = type
+        self.low = self.high = self.choices = None
+        if bounds is not None:
+            self.low, self.high = bounds
+        elif isinstance(choices, range) and choices.step == 1:
+            self.low, self.high = choices.start, choices.stop - 1
+        elif choices is not None:
+            self.choices = frozenset(choices)
+        self.required = required
+        self.default = default
+        self.help = help
+        # the body reqparse answers with on any problem with this argument
+        self.error = {'message': {name: help}}
+
+    def optional(self):
+        """ a copy of this argument that may be left out. """
+        arg = copy.copy(self)
+        arg.required = False
+        return arg
+
+
+class Schema(object):
+    """ The arguments accepted by a resource method. """
+    def __init__(self, *arguments, **kwargs):
+        """ Args:
+                arguments - Argument instances
+                strict - reject arguments not declared, as
+                         reqparse's parse_args(strict=True) """
+        self.arguments = arguments
+        self.strict = kwargs.get('strict', False)
+        self._names = frozenset(a.name for a in arguments)
+
+    def parse(self, source):
+        """ Converts and checks arguments.
+            Args:
+                source - mapping of the supplied argument values
+            Returns:
+                dict with a value for every declared argument, the
+                default for those not supplied.
+            Raises:
+                ValidationError """
+        args = {}
+        for arg in self.arguments:
+            value = source.get(arg.name)
+            if value is None:
+                if arg.required:
+                    raise ValidationError(arg.error)
+                args[arg.name] = arg.default
+                continue
+            try:
+                value = arg.type(value)
+            except (TypeError, ValueError):
+                raise ValidationError(arg.error)
+            if arg.low is not None:
+                if not arg.low <= value <= arg.high:
+                    raise ValidationError(arg.error)
+            elif arg.choices is not None and value not in arg.choices:
+                raise ValidationError(arg.error)
+            args[arg.name] = value
+        if self.strict:
+            unknown = [k for k in source if k not in self._names]
+            if unknown:
+                raise ValidationError(
+                    {'message': 'Unknown arguments: ' + ', '.join(unknown)})
+        return args